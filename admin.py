@@ -1,72 +1,324 @@
+import json
+import sqlite3
 from flask import Blueprint, render_template, request, jsonify
-from db_utils import DBHelper
+from db_utils import MACHINE_SORTS, DBHelper, record_machine_changes, refresh_machine_attributes
+from themes import compile_theme
+from http_cache import PRIVATE_POLICY, cache_policy, versioned_json
 
 admin_bp = Blueprint('admin', __name__, template_folder='templates/admin')
 db = DBHelper()  # Initialize DBHelper
 
+# Most operations one POST to /admin/machines/bulk may carry
+MAX_BULK_OPERATIONS = 500
+
+MACHINE_ACTIONS = ('add', 'update', 'delete', 'activate')
+
+# Page size of the admin machine list: default and largest allowed
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+ACTIVE_FILTERS = {'': None, 'all': None, 'true': True, '1': True, 'false': False, '0': False}
+
+def machine_page_args(args):
+    """DBHelper.page_machines arguments from the query string of GET /admin/machines"""
+    offset = args.get('offset', 0, type=int)
+    limit = args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    if offset < 0 or not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"offset must be >= 0 and limit between 1 and {MAX_PAGE_SIZE}")
+    active = args.get('active', '').lower()
+    if active not in ACTIVE_FILTERS:
+        raise ValueError("active must be true, false or all")
+    sort = args.get('sort', 'name')
+    if sort.lstrip('-') not in MACHINE_SORTS:
+        raise ValueError(f"sort must be one of {', '.join(MACHINE_SORTS)}, optionally prefixed with -")
+    return {
+        'offset': offset,
+        'limit': limit,
+        'sort': sort.lstrip('-'),
+        'descending': sort.startswith('-'),
+        'active': ACTIVE_FILTERS[active],
+        'manufacturer': args.get('manufacturer', '').strip() or None,
+        'tags': tuple(tag.strip() for tag in args.getlist('tag') if tag.strip()),
+        'query': args.get('q', '').strip(),
+    }
+
+# Write jobs for the machine admin; each runs on the shared writer (db.write)
+def _machine_id(operation, machine_ids):
+    try:
+        machine_id = int(operation.get('id'))
+    except (TypeError, ValueError):
+        raise ValueError("operation needs a numeric machine id")
+    if machine_id not in machine_ids:
+        raise ValueError(f"no machine with id {machine_id}")
+    return machine_id
+
+def _machine_name(operation):
+    name = operation.get('name')
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError("machine name must be a non-empty string")
+    return name.strip()
+
+def _tag_ids(cursor, tag_ids, tags):
+    """Ids of the named tags, creating new ones; tag_ids is the batch's name -> id map"""
+    if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+        raise ValueError("tags must be a list of strings")
+    ids = []
+    for tag in dict.fromkeys(tag.strip() for tag in tags if tag.strip()):
+        if tag not in tag_ids:
+            cursor.execute("INSERT INTO tags (name) VALUES (?)", (tag,))
+            tag_ids[tag] = cursor.lastrowid
+        ids.append(tag_ids[tag])
+    return ids
+
+def _set_tags(cursor, tag_ids, machine_id, tags):
+    cursor.execute("DELETE FROM machine_tags WHERE machine_id = ?", (machine_id,))
+    cursor.executemany("INSERT INTO machine_tags (machine_id, tag_id) VALUES (?, ?)",
+                       [(machine_id, tag_id) for tag_id in _tag_ids(cursor, tag_ids, tags)])
+
+def add_machine(cursor, tag_ids, machine_ids, operation):
+    name = _machine_name(operation)
+    cursor.execute("INSERT INTO machines (name, active) VALUES (?, ?)",
+                   (name, bool(operation.get('active', True))))
+    machine_id = cursor.lastrowid
+    _set_tags(cursor, tag_ids, machine_id, operation.get('tags', []))
+    machine_ids.add(machine_id)
+    return machine_id
+
+def update_machine(cursor, tag_ids, machine_ids, operation):
+    # Only the fields present in the operation change
+    machine_id = _machine_id(operation, machine_ids)
+    if 'name' in operation:
+        cursor.execute("UPDATE machines SET name = ? WHERE id = ?", (_machine_name(operation), machine_id))
+    if 'active' in operation:
+        cursor.execute("UPDATE machines SET active = ? WHERE id = ?", (bool(operation['active']), machine_id))
+    if 'tags' in operation:
+        _set_tags(cursor, tag_ids, machine_id, operation['tags'])
+    return machine_id
+
+def _delete_machines(cursor, machine_ids):
+    # First delete machine_tags entries, then the machines
+    rows = [(machine_id,) for machine_id in machine_ids]
+    cursor.executemany("DELETE FROM machine_tags WHERE machine_id = ?", rows)
+    cursor.executemany("DELETE FROM machines WHERE id = ?", rows)
+
+def _set_active(cursor, changes):
+    cursor.executemany("UPDATE machines SET active = ? WHERE id = ?",
+                       [(active, machine_id) for machine_id, active in changes])
+
+def apply_machine_operations(cursor, operations):
+    """
+    Apply a list of machine operations in one transaction and return one result
+    per operation, in order:
+
+        {"action": "add", "name": ..., "tags": [...], "active": true}
+        {"action": "update", "id": ..., "name"?, "tags"?, "active"?}
+        {"action": "delete", "id": ...}
+        {"action": "activate", "id": ..., "active": false}
+
+    Tag and machine ids are looked up once per batch and kept in memory, and
+    runs of deletes or activate toggles go to the database as one executemany.
+    An add or update that fails (e.g. a duplicate name) is rolled back on its
+    own and reported as {"status": "error", "message": ...}; the rest still apply.
+    Every applied operation is appended to the machine change log.
+    """
+    tag_ids = dict(cursor.execute("SELECT name, id FROM tags").fetchall())
+    machine_ids = {row[0] for row in cursor.execute("SELECT id FROM machines")}
+    results = []
+    touched = []
+    changes = []
+    pending_action, pending = None, []
+
+    def flush():
+        if pending_action == 'delete':
+            _delete_machines(cursor, pending)
+        elif pending_action == 'activate':
+            _set_active(cursor, pending)
+        pending.clear()
+
+    for operation in operations:
+        action = operation.get('action') if isinstance(operation, dict) else None
+        try:
+            if action not in MACHINE_ACTIONS:
+                raise ValueError(f"unknown action {action!r}")
+            if action in ('delete', 'activate'):
+                machine_id = _machine_id(operation, machine_ids)
+                if action != pending_action:
+                    flush()
+                    pending_action = action
+                if action == 'delete':
+                    pending.append(machine_id)
+                    machine_ids.discard(machine_id)
+                else:
+                    pending.append((machine_id, bool(operation.get('active', True))))
+                results.append({"status": "success", "id": machine_id})
+                changes.append((machine_id, action == 'delete'))
+                continue
+
+            flush()
+            pending_action = None
+            known_tags = len(tag_ids)
+            cursor.execute("SAVEPOINT machine_operation")
+            try:
+                job = add_machine if action == 'add' else update_machine
+                machine_id = job(cursor, tag_ids, machine_ids, operation)
+                cursor.execute("RELEASE machine_operation")
+            except Exception:
+                cursor.execute("ROLLBACK TO machine_operation")
+                cursor.execute("RELEASE machine_operation")
+                # Forget tags created by the rolled back operation
+                for tag in list(tag_ids)[known_tags:]:
+                    del tag_ids[tag]
+                raise
+            touched.append(machine_id)
+            results.append({"status": "success", "id": machine_id})
+            changes.append((machine_id, False))
+        except (ValueError, sqlite3.IntegrityError) as e:
+            results.append({"status": "error", "message": str(e)})
+
+    flush()
+    refresh_machine_attributes(cursor, touched)
+    record_machine_changes(cursor, changes)
+    return results
+
+def add_theme(cursor, name, rules, active):
+    cursor.execute("INSERT INTO themes (name, rules, active) VALUES (?, ?, ?)",
+                (name, json.dumps(rules), active))
+    return cursor.lastrowid
+
+def update_theme(cursor, theme_id, fields):
+    """Change only the given fields (name / rules / active); returns the rows updated"""
+    if 'rules' in fields:
+        fields = {**fields, 'rules': json.dumps(fields['rules'])}
+    assignments = ', '.join(f"{column} = ?" for column in fields)
+    cursor.execute(f"UPDATE themes SET {assignments} WHERE id = ?", (*fields.values(), theme_id))
+    return cursor.rowcount
+
+def delete_theme(cursor, theme_id):
+    cursor.execute("DELETE FROM themes WHERE id = ?", (theme_id,))
+    return cursor.rowcount
+
 @admin_bp.route('/')
+@cache_policy(PRIVATE_POLICY)
 def admin_dashboard():
     """Render the admin page for managing machines."""
     return render_template('machines.html')
 
 @admin_bp.route('/machines', methods=['GET', 'POST'])
+@cache_policy(PRIVATE_POLICY)
 def manage_machines():
     """API endpoint for fetching and managing machines."""
     if request.method == 'POST':
+        # One operation, same format as an entry of /admin/machines/bulk
         data = request.json
+        result = db.write(apply_machine_operations, [data])[0]
+        if result["status"] != "success":
+            return jsonify(result), 400
+        db.invalidate_catalog()
+        if data.get('action') == 'add':
+            return jsonify(result)
+        return jsonify({"status": "success"})
+
+    # GET: One page of machines, filtered and sorted in SQL
+    try:
+        page = machine_page_args(request.args)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    # The change log version also covers edits made through other processes
+    version = (db.catalog.version, db.machine_change_version(), sorted(page.items()))
+    return versioned_json(version, lambda: db.page_machines(**page))
+
+@admin_bp.route('/machines/facets')
+@cache_policy(PRIVATE_POLICY)
+def machine_facets():
+    """Manufacturers and tags to filter the machine list by."""
+    return versioned_json(db.catalog.version, db.machine_facets)
+
+@admin_bp.route('/machines/changes')
+@cache_policy(PRIVATE_POLICY)
+def machine_changes():
+    """Machines changed or deleted since change log version ?since= (see DBHelper.machine_changes)."""
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({"status": "error", "message": "since must be a change log version"}), 400
+    return jsonify(db.machine_changes(since))
+
+@admin_bp.route('/machines/bulk', methods=['POST'])
+@cache_policy(PRIVATE_POLICY)
+def bulk_machines():
+    """Apply a list of machine operations in one transaction (see apply_machine_operations)."""
+    operations = (request.get_json(silent=True) or {}).get('operations')
+    if not isinstance(operations, list):
+        return jsonify({"status": "error", "message": "expected {\"operations\": [...]}"}), 400
+    if len(operations) > MAX_BULK_OPERATIONS:
+        return jsonify({"status": "error",
+                        "message": f"at most {MAX_BULK_OPERATIONS} operations per request"}), 400
+
+    results = db.write(apply_machine_operations, operations)
+    applied = sum(result["status"] == "success" for result in results)
+    if applied:
+        db.invalidate_catalog()
+    return jsonify({
+        "status": "success" if applied == len(results) else "error",
+        "applied": applied,
+        "results": results,
+    })
+
+@admin_bp.route('/themes', methods=['GET', 'POST'])
+@cache_policy(PRIVATE_POLICY)
+def manage_themes():
+    """API endpoint for fetching and managing declarative themes."""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
         action = data.get('action')
+        if action not in ('add', 'update', 'delete'):
+            return jsonify({"status": "error", "message": f"unknown action {action!r}"}), 400
+
+        # add needs every field; update changes only the ones it was sent
+        fields = {}
+        try:
+            if action == 'add' or 'name' in data:
+                name = data.get('name')
+                if not isinstance(name, str) or not name.strip():
+                    raise ValueError("theme name must be a non-empty string")
+                fields['name'] = name.strip()
+            if action == 'add' or 'rules' in data:
+                compile_theme(data.get('rules'))
+                fields['rules'] = data.get('rules')
+            if action == 'add' or 'active' in data:
+                fields['active'] = bool(data.get('active', True))
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+
+        try:
+            if action == 'add':
+                theme_id = db.write(add_theme, fields['name'], fields['rules'], fields['active'])
+            elif action == 'update':
+                theme_id = data.get('id')
+                if not fields:
+                    return jsonify({"status": "error", "message": "nothing to update"}), 400
+                if not db.write(update_theme, theme_id, fields):
+                    return jsonify({"status": "error", "message": f"no theme with id {theme_id}"}), 404
+            else:
+                theme_id = data.get('id')
+                if not db.write(delete_theme, theme_id):
+                    return jsonify({"status": "error", "message": f"no theme with id {theme_id}"}), 404
+        except sqlite3.IntegrityError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        db.versions.notify('themes')
 
         if action == 'add':
-            name = data.get('name')
-            tags = data.get('tags', [])
-            active = data.get('active', True)
-            with db.get_connection() as conn:
-                # Insert machine and get its ID
-                cursor = conn.cursor()
-                cursor.execute("INSERT INTO machines (name, active) VALUES (?, ?)", (name, active))
-                machine_id = cursor.lastrowid
-                
-                # Handle tags
-                for tag in tags:
-                    cursor.execute("INSERT OR IGNORE INTO tags (name) VALUES (?)", (tag,))
-                    tag_id = cursor.execute("SELECT id FROM tags WHERE name = ?", (tag,)).fetchone()[0]
-                    cursor.execute("INSERT INTO machine_tags (machine_id, tag_id) VALUES (?, ?)", 
-                                (machine_id, tag_id))
-                conn.commit()
-                return jsonify({"status": "success", "id": machine_id})
-                
-        elif action == 'update':
-            machine_id = data.get('id')
-            name = data.get('name')
-            active = data.get('active')
-            tags = data.get('tags', [])
-            
-            with db.get_connection() as conn:
-                cursor = conn.cursor()
-                # Update machine info
-                cursor.execute("UPDATE machines SET name = ?, active = ? WHERE id = ?", 
-                            (name, active, machine_id))
-                
-                # Update tags
-                cursor.execute("DELETE FROM machine_tags WHERE machine_id = ?", (machine_id,))
-                for tag in tags:
-                    cursor.execute("INSERT OR IGNORE INTO tags (name) VALUES (?)", (tag,))
-                    tag_id = cursor.execute("SELECT id FROM tags WHERE name = ?", (tag,)).fetchone()[0]
-                    cursor.execute("INSERT INTO machine_tags (machine_id, tag_id) VALUES (?, ?)", 
-                                (machine_id, tag_id))
-                conn.commit()
-                
-        elif action == 'delete':
-            machine_id = data.get('id')
-            with db.get_connection() as conn:
-                # First delete machine_tags entries
-                conn.execute("DELETE FROM machine_tags WHERE machine_id = ?", (machine_id,))
-                # Then delete the machine
-                conn.execute("DELETE FROM machines WHERE id = ?", (machine_id,))
-                conn.commit()
-                
+            return jsonify({"status": "success", "id": theme_id})
         return jsonify({"status": "success"})
 
-    # GET: Fetch all machines and their tags
-    machines = db.load_all_machines()
-    return jsonify(machines)
+    # GET: All themes with how many active machines each one currently matches
+    def build():
+        themes = db.load_themes(include_inactive=True)
+        for theme in themes:
+            try:
+                theme['machine_count'] = len(db.theme_machine_ids(theme['rules']))
+            except ValueError as e:
+                # Saved before its rules were validated this strictly; shown so it can be fixed
+                theme['machine_count'] = 0
+                theme['error'] = str(e)
+        return themes
+    return versioned_json((db.catalog.version, db.versions.get('themes')), build)
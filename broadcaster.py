@@ -0,0 +1,105 @@
+# broadcaster.py
+
+"""
+One place that sends live updates to browsers.
+
+Writers (web routes and the bot thread) publish change notifications instead
+of emitting directly. Notifications for the same topic (event + room) are
+collected and coalesced by key: a later item for a key replaces, or is merged
+into, the pending one. A single background task flushes every topic at most
+once per interval, so a burst of battles turns into one event per topic carrying
+a list of changes:
+
+    broadcaster = Broadcaster(emit, start_task, sleep, window=0.5, max_rate=2)
+    broadcaster.start()  # once, at server startup
+    broadcaster.publish('leaderboard_update', 'leaderboard:all_time', entry, key=entry['player'])
+
+The flush task is started by start() on the server's own thread, never by a
+publisher: publishers include the bot's asyncio thread, which must not spawn
+tasks of the Socket.IO async mode (e.g. eventlet greenlets).
+
+The interval is the coalescing window, stretched if needed so that no topic is
+emitted more than max_rate times per second. Counters of notifications received
+and events emitted are kept per event name (see stats()).
+"""
+
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+class Broadcaster:
+    def __init__(self, emit: Callable, start_task: Callable, sleep: Callable,
+                 window: float = 0.5, max_rate: float = 2.0):
+        """
+        emit(event, items, room) sends one event; start_task(fn) runs fn in the
+        background and sleep(seconds) pauses it (socketio.start_background_task
+        and socketio.sleep, so this works under any Socket.IO async mode).
+        """
+        self._emit = emit
+        self._start_task = start_task
+        self._sleep = sleep
+        self.interval = max(window, 1.0 / max_rate)
+        # (event, room) -> key -> item, in the order topics and keys first arrived
+        self._pending: Dict[Tuple[str, str], OrderedDict] = OrderedDict()
+        self._lock = threading.Lock()
+        self._started = False
+        self.received: Counter = Counter()
+        self.emitted: Counter = Counter()
+        self.last_flush: Optional[float] = None
+
+    def publish(self, event: str, room: str, item, key=None,
+                merge: Optional[Callable] = None, reset: bool = False):
+        """
+        Queue `item` for the next flush of (event, room).
+
+        key: items with the same key are coalesced (default: never coalesced)
+        merge: merge(pending, new) -> item to keep; by default the new item wins
+        reset: drop everything pending for the topic first (e.g. a table was cleared)
+        """
+        with self._lock:
+            self.received[event] += 1
+            items = self._pending.setdefault((event, room), OrderedDict())
+            if reset:
+                items.clear()
+            if key is None:
+                key = ('unkeyed', self.received[event])
+            if merge is not None and key in items:
+                item = merge(items[key], item)
+            items[key] = item
+
+    def start(self):
+        """Start the flush task; call once from the server's thread before serving"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self._start_task(self._run)
+
+    def flush(self):
+        """Emit everything pending now, one event per topic"""
+        with self._lock:
+            pending, self._pending = self._pending, OrderedDict()
+        for (event, room), items in pending.items():
+            self._emit(event, list(items.values()), room)
+            self.emitted[event] += 1
+        self.last_flush = time.time()
+
+    def _run(self):
+        while True:
+            self._sleep(self.interval)
+            if self._pending:
+                try:
+                    self.flush()
+                except Exception as e:
+                    # Keep broadcasting; one failed emit only loses that batch
+                    print(f"Error broadcasting live updates: {e}")
+
+    def stats(self) -> Dict:
+        return {
+            "interval": self.interval,
+            "received": dict(self.received),
+            "emitted": dict(self.emitted),
+            "pending_topics": len(self._pending),
+            "last_flush": self.last_flush,
+        }
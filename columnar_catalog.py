@@ -0,0 +1,294 @@
+# columnar_catalog.py
+
+"""
+Columnar, memory-mapped copy of the active machine catalog, used to filter
+machines by theme and attribute rules.
+
+Scanning the catalog's machine dicts for every rule is slow, so export_catalog
+writes the active machines to one compact file next to the database:
+
+    header      magic, catalog version, row / string / tag counts
+    ints        one int32 array per INT_COLUMNS entry (NULL_INT when unknown)
+    texts       one uint32 array per TEXT_COLUMNS entry, indexes into the strings
+    tag names   uint32 indexes into the strings, one per tag
+    strings     uint32 offsets + UTF-8 blob, every distinct text stored once
+    tag bitmap  per machine, one bit per tag
+
+Workers map the file read-only (CatalogColumns). It is an extra copy used for
+filtering only: each process still keeps its own MachineCatalog snapshot of
+full machine dicts for lookups, so it does not reduce per-worker memory. The
+header carries the catalog version, which comes from the database and so means
+the same in every process: CatalogFile maps whatever file is there and rewrites
+it atomically only when its version differs from the catalog the caller has.
+
+Filtering takes the same rules as themes.py and evaluates them column-wise:
+with NumPy one vectorized mask per rule, otherwise a plain Python fallback.
+Results match the SQL that themes.compile_theme produces.
+"""
+
+import mmap
+import operator
+import os
+import struct
+import threading
+from array import array
+from typing import Dict, List, Optional
+
+from themes import normalize_theme
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; filtering falls back to plain Python
+    np = None
+
+# 02: the header version is the database's 'machines' data version
+MAGIC = b'GBCOLS02'
+HEADER = struct.Struct('<8sQIIII')  # magic, catalog version, rows, strings, tags, tag bytes per row
+
+NULL_INT = -2 ** 31
+
+INT_COLUMNS = (
+    'id', 'release_year', 'release_count_num', 'in_production', 'value_low', 'value_high',
+    'players', 'flippers', 'ramps', 'multiball'
+)
+# Together these cover every field of themes.THEME_FIELDS
+TEXT_COLUMNS = (
+    'name', 'manufacturer', 'type', 'generation', 'display_type', 'display_kind',
+    'cabinet', 'release_count'
+)
+
+# Numbers the theme fields read as 0 when missing (see themes.THEME_FIELDS);
+# the other int columns stay NULL. Missing text is always stored as ''.
+ZERO_DEFAULT_COLUMNS = ('in_production', 'players', 'flippers', 'ramps', 'multiball')
+
+OPS = {
+    'eq': operator.eq, 'ne': operator.ne, 'lt': operator.lt,
+    'le': operator.le, 'gt': operator.gt, 'ge': operator.ge,
+}
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+def _int_value(machine, column) -> int:
+    value = machine.get(column)
+    if value is None:
+        return 0 if column in ZERO_DEFAULT_COLUMNS else NULL_INT
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return NULL_INT
+
+def _sort_key(value):
+    # SQLite orders numbers before text and never converts between them here
+    return (1, value) if isinstance(value, str) else (0, value)
+
+def _compare(value, op, operand) -> bool:
+    """`value op operand` with SQLite semantics; NULL (None) never matches"""
+    if value is None:
+        return False
+    if op == 'contains':
+        return operand in str(value)
+    if op == 'between':
+        return _compare(value, 'ge', operand[0]) and _compare(value, 'le', operand[1])
+    return OPS[op](_sort_key(value), _sort_key(operand))
+
+
+def export_catalog(snapshot, path: str):
+    """Write the active machines of a catalog snapshot to `path`, replacing it atomically"""
+    machines = snapshot.active
+    rows = len(machines)
+
+    strings: Dict[str, int] = {}
+    def intern(text) -> int:
+        return strings.setdefault('' if text is None else str(text), len(strings))
+
+    ints = array('i', (_int_value(machine, column) for column in INT_COLUMNS for machine in machines))
+    texts = array('I', (intern(machine.get(column)) for column in TEXT_COLUMNS for machine in machines))
+
+    tag_names = sorted({tag for machine in machines for tag in machine['tags']})
+    tag_ids = array('I', (intern(tag) for tag in tag_names))
+    tag_bits = {tag: bit for bit, tag in enumerate(tag_names)}
+    row_bytes = (len(tag_names) + 7) // 8
+    bitmap = bytearray(rows * row_bytes)
+    for row, machine in enumerate(machines):
+        for tag in machine['tags']:
+            bit = tag_bits[tag]
+            bitmap[row * row_bytes + (bit >> 3)] |= 1 << (bit & 7)
+
+    blob = bytearray()
+    offsets = array('I', [0])
+    for text in strings:  # insertion order == string id
+        blob += text.encode('utf-8')
+        offsets.append(len(blob))
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, snapshot.version, rows, len(strings), len(tag_names), row_bytes))
+        for section in (ints, texts, tag_ids, offsets, blob, bitmap):
+            f.write(b'\0' * (_align(f.tell()) - f.tell()))
+            f.write(section)
+    os.replace(tmp_path, path)
+
+
+class CatalogColumns:
+    """Read-only, memory-mapped view of a file written by export_catalog"""
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self._identity = self._file_identity(os.fstat(f.fileno()))
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.version, self.rows, string_count, tag_count, self._row_bytes = \
+            HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a machine catalog file")
+
+        offset = HEADER.size
+        def section(typecode, count):
+            nonlocal offset
+            offset = _align(offset)
+            start = offset
+            offset += count * array(typecode).itemsize
+            view = memoryview(self._mmap)[start:offset]
+            return view.cast(typecode) if typecode != 'B' else view
+
+        ints = section('i', len(INT_COLUMNS) * self.rows)
+        texts = section('I', len(TEXT_COLUMNS) * self.rows)
+        tag_ids = section('I', tag_count)
+        self._offsets = section('I', string_count + 1)
+        self._blob = section('B', self._offsets[-1] if string_count else 0)
+        bitmap = section('B', self.rows * self._row_bytes)
+
+        self._columns = {}
+        for index, column in enumerate(INT_COLUMNS):
+            self._columns[column] = ints[index * self.rows:(index + 1) * self.rows]
+        for index, column in enumerate(TEXT_COLUMNS):
+            self._columns[column] = texts[index * self.rows:(index + 1) * self.rows]
+        if np is not None:
+            self._columns = {column: np.asarray(view) for column, view in self._columns.items()}
+            bitmap = np.asarray(bitmap).reshape(self.rows, self._row_bytes)
+        self._bitmap = bitmap
+
+        self._strings: Dict[int, str] = {}
+        self._tag_bits = {self.string(string_id): bit for bit, string_id in enumerate(tag_ids)}
+
+    @staticmethod
+    def _file_identity(stat):
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def is_current(self, path: str) -> bool:
+        """False once the file at `path` has been replaced by a newer export"""
+        try:
+            return self._file_identity(os.stat(path)) == self._identity
+        except FileNotFoundError:
+            return False
+
+    def string(self, string_id: int) -> str:
+        text = self._strings.get(string_id)
+        if text is None:
+            start, end = self._offsets[string_id], self._offsets[string_id + 1]
+            text = self._strings[string_id] = bytes(self._blob[start:end]).decode('utf-8')
+        return text
+
+    def column(self, name: str):
+        """Raw column: a NumPy array when available, otherwise a memoryview"""
+        return self._columns[name]
+
+    @property
+    def ids(self) -> List[int]:
+        return [int(machine_id) for machine_id in self._columns['id']]
+
+    def _isin(self, column, wanted):
+        if np is not None:
+            return np.isin(column, list(wanted))
+        return [value in wanted for value in column]
+
+    def _all_rows(self, value: bool):
+        if np is not None:
+            return np.full(self.rows, value)
+        return [value] * self.rows
+
+    def _and(self, mask, other):
+        if mask is None:
+            return other
+        if np is not None:
+            return mask & other
+        return [a and b for a, b in zip(mask, other)]
+
+    def _tag_mask(self, tag: str):
+        bit = self._tag_bits.get(tag)
+        if bit is None:
+            return self._all_rows(False)
+        byte, flag = bit >> 3, 1 << (bit & 7)
+        if np is not None:
+            return (self._bitmap[:, byte] & flag) != 0
+        return [bool(self._bitmap[row * self._row_bytes + byte] & flag) for row in range(self.rows)]
+
+    def _field_mask(self, field: str, op: str, operand):
+        # Evaluate the rule once per distinct value, then select matching rows
+        column = self._columns[field]
+        if field in TEXT_COLUMNS:
+            wanted = {string_id for string_id in set(column.tolist())
+                      if _compare(self.string(string_id), op, operand)}
+        else:
+            wanted = {value for value in set(column.tolist())
+                      if _compare(None if value == NULL_INT else value, op, operand)}
+        return self._isin(column, wanted)
+
+    def _rule_mask(self, rule: Dict):
+        if 'tags_any' in rule:
+            mask = self._all_rows(False)
+            for tag in set(rule['tags_any']):
+                other = self._tag_mask(tag)
+                mask = mask | other if np is not None else [a or b for a, b in zip(mask, other)]
+            return mask
+        if 'tags_all' in rule:
+            mask = None
+            for tag in set(rule['tags_all']):
+                mask = self._and(mask, self._tag_mask(tag))
+            return mask
+        return self._field_mask(rule['field'], rule['op'], rule['value'])
+
+    def select(self, rules: List[Dict]) -> List[int]:
+        """
+        Ids of the machines matching every rule (themes.py rule format).
+        Raises ValueError for malformed rules, like compile_theme.
+        """
+        rules = normalize_theme(rules)
+        mask = None
+        for rule in rules:
+            mask = self._and(mask, self._rule_mask(rule))
+        ids = self._columns['id']
+        if np is not None:
+            return ids[mask].tolist()
+        return [ids[row] for row in range(self.rows) if mask[row]]
+
+
+class CatalogFile:
+    """
+    This process's handle on the shared catalog file: remaps it when another
+    process replaced it and re-exports it when it is not the snapshot's version.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._columns: Optional[CatalogColumns] = None
+        self._lock = threading.Lock()
+
+    def _open(self) -> Optional[CatalogColumns]:
+        try:
+            return CatalogColumns(self.path)
+        except (OSError, ValueError, struct.error):
+            # Missing, or written by an older version of this module
+            return None
+
+    def columns(self, snapshot) -> CatalogColumns:
+        with self._lock:
+            if self._columns is None or not self._columns.is_current(self.path):
+                # The old mapping is released once no caller holds its columns
+                self._columns = self._open()
+            # Versions only move forward, but a replaced database starts over:
+            # any mismatch means the file does not hold this catalog
+            if self._columns is None or self._columns.version != snapshot.version:
+                export_catalog(snapshot, self.path)
+                self._columns = CatalogColumns(self.path)
+            return self._columns
+
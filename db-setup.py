@@ -1,6 +1,13 @@
+import argparse
 import sqlite3
 import json
+import re
+import time
 from datetime import datetime
+from db_utils import (
+    MACHINE_ATTRIBUTE_COLUMNS, apply_migrations, machine_attributes, natural_battle_key,
+    rebuild_player_aggregates
+)
 
 def create_tables(cursor):
     # Create machines table
@@ -103,173 +110,288 @@ def create_tables(cursor):
         )
     ''')
 
-def load_json_data():
-    # Load machines
-    with open('json/machines.json', 'r') as f:
-        machines_data = json.load(f)
-    
-    # Load player stats
-    with open('json/player_stats.json', 'r') as f:
-        players_data = json.load(f)
-    
-    # Load battle history
-    with open('json/battle_history.json', 'r') as f:
-        battles_data = json.load(f)
-    
-    # Load monthly contest
-    with open('json/monthly_contest.json', 'r') as f:
-        monthly_data = json.load(f)
-    
-    return machines_data, players_data, battles_data, monthly_data
+MACHINE_COLUMNS = (
+    'pinside_id', 'manufacturer', 'release_date', 'type', 'generation',
+    'release_count', 'estimated_value', 'cabinet', 'display_type', 'players',
+    'flippers', 'ramps', 'multiball', 'ipdb', 'latest_software'
+)
+
+# Whitespace and commas between the elements of a JSON array
+ARRAY_SEPARATOR = re.compile(r'[\s,]*')
+
+# Largest number of bound parameters used in one IN (...) lookup
+LOOKUP_BATCH = 900
+
+def iter_json_records(path, read_size=1 << 16):
+    """
+    Stream records from a file holding either one JSON array or one JSON object
+    per line (NDJSON), without loading the whole file into memory.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r') as f:
+        first = f.read(1)
+        while first.isspace():
+            first = f.read(1)
+        if first != '[':
+            # NDJSON: one record per line
+            f.seek(0)
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        # JSON array: decode one element at a time from a rolling buffer
+        buffer = ''
+        position = 0
+        while True:
+            position = ARRAY_SEPARATOR.match(buffer, position).end()
+            if buffer.startswith(']', position):
+                return
+            try:
+                record, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                chunk = f.read(read_size)
+                if not chunk:
+                    raise
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            yield record
+
+def iter_chunks(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def lookup_ids(cursor, table, names):
+    """Map name -> id for the given names of `table` (players or machines)"""
+    names = list(names)
+    ids = {}
+    for start in range(0, len(names), LOOKUP_BATCH):
+        batch = names[start:start + LOOKUP_BATCH]
+        cursor.execute(
+            f'SELECT name, id FROM {table} WHERE name IN ({",".join("?" * len(batch))})', batch
+        )
+        ids.update(cursor.fetchall())
+    return ids
+
+def machine_row(machine, active):
+    """Insert values for (name, active, *MACHINE_COLUMNS, *MACHINE_ATTRIBUTE_COLUMNS)"""
+    details = machine.get('details', {})
+    attributes = machine_attributes(
+        details.get('release_date'), details.get('release_count'),
+        details.get('estimated_value'), details.get('display_type')
+    )
+    return (machine['name'], active) + tuple(details.get(column) for column in MACHINE_COLUMNS) + attributes
+
+def upsert_machines(cursor, machines, update_existing=True):
+    """
+    Insert machines keyed by name. Existing machines get their details
+    refreshed (unless update_existing is False) but keep their active flag,
+    which belongs to the admin page. Tags are only ever added.
+    """
+    all_columns = MACHINE_COLUMNS + MACHINE_ATTRIBUTE_COLUMNS
+    columns = ', '.join(all_columns)
+    placeholders = ', '.join('?' * (len(all_columns) + 2))
+    if update_existing:
+        on_conflict = 'DO UPDATE SET ' + ', '.join(f'{column} = excluded.{column}' for column in all_columns)
+    else:
+        on_conflict = 'DO NOTHING'
+    cursor.executemany(f'''
+        INSERT INTO machines (name, active, {columns})
+        VALUES ({placeholders})
+        ON CONFLICT (name) {on_conflict}
+    ''', [machine_row(machine, machine.get('active', True)) for machine in machines])
+
+    all_tags = {tag for machine in machines for tag in machine.get('tags', [])}
+    cursor.executemany('INSERT OR IGNORE INTO tags (name) VALUES (?)', [(tag,) for tag in all_tags])
+    tag_lookup = lookup_ids(cursor, 'tags', all_tags)
+    machine_lookup = lookup_ids(cursor, 'machines', {machine['name'] for machine in machines})
+    cursor.executemany('INSERT OR IGNORE INTO machine_tags (machine_id, tag_id) VALUES (?, ?)', [
+        (machine_lookup[machine['name']], tag_lookup[tag])
+        for machine in machines
+        for tag in machine.get('tags', [])
+    ])
+    return machine_lookup
 
 def populate_machines(cursor, machines_data):
-    # First, collect all unique tags
-    all_tags = set()
-    for machine in machines_data['machines']:
-        all_tags.update(machine['tags'])
-    
-    # Insert tags
-    for tag in all_tags:
-        cursor.execute('INSERT OR IGNORE INTO tags (name) VALUES (?)', (tag,))
-    
-    # Create a tag lookup dictionary
-    cursor.execute('SELECT id, name FROM tags')
-    tag_lookup = {name: tag_id for tag_id, name in cursor.fetchall()}
-    
-    # Insert machines and their tags
-    for machine in machines_data['machines']:
-        details = machine['details']
-        cursor.execute('''
-            INSERT INTO machines (
-                name, active, pinside_id, manufacturer, release_date,
-                type, generation, release_count, estimated_value,
-                cabinet, display_type, players, flippers, ramps,
-                multiball, ipdb, latest_software
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            machine['name'], machine['active'],
-            details.get('pinside_id'), details.get('manufacturer'),
-            details.get('release_date'), details.get('type'),
-            details.get('generation'), details.get('release_count'),
-            details.get('estimated_value'), details.get('cabinet'),
-            details.get('display_type'), details.get('players'),
-            details.get('flippers'), details.get('ramps'),
-            details.get('multiball'), details.get('ipdb'),
-            details.get('latest_software')
-        ))
-        
-        machine_id = cursor.lastrowid
-        
-        # Insert machine tags
-        for tag in machine['tags']:
-            cursor.execute('''
-                INSERT INTO machine_tags (machine_id, tag_id)
-                VALUES (?, ?)
-            ''', (machine_id, tag_lookup[tag]))
+    upsert_machines(cursor, machines_data['machines'])
+    return len(machines_data['machines'])
+
+def upsert_players(cursor, names):
+    cursor.executemany('''
+        INSERT INTO players (name, wins, losses) VALUES (?, 0, 0)
+        ON CONFLICT (name) DO NOTHING
+    ''', [(name,) for name in names])
+    return lookup_ids(cursor, 'players', names)
 
 def populate_players(cursor, players_data):
-    for name, stats in players_data.items():
-        try:
-            cursor.execute('''
-                INSERT INTO players (name, custom_name, wins, losses)
-                VALUES (?, ?, ?, ?)
-            ''', (
-                name,
-                stats.get('custom_name'),
-                stats.get('wins', 0),
-                stats.get('losses', 0)
-            ))
-        except sqlite3.IntegrityError:
-            print(f"Player {name} already exists. Skipping.")
-
-def populate_battles(cursor, battles_data):
-    # Create player name to ID lookup
-    cursor.execute('SELECT id, name FROM players')
-    player_lookup = {name: player_id for player_id, name in cursor.fetchall()}
-    
-    # Create machine name to ID lookup
-    cursor.execute('SELECT id, name FROM machines')
-    machine_lookup = {name: machine_id for machine_id, name in cursor.fetchall()}
-    
-    for battle in battles_data:
-        cursor.execute('''
-            INSERT INTO battles (winner_id, loser_id, battle_time)
-            VALUES (?, ?, ?)
-        ''', (
-            player_lookup[battle['winner']],
-            player_lookup[battle['loser']],
-            battle['time']
-        ))
-        
-        battle_id = cursor.lastrowid
-        
-        # Insert battle machines
-        for position, machine in enumerate(battle['machines']):
-            cursor.execute('''
-                INSERT INTO battle_machines (battle_id, machine_id, position)
-                VALUES (?, ?, ?)
-            ''', (
-                battle_id,
-                machine_lookup[machine['name']],
-                position
-            ))
-
-def populate_monthly_contest(cursor, monthly_data, machines_data):
-    # Create machine name to ID lookup if not exists
-    cursor.execute('SELECT id, name FROM machines')
-    machine_lookup = {name: machine_id for machine_id, name in cursor.fetchall()}
-    
-    cursor.execute('''
-        INSERT INTO monthly_contests (month, machine_id)
-        VALUES (?, ?)
-    ''', (
-        monthly_data['month'],
-        machine_lookup[monthly_data['machine_of_the_month']]
-    ))
-    
-    contest_id = cursor.lastrowid
-    
-    # Create player name to ID lookup
-    cursor.execute('SELECT id, name FROM players')
-    player_lookup = {name: player_id for player_id, name in cursor.fetchall()}
-    
-    for score_entry in monthly_data.get('scores', []):
-        cursor.execute('''
-            INSERT INTO monthly_scores (contest_id, player_id, score)
+    cursor.executemany('''
+        INSERT INTO players (name, custom_name, wins, losses)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (name) DO UPDATE SET custom_name = COALESCE(players.custom_name, excluded.custom_name)
+    ''', [
+        (name, stats.get('custom_name'), stats.get('wins', 0), stats.get('losses', 0))
+        for name, stats in players_data.items()
+    ])
+    return len(players_data)
+
+def populate_battles(cursor, battle_records, chunk_size, label):
+    """
+    Import battles chunk by chunk. Battles are keyed by their natural key
+    (winner, loser, time), so importing the same archive twice adds nothing.
+    Machines a battle mentions that are not in our catalog are added as inactive.
+    """
+    cursor.execute('SELECT name, id FROM players')
+    player_lookup = dict(cursor.fetchall())
+    cursor.execute('SELECT name, id FROM machines')
+    machine_lookup = dict(cursor.fetchall())
+
+    started = time.perf_counter()
+    read = inserted = 0
+    for chunk in iter_chunks(battle_records, chunk_size):
+        new_players = {name for battle in chunk for name in (battle['winner'], battle['loser'])} - player_lookup.keys()
+        if new_players:
+            player_lookup.update(upsert_players(cursor, new_players))
+
+        new_machines = {}
+        for battle in chunk:
+            for machine in battle['machines']:
+                if machine['name'] not in machine_lookup:
+                    new_machines[machine['name']] = dict(machine, active=False)
+        if new_machines:
+            machine_lookup.update(upsert_machines(cursor, list(new_machines.values()), update_existing=False))
+
+        keys = [natural_battle_key(battle['winner'], battle['loser'], battle['time']) for battle in chunk]
+        # Battles that get an id above this one are the ones this chunk inserted
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM battles')
+        last_id = cursor.fetchone()[0]
+        cursor.executemany('''
+            INSERT INTO battles (battle_key, winner_id, loser_id, battle_time)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (battle_key) DO NOTHING
+        ''', [
+            (key, player_lookup[battle['winner']], player_lookup[battle['loser']], battle['time'])
+            for key, battle in zip(keys, chunk)
+        ])
+        # rowcount leaves out the rows changed by triggers (data_versions)
+        inserted += cursor.rowcount
+
+        battle_ids = {}
+        for start in range(0, len(keys), LOOKUP_BATCH):
+            batch = keys[start:start + LOOKUP_BATCH]
+            cursor.execute(
+                f'SELECT battle_key, id FROM battles WHERE battle_key IN ({",".join("?" * len(batch))})', batch
+            )
+            battle_ids.update(cursor.fetchall())
+
+        # Only link machines to the battles just inserted, and only from the first
+        # copy of each: a battle the database already had keeps its machines
+        battle_machines = []
+        linked = set()
+        for key, battle in zip(keys, chunk):
+            battle_id = battle_ids[key]
+            if battle_id <= last_id or battle_id in linked:
+                continue
+            linked.add(battle_id)
+            battle_machines.extend(
+                (battle_id, machine_lookup[machine['name']], position)
+                for position, machine in enumerate(battle['machines'], 1)
+            )
+        cursor.executemany('''
+            INSERT OR IGNORE INTO battle_machines (battle_id, machine_id, position)
             VALUES (?, ?, ?)
-        ''', (
-            contest_id,
-            player_lookup[score_entry['player']],
-            score_entry['score']
-        ))
+        ''', battle_machines)
+
+        read += len(chunk)
+        elapsed = time.perf_counter() - started
+        print(f"{label}: {read:,} battles read, {inserted:,} new ({read / elapsed:,.0f} battles/s)")
+
+    return inserted
+
+def populate_monthly_contest(cursor, monthly_data):
+    cursor.execute('SELECT id FROM machines WHERE name = ?', (monthly_data['machine_of_the_month'],))
+    machine_id = cursor.fetchone()[0]
+
+    cursor.execute('SELECT id FROM monthly_contests WHERE month = ? AND machine_id = ?',
+                   (monthly_data['month'], machine_id))
+    contest_row = cursor.fetchone()
+    if contest_row:
+        contest_id = contest_row[0]
+    else:
+        cursor.execute('INSERT INTO monthly_contests (month, machine_id) VALUES (?, ?)',
+                       (monthly_data['month'], machine_id))
+        contest_id = cursor.lastrowid
+
+    scores = monthly_data.get('scores', [])
+    player_lookup = upsert_players(cursor, {entry['player'] for entry in scores})
+    # Keep the best score per player if the contest already has one
+    cursor.executemany('''
+        INSERT INTO monthly_scores (contest_id, player_id, score)
+        VALUES (?, ?, ?)
+        ON CONFLICT (contest_id, player_id) DO UPDATE SET score = max(score, excluded.score)
+    ''', [(contest_id, player_lookup[entry['player']], entry['score']) for entry in scores])
+    return len(scores)
 
 def main():
+    parser = argparse.ArgumentParser(description='Create goblin_battle.db and import (or merge) JSON data into it.')
+    parser.add_argument('--db', default='goblin_battle.db', help='database file to create or update')
+    parser.add_argument('--battles', nargs='*', default=['json/battle_history.json'],
+                        help='battle history files to merge (JSON array or NDJSON)')
+    parser.add_argument('--chunk-size', type=int, default=5000, help='battles per executemany batch')
+    parser.add_argument('--battles-only', action='store_true',
+                        help='only merge battle history, skip machines, players and the monthly contest')
+    args = parser.parse_args()
+
     # Connect to SQLite database (creates it if it doesn't exist)
-    conn = sqlite3.connect('goblin_battle.db')
+    conn = sqlite3.connect(args.db)
+    conn.isolation_level = None  # transactions are managed explicitly
     cursor = conn.cursor()
-    
+    started = time.perf_counter()
+
     try:
-        # Create all tables
+        # Create all tables and bring them to the latest schema version, so the
+        # natural-key unique indexes the upserts rely on exist
         create_tables(cursor)
-        
-        # Load JSON data
-        machines_data, players_data, battles_data, monthly_data = load_json_data()
-        
-        # Populate tables
-        populate_machines(cursor, machines_data)
-        populate_players(cursor, players_data)
-        populate_battles(cursor, battles_data)
-        populate_monthly_contest(cursor, monthly_data, machines_data)
-        
-        # Commit changes
-        conn.commit()
-        print("Database successfully created and populated!")
-        
+        apply_migrations(conn)
+
+        # Check foreign keys once at commit instead of per row
+        cursor.execute('PRAGMA foreign_keys = ON')
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('PRAGMA defer_foreign_keys = ON')
+
+        if not args.battles_only:
+            with open('json/machines.json', 'r') as f:
+                print(f"machines: {populate_machines(cursor, json.load(f)):,} upserted")
+            with open('json/player_stats.json', 'r') as f:
+                print(f"players: {populate_players(cursor, json.load(f)):,} upserted")
+
+        inserted = 0
+        for path in args.battles:
+            inserted += populate_battles(cursor, iter_json_records(path), args.chunk_size, path)
+
+        if not args.battles_only:
+            with open('json/monthly_contest.json', 'r') as f:
+                print(f"monthly scores: {populate_monthly_contest(cursor, json.load(f)):,} upserted")
+
+        # Recount player wins/losses in one pass over battles
+        rebuild_player_aggregates(cursor)
+
+        cursor.execute('COMMIT')
+        print(f"Database successfully created and populated! "
+              f"{inserted:,} new battles in {time.perf_counter() - started:.1f}s")
+
     except Exception as e:
         print(f"An error occurred: {e}")
-        conn.rollback()
+        if conn.in_transaction:
+            cursor.execute('ROLLBACK')
     finally:
         conn.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,32 +1,914 @@
+import asyncio
+import functools
+import json
 import sqlite3
 import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
 from typing import List, Dict, Optional, Tuple
+from flask import g, has_app_context
+from themes import compile_theme
+from columnar_catalog import CatalogColumns, CatalogFile
+from machine_sampler import MachineSampler
+
+class ConnectionManager:
+    """
+    Hands out long-lived, pre-tuned SQLite connections for one database file.
+
+    Threads outside of a Flask request (the Discord bot, scripts) keep a single
+    connection for their whole lifetime. Flask requests borrow a connection from
+    a small idle pool, keep it in `g` so every query of the request shares it,
+    and hand it back on app context teardown.
+    """
+    PRAGMAS = (
+        "PRAGMA journal_mode = WAL",
+        "PRAGMA synchronous = NORMAL",
+        "PRAGMA mmap_size = 268435456",   # 256 MB
+        "PRAGMA cache_size = -16000",     # ~16 MB of page cache
+    )
+
+    def __init__(self, db_path: str, busy_timeout: float = 5.0,
+                 cached_statements: int = 256, max_idle: int = 8):
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self.max_idle = max_idle
+        self._local = threading.local()
+        self._idle: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def open_connection(self) -> sqlite3.Connection:
+        # check_same_thread is off because pooled connections move between
+        # request threads; each one is only ever used by one thread at a time
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout,
+            cached_statements=self.cached_statements,
+            check_same_thread=False
+        )
+        for pragma in self.PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """Return the connection bound to the current request or thread"""
+        if has_app_context():
+            request_conns = g.setdefault('_db_connections', {})
+            conn = request_conns.get(self.db_path)
+            if conn is None:
+                conn = self._checkout()
+                request_conns[self.db_path] = conn
+            return conn
+
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self.open_connection()
+            self._local.conn = conn
+        return conn
+
+    def _checkout(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self.open_connection()
+
+    def checkin(self, conn: sqlite3.Connection):
+        """Return a request connection to the idle pool"""
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close_thread_connection(self):
+        """Close the connection held by the calling (non-request) thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+# One manager per database file, shared by every DBHelper pointing at it
+_managers: Dict[str, ConnectionManager] = {}
+_managers_lock = threading.Lock()
+
+def get_connection_manager(db_path: str) -> ConnectionManager:
+    with _managers_lock:
+        manager = _managers.get(db_path)
+        if manager is None:
+            manager = ConnectionManager(db_path)
+            _managers[db_path] = manager
+        return manager
+
+def release_request_connections(exception=None):
+    """Flask teardown hook: hand every connection borrowed by this request back"""
+    request_conns = g.pop('_db_connections', None) or {}
+    for db_path, conn in request_conns.items():
+        _managers[db_path].checkin(conn)
+
+# --- Single writer -----------------------------------------------------------
+
+class WriteQueue:
+    """
+    The only writer for one database file.
+
+    Write jobs are callables that take a cursor (plus their own arguments) and
+    must not commit. A dedicated thread drains every job queued so far, runs
+    each one inside its own savepoint of a single transaction and commits the
+    whole batch at once, so a burst of writes costs one commit and one fsync.
+    Each job's Future is resolved with its return value or exception; a job
+    that raises only rolls back its own savepoint.
+    """
+    def __init__(self, connections: ConnectionManager, max_batch: int = 256):
+        self._connections = connections
+        self.max_batch = max_batch
+        self._queue: "queue.Queue[Tuple]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        # Counters for monitoring how well writes are being grouped
+        self.jobs_written = 0
+        self.commits = 0
+
+    def submit(self, job, *args, **kwargs) -> Future:
+        """Queue a write job and return a Future for its result"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((job, args, kwargs, future))
+        return future
+
+    def run(self, job, *args, **kwargs):
+        """Queue a write job and block until it is committed"""
+        return self.submit(job, *args, **kwargs).result()
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='goblin-db-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        conn = self._connections.open_connection()
+        # Transactions are managed explicitly below
+        conn.isolation_level = None
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write_batch(conn, batch)
+
+    def _write_batch(self, conn: sqlite3.Connection, batch: List[Tuple]):
+        outcomes = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            cursor = conn.cursor()
+            for job, args, kwargs, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                cursor.execute('SAVEPOINT write_job')
+                try:
+                    result = job(cursor, *args, **kwargs)
+                except Exception as e:
+                    cursor.execute('ROLLBACK TO write_job')
+                    cursor.execute('RELEASE write_job')
+                    outcomes.append((future, None, e))
+                else:
+                    cursor.execute('RELEASE write_job')
+                    outcomes.append((future, result, None))
+            conn.execute('COMMIT')
+        except Exception as e:
+            # The batch as a whole failed (lock timeout, disk error...): nothing was written
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            print(f"Write batch of {len(batch)} jobs failed: {e}")
+            for _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.commits += 1
+        self.jobs_written += len(outcomes)
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+# One writer per database file, shared by every DBHelper pointing at it
+_writers: Dict[str, WriteQueue] = {}
+
+def get_write_queue(db_path: str) -> WriteQueue:
+    connections = get_connection_manager(db_path)
+    with _managers_lock:
+        writer = _writers.get(db_path)
+        if writer is None:
+            writer = WriteQueue(connections)
+            _writers[db_path] = writer
+        return writer
+
+
+# Period key for the all-time rows of player_aggregates; monthly rows use 'YYYY-MM'
+ALL_TIME_PERIOD = 'all'
+
+CREATE_PLAYER_AGGREGATES_SQL = '''
+    CREATE TABLE IF NOT EXISTS player_aggregates (
+        player_id INTEGER NOT NULL,
+        period VARCHAR(7) NOT NULL,
+        wins INTEGER NOT NULL DEFAULT 0,
+        losses INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (player_id, period),
+        FOREIGN KEY (player_id) REFERENCES players(id)
+    )
+'''
+
+# Wins/losses per player for all time and for every month, computed in a
+# single scan of battles (each battle fans out to the four rows it affects)
+PLAYER_AGGREGATES_FROM_BATTLES_SQL = '''
+    WITH sides(is_win, monthly) AS (VALUES (1, 0), (0, 0), (1, 1), (0, 1))
+    SELECT
+        CASE WHEN s.is_win THEN b.winner_id ELSE b.loser_id END AS player_id,
+        CASE WHEN s.monthly THEN substr(b.battle_time, 1, 7) ELSE 'all' END AS period,
+        SUM(s.is_win) AS wins,
+        SUM(1 - s.is_win) AS losses
+    FROM battles b
+    CROSS JOIN sides s
+    GROUP BY 1, 2
+'''
+
+def rebuild_player_aggregates(cursor):
+    """Recompute player_aggregates from the battles table"""
+    cursor.execute('DELETE FROM player_aggregates')
+    cursor.execute(f'''
+        INSERT INTO player_aggregates (player_id, period, wins, losses)
+        {PLAYER_AGGREGATES_FROM_BATTLES_SQL}
+    ''')
+
+def natural_battle_key(winner: str, loser: str, battle_time: str) -> str:
+    """battle_key for battles that have no Battle.battle_id (legacy rows and imports)"""
+    return f"{winner}|{loser}|{battle_time}"
+
+def record_player_aggregates(cursor, winner_id: int, loser_id: int, battle_time: str):
+    """Count one battle in the all-time and monthly aggregate rows of both players"""
+    month = battle_time[:7]
+    rows = [
+        (winner_id, ALL_TIME_PERIOD, 1, 0),
+        (winner_id, month, 1, 0),
+        (loser_id, ALL_TIME_PERIOD, 0, 1),
+        (loser_id, month, 0, 1),
+    ]
+    cursor.executemany('''
+        INSERT INTO player_aggregates (player_id, period, wins, losses)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (player_id, period) DO UPDATE SET
+            wins = wins + excluded.wins,
+            losses = losses + excluded.losses
+    ''', rows)
+
+
+# --- Typed machine attributes ------------------------------------------------
+# Pinside details are free text ("March 1993", "In production", "$9,340 - $10,860").
+# They are parsed once when a machine is written and kept in typed columns so
+# themes and other readers can compare (and index) them directly.
+
+MACHINE_ATTRIBUTE_COLUMNS = (
+    'release_year', 'release_count_num', 'in_production', 'value_low', 'value_high', 'display_kind'
+)
+
+# Display types as Pinside spells them -> one name per kind of display
+DISPLAY_KINDS = {
+    'lcd': 'LCD',
+    'lcd display': 'LCD',
+    'dot matrix': 'Dot Matrix',
+    'alphanumeric': 'Alphanumeric',
+    'digital': 'Digital',
+    'mechanical reels': 'Mechanical Reels',
+    'tv screen': 'TV Screen',
+}
+
+# Sort keys of the admin machine list (DBHelper.page_machines); ties go by name
+MACHINE_SORTS = {
+    'name': 'm.name',
+    'manufacturer': 'm.manufacturer',
+    'release_year': 'm.release_year',
+    'added': 'm.id',
+}
+
+# Change log entries kept for admin pages catching up (DBHelper.machine_changes)
+MACHINE_CHANGE_LOG_SIZE = 10000
+
+YEAR_PATTERN = re.compile(r'(\d{4})\s*$')
+DOLLAR_PATTERN = re.compile(r'\$\s*([\d,]+)')
+
+def machine_attributes(release_date, release_count, estimated_value, display_type) -> Tuple:
+    """
+    Parse a machine's text details into the values of MACHINE_ATTRIBUTE_COLUMNS.
+    Anything that cannot be parsed ("Unknown", missing) becomes None.
+    """
+    release_date, release_count, estimated_value, display_type = (
+        '' if value is None else str(value)
+        for value in (release_date, release_count, estimated_value, display_type)
+    )
+    year = YEAR_PATTERN.search(release_date)
+    release_year = int(year.group(1)) if year else None
+
+    count = release_count.replace(',', '').strip()
+    release_count_num = int(count) if count.isdigit() else None
+    in_production = count.lower() == 'in production'
+
+    values = [int(value.replace(',', '')) for value in DOLLAR_PATTERN.findall(estimated_value)]
+    value_low = min(values) if values else None
+    value_high = max(values) if values else None
+
+    display = ' '.join(display_type.split())
+    display_kind = DISPLAY_KINDS.get(display.lower(), display.title()) if display else None
+
+    return release_year, release_count_num, in_production, value_low, value_high, display_kind
+
+def _admin_machine_rows(cursor, clauses: str, params) -> List[Dict]:
+    """The admin list's machine rows selected by `clauses` (WHERE / ORDER BY / LIMIT), with tags"""
+    cursor.execute(f'''
+        SELECT m.id, m.name, m.active, m.manufacturer, m.release_year
+        FROM machines m
+        {clauses}
+    ''', params)
+    machines = [
+        {'id': machine_id, 'name': name, 'active': bool(is_active),
+         'manufacturer': maker, 'release_year': year, 'tags': []}
+        for machine_id, name, is_active, maker, year in cursor.fetchall()
+    ]
+
+    by_id = {machine['id']: machine for machine in machines}
+    if by_id:
+        cursor.execute(f'''
+            SELECT mt.machine_id, t.name FROM machine_tags mt
+            JOIN tags t ON t.id = mt.tag_id
+            WHERE mt.machine_id IN ({",".join("?" * len(by_id))})
+            ORDER BY t.name
+        ''', list(by_id))
+        for machine_id, tag in cursor.fetchall():
+            by_id[machine_id]['tags'].append(tag)
+    return machines
+
+def machine_change_version(cursor) -> int:
+    """Latest version of the machine change log (0 before the first change)"""
+    row = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'machine_changes'").fetchone()
+    return row[0] if row else 0
+
+def record_machine_changes(cursor, changes):
+    """
+    Append (machine id, deleted) pairs to the machine change log, one new
+    version each, and drop entries beyond the last MACHINE_CHANGE_LOG_SIZE.
+    Call from the write job that made the changes, so both commit together.
+    """
+    changes = list(changes)
+    if not changes:
+        return
+    cursor.executemany('INSERT INTO machine_changes (machine_id, deleted) VALUES (?, ?)', changes)
+    cursor.execute('DELETE FROM machine_changes WHERE version <= ?',
+                   (machine_change_version(cursor) - MACHINE_CHANGE_LOG_SIZE,))
+
+def refresh_machine_attributes(cursor, machine_ids=None):
+    """Recompute the typed attribute columns of the given machines (default: all)"""
+    query = 'SELECT id, release_date, release_count, estimated_value, display_type FROM machines'
+    if machine_ids is None:
+        rows = cursor.execute(query).fetchall()
+    else:
+        machine_ids = list(machine_ids)
+        rows = []
+        for start in range(0, len(machine_ids), 500):
+            chunk = machine_ids[start:start + 500]
+            rows += cursor.execute(f'{query} WHERE id IN ({",".join("?" * len(chunk))})', chunk).fetchall()
+
+    assignments = ', '.join(f'{column} = ?' for column in MACHINE_ATTRIBUTE_COLUMNS)
+    cursor.executemany(
+        f'UPDATE machines SET {assignments} WHERE id = ?',
+        [machine_attributes(*row[1:]) + (row[0],) for row in rows]
+    )
+
+
+# --- Schema migrations -------------------------------------------------------
+# db-setup.py creates the base schema (version 0). Each function below moves a
+# database up one version; PRAGMA user_version records how many have been
+# applied. Only ever append to MIGRATIONS, never reorder or edit applied steps.
+
+def _add_player_aggregates(cursor):
+    cursor.execute(CREATE_PLAYER_AGGREGATES_SQL)
+    rebuild_player_aggregates(cursor)
+
+def _add_hot_path_indexes(cursor):
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_battles_winner_id ON battles (winner_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_battles_loser_id ON battles (loser_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_battles_battle_time ON battles (battle_time, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_battle_machines_machine_id ON battle_machines (machine_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_monthly_scores_contest_player ON monthly_scores (contest_id, player_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_monthly_contests_month ON monthly_contests (month)')
+
+def _add_battle_keys(cursor):
+    # Battle.battle_id of the resolved battle; legacy rows keep NULL
+    cursor.execute('ALTER TABLE battles ADD COLUMN battle_key VARCHAR(32)')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_battles_battle_key ON battles (battle_key)')
+
+def _add_natural_keys(cursor):
+    # Give legacy battles their natural key and make machine names unique so
+    # imports can upsert by name and by battle key
+    cursor.execute('''
+        UPDATE OR IGNORE battles
+        SET battle_key = (SELECT name FROM players WHERE id = battles.winner_id)
+            || '|' || (SELECT name FROM players WHERE id = battles.loser_id)
+            || '|' || battle_time
+        WHERE battle_key IS NULL
+    ''')
+
+    # Older db-setup.py runs imported the machines again on every run: merge
+    # each name into its lowest id before the name can be unique
+    cursor.execute('''
+        CREATE TEMP TABLE machine_merges AS
+        SELECT m.id AS old_id, keep.id AS new_id
+        FROM machines m
+        JOIN (SELECT name, MIN(id) AS id FROM machines GROUP BY name) keep ON keep.name = m.name
+        WHERE m.id != keep.id
+    ''')
+    cursor.execute('''
+        INSERT OR IGNORE INTO machine_tags (machine_id, tag_id)
+        SELECT mm.new_id, mt.tag_id
+        FROM machine_tags mt JOIN machine_merges mm ON mm.old_id = mt.machine_id
+    ''')
+    cursor.execute('''
+        INSERT OR IGNORE INTO battle_machines (battle_id, machine_id, position)
+        SELECT bm.battle_id, mm.new_id, bm.position
+        FROM battle_machines bm JOIN machine_merges mm ON mm.old_id = bm.machine_id
+    ''')
+    cursor.execute('''
+        UPDATE monthly_contests
+        SET machine_id = (SELECT new_id FROM machine_merges WHERE old_id = monthly_contests.machine_id)
+        WHERE machine_id IN (SELECT old_id FROM machine_merges)
+    ''')
+    for table, column in (('machine_tags', 'machine_id'), ('battle_machines', 'machine_id'), ('machines', 'id')):
+        cursor.execute(f'DELETE FROM {table} WHERE {column} IN (SELECT old_id FROM machine_merges)')
+    cursor.execute('DROP TABLE machine_merges')
+
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_machines_name ON machines (name)')
+
+def _add_unique_monthly_scores(cursor):
+    # Keep each player's best score per contest, then enforce one row per player
+    cursor.execute('''
+        DELETE FROM monthly_scores
+        WHERE id NOT IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY contest_id, player_id ORDER BY score DESC, id
+                ) AS score_rank
+                FROM monthly_scores
+            )
+            WHERE score_rank = 1
+        )
+    ''')
+    cursor.execute('DROP INDEX IF EXISTS idx_monthly_scores_contest_player')
+    cursor.execute('CREATE UNIQUE INDEX idx_monthly_scores_contest_player ON monthly_scores (contest_id, player_id)')
+
+def _add_machine_search(cursor):
+    # Full-text index over machine name, manufacturer, generation and tags
+    # (rowid = machine id), kept in sync by triggers on machines and machine_tags
+    cursor.execute('''
+        CREATE VIRTUAL TABLE machines_fts USING fts5(
+            name, manufacturer, generation, tags,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    ''')
+    def tags_of(machine_id):
+        return f'''(
+            SELECT GROUP_CONCAT(t.name, ' ') FROM machine_tags mt
+            JOIN tags t ON mt.tag_id = t.id WHERE mt.machine_id = {machine_id}
+        )'''
+
+    cursor.execute(f'''
+        INSERT INTO machines_fts (rowid, name, manufacturer, generation, tags)
+        SELECT id, name, manufacturer, generation, {tags_of('machines.id')} FROM machines
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER machines_fts_insert AFTER INSERT ON machines BEGIN
+            INSERT INTO machines_fts (rowid, name, manufacturer, generation, tags)
+            VALUES (new.id, new.name, new.manufacturer, new.generation, '');
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER machines_fts_update AFTER UPDATE ON machines BEGIN
+            DELETE FROM machines_fts WHERE rowid = old.id;
+            INSERT INTO machines_fts (rowid, name, manufacturer, generation, tags)
+            VALUES (new.id, new.name, new.manufacturer, new.generation, {tags_of('new.id')});
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER machines_fts_delete AFTER DELETE ON machines BEGIN
+            DELETE FROM machines_fts WHERE rowid = old.id;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER machine_tags_fts_insert AFTER INSERT ON machine_tags BEGIN
+            UPDATE machines_fts SET tags = {tags_of('new.machine_id')} WHERE rowid = new.machine_id;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER machine_tags_fts_delete AFTER DELETE ON machine_tags BEGIN
+            UPDATE machines_fts SET tags = {tags_of('old.machine_id')} WHERE rowid = old.machine_id;
+        END
+    ''')
+
+# themes.THEMES when _add_themes was written. Frozen here, so that editing
+# themes.py later does not change what this migration does on new databases.
+SEED_THEMES = [
+    ("70s Battle", [{"field": "release_year", "op": "between", "value": [1970, 1979]}]),
+    ("Games with No Ramps", [{"field": "ramps", "op": "eq", "value": 0}]),
+    ("80s Classics", [{"field": "release_year", "op": "between", "value": [1980, 1989]}]),
+    ("90s Favorites", [{"field": "release_year", "op": "between", "value": [1990, 1999]}]),
+    ("Zero Multiball Madness", [{"field": "multiball", "op": "eq", "value": 0}]),
+    ("Six-Ball Mayhem (Multiball = 6)", [{"field": "multiball", "op": "eq", "value": 6}]),
+    ("Dot Matrix Heroes", [{"field": "display_type", "op": "eq", "value": "Dot Matrix"}]),
+    ("LCD Display Crew", [{"field": "display_type", "op": "contains", "value": "LCD"}]),
+    ("Music & Rock", [{"tags_any": ["music", "rock"]}]),
+    ("Horror & Monsters", [{"tags_any": ["horror", "monsters"]}]),
+    ("Treasure & Adventure", [{"tags_any": ["adventure"]}]),
+    ("Fantasy Realms", [{"tags_any": ["fantasy"]}]),
+    ("Movie Licensed", [{"tags_all": ["movie", "licensed"]}]),
+    ("Motor Sports", [{"tags_any": ["racing"]}]),
+    ("Solid State Throwbacks", [{"field": "type", "op": "eq", "value": "Solid state"}, {"field": "release_year", "op": "lt", "value": 2000}]),
+    ("EM Nostalgia", [{"field": "type", "op": "eq", "value": "Electro-mechanical"}]),
+    ("Futuristic Sci-Fi", [{"tags_any": ["sci-fi"]}]),
+    ("Four-Flipper Frenzy", [{"field": "flippers", "op": "eq", "value": 4}]),
+    ("Ramps Galore (3 or More)", [{"field": "ramps", "op": "ge", "value": 3}]),
+    ("Alphanumeric Retro", [{"field": "display_type", "op": "eq", "value": "Alphanumeric"}]),
+    ("Three-Flipper Club", [{"field": "flippers", "op": "eq", "value": 3}]),
+    ("Active Sci-Fi Adventures", [{"tags_any": ["sci-fi"]}]),
+    ("Food Frenzy", [{"tags_any": ["food", "BBQ", "festival"]}]),
+    ("Outdoor Sports", [{"tags_any": ["outdoor", "sports"]}]),
+    ("Bally Originals", [{"field": "manufacturer", "op": "contains", "value": "Bally"}]),
+    ("American Pinball All-Stars", [{"field": "manufacturer", "op": "eq", "value": "American Pinball"}]),
+    ("Gottlieb Gems", [{"field": "manufacturer", "op": "contains", "value": "Gottlieb"}]),
+    ("Williams System 11 Showcase", [{"field": "generation", "op": "contains", "value": "Williams System 11"}]),
+    ("TV Series Ties", [{"tags_any": ["television"]}]),
+    ("Small Release Runs (\u2264 500 units)", [{"field": "release_count_num", "op": "le", "value": 500}]),
+    ("Digital Old-School (Display = \"Digital\")", [{"field": "display_type", "op": "eq", "value": "Digital"}]),
+    ("Mechanical Reels Throwback", [{"field": "display_type", "op": "eq", "value": "Mechanical Reels"}]),
+    ("5-Ball (or More) Multiball", [{"field": "multiball", "op": "ge", "value": 5}]),
+    ("Sky High Adventures", [{"tags_any": ["aviation", "skydiving", "hang gliding"]}]),
+    ("Space Explorers", [{"tags_any": ["space"]}]),
+    ("Flipper Overload (4 or More)", [{"field": "flippers", "op": "ge", "value": 4}]),
+    ("Movie Marathon", [{"tags_any": ["movie"]}]),
+    ("Under 2,000 Release Count", [{"field": "release_count_num", "op": "lt", "value": 2000}]),
+    ("Widebodies", [{"field": "cabinet", "op": "contains", "value": "Wide"}]),
+    ("BBQ & Brew", [{"tags_any": ["BBQ", "food", "beer", "festival"]}]),
+    ("Swords & Sorcery", [{"tags_any": ["fantasy", "Norse mythology", "mythology"]}]),
+    ("Comedy & Humor", [{"tags_any": ["comedy"]}]),
+    ("Mythology Matters", [{"tags_any": ["mythology"]}]),
+    ("Pinball Giants (Over 10,000 Made)", [{"field": "release_count_num", "op": "gt", "value": 10000}]),
+    ("Still Rolling Off the Line (In Production)", [{"field": "release_count", "op": "eq", "value": "In production"}]),
+    ("Solid State Stern", [{"field": "manufacturer", "op": "contains", "value": "Stern"}, {"field": "type", "op": "eq", "value": "Solid state"}]),
+    ("Late 90s Hits (1995\u20131999)", [{"field": "release_year", "op": "between", "value": [1995, 1999]}]),
+    ("Sports Galore", [{"tags_any": ["sports"]}]),
+    ("Less Than 3 Flippers", [{"field": "flippers", "op": "lt", "value": 3}]),
+]
+
+def _add_themes(cursor):
+    # Declarative theme definitions (see themes.py), seeded from SEED_THEMES
+    cursor.execute('''
+        CREATE TABLE themes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name VARCHAR(255) NOT NULL UNIQUE,
+            rules TEXT NOT NULL,
+            active BOOLEAN DEFAULT true
+        )
+    ''')
+    cursor.executemany(
+        'INSERT INTO themes (name, rules) VALUES (?, ?)',
+        [(name, json.dumps(rules)) for name, rules in SEED_THEMES]
+    )
+
+def _add_machine_attributes(cursor):
+    # Typed copies of the free-text machine details, see machine_attributes
+    for column, column_type in zip(MACHINE_ATTRIBUTE_COLUMNS, (
+            'INTEGER', 'INTEGER', 'BOOLEAN DEFAULT false', 'INTEGER', 'INTEGER', 'VARCHAR(50)')):
+        cursor.execute(f'ALTER TABLE machines ADD COLUMN {column} {column_type}')
+    refresh_machine_attributes(cursor)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_machines_release_year ON machines (release_year)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_machines_release_count_num ON machines (release_count_num)')
+
+def _add_machine_admin_indexes(cursor):
+    # Filters and sort orders of the paged admin machine list
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_machines_active_name ON machines (active, name)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_machines_manufacturer_name ON machines (manufacturer, name)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_machine_tags_tag_id ON machine_tags (tag_id, machine_id)')
+
+def _add_machine_changes(cursor):
+    # Change log of the machine admin; AUTOINCREMENT keeps versions increasing after pruning
+    cursor.execute('''
+        CREATE TABLE machine_changes (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            machine_id INTEGER NOT NULL,
+            deleted BOOLEAN NOT NULL DEFAULT false,
+            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _add_data_versions(cursor):
+    # Change counters bumped by triggers, so writes from any process (other
+    # workers, the bot, db-setup.py, CLI commands) invalidate every cache
+    cursor.execute('''
+        CREATE TABLE data_versions (
+            name VARCHAR(20) PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    for name, tables in (
+            # battle_machines rows are only written together with their battle
+            ('battles', ('battles', 'players', 'player_aggregates')),
+            ('monthly', ('monthly_contests', 'monthly_scores')),
+            ('machines', ('machines', 'tags', 'machine_tags')),
+            ('themes', ('themes',))):
+        cursor.execute('INSERT INTO data_versions (name) VALUES (?)', (name,))
+        for table in tables:
+            for event in ('INSERT', 'UPDATE', 'DELETE'):
+                cursor.execute(f'''
+                    CREATE TRIGGER {table}_{event.lower()}_data_version AFTER {event} ON {table} BEGIN
+                        UPDATE data_versions SET version = version + 1 WHERE name = '{name}';
+                    END
+                ''')
+
+def _add_contest_version(cursor):
+    # A counter only contest changes move; 'monthly' also moves on every score
+    cursor.execute("INSERT INTO data_versions (name) VALUES ('contests')")
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER monthly_contests_{event.lower()}_contest_version AFTER {event} ON monthly_contests BEGIN
+                UPDATE data_versions SET version = version + 1 WHERE name = 'contests';
+            END
+        ''')
+
+def _use_typed_theme_fields(cursor):
+    # Seeded themes that the typed machine attributes match better; themes an
+    # admin has edited since keep their rules
+    for name, old_rules, new_rules in (
+            ("LCD Display Crew",
+             [{"field": "display_type", "op": "contains", "value": "LCD"}],
+             [{"field": "display_kind", "op": "eq", "value": "LCD"}]),
+            ("Still Rolling Off the Line (In Production)",
+             [{"field": "release_count", "op": "eq", "value": "In production"}],
+             [{"field": "in_production", "op": "eq", "value": 1}])):
+        cursor.execute('UPDATE themes SET rules = ? WHERE name = ? AND rules = ?',
+                       (json.dumps(new_rules), name, json.dumps(old_rules)))
+
+MIGRATIONS = [
+    _add_player_aggregates,
+    _add_hot_path_indexes,
+    _add_battle_keys,
+    _add_natural_keys,
+    _add_unique_monthly_scores,
+    _add_machine_search,
+    _add_themes,
+    _add_machine_attributes,
+    _add_machine_admin_indexes,
+    _add_machine_changes,
+    _add_data_versions,
+    _add_contest_version,
+    _use_typed_theme_fields,
+]
+
+def apply_migrations(conn: sqlite3.Connection) -> int:
+    """
+    Bring the database schema up to date, one transaction per migration.
+    Safe to call from several processes at once: each step re-checks the
+    version after taking the write lock.
+
+    Returns:
+    The schema version after migrating
+    """
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    while version < len(MIGRATIONS):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version < len(MIGRATIONS):
+                migration = MIGRATIONS[version]
+                migration(conn.cursor())
+                version += 1
+                conn.execute(f'PRAGMA user_version = {version}')
+                print(f"Applied schema migration {version}: {migration.__name__.lstrip('_')}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return version
+
+
+# --- Machine catalog ---------------------------------------------------------
+
+class MachineRecord(dict):
+    """A machine row shared by every reader of the catalog, so it cannot be modified"""
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Machine records are read-only; write to the database and invalidate the catalog")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _read_only
+
+class CatalogSnapshot:
+    """Immutable view of every machine at one catalog version"""
+    def __init__(self, version: int, machines: List[Dict]):
+        self.version = version
+        self.machines = tuple(
+            MachineRecord(machine, tags=tuple(machine['tags'])) for machine in machines
+        )
+        self.by_id = {machine['id']: machine for machine in self.machines}
+        self.by_name = {machine['name']: machine for machine in self.machines}
+        self.active = tuple(machine for machine in self.machines if machine['active'])
+
+class MachineCatalog:
+    """
+    Process-wide, in-memory machine catalog.
+
+    Reads are served from the current snapshot and do not touch SQLite. Its
+    version is the database's 'machines' data version, taken from the
+    in-process copy in DataVersions: a write in this process moves it as soon
+    as invalidate_catalog() runs, a write from another process within
+    DataVersions.recheck_interval, and the next read reloads the snapshot once.
+    """
+    def __init__(self, loader, read_version):
+        self._loader = loader
+        self._read_version = read_version
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> int:
+        return self._read_version()
+
+    def snapshot(self) -> CatalogSnapshot:
+        # Read the version first: a write committed while loading is picked up next time
+        version = self._read_version()
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        with self._lock:
+            if self._snapshot is None or self._snapshot.version != version:
+                self._snapshot = CatalogSnapshot(version, self._loader())
+            return self._snapshot
+
+# One catalog per database file, shared by every DBHelper pointing at it
+_catalogs: Dict[str, MachineCatalog] = {}
+
+def get_machine_catalog(db_path: str, loader) -> MachineCatalog:
+    versions = get_data_versions(db_path)
+    with _managers_lock:
+        catalog = _catalogs.get(db_path)
+        if catalog is None:
+            catalog = MachineCatalog(loader, lambda: versions.get('machines'))
+            _catalogs[db_path] = catalog
+        return catalog
+
+_samplers: Dict[str, MachineSampler] = {}
+
+def get_machine_sampler(db_path: str) -> MachineSampler:
+    with _managers_lock:
+        return _samplers.setdefault(db_path, MachineSampler())
+
+_catalog_files: Dict[str, CatalogFile] = {}
+
+def get_catalog_file(db_path: str) -> CatalogFile:
+    """The columnar catalog file shared by every process using this database"""
+    with _managers_lock:
+        return _catalog_files.setdefault(db_path, CatalogFile(f'{db_path}.columns'))
+
+
+class DataVersions:
+    """
+    Named change counters of one database file ('battles', 'monthly',
+    'contests', 'machines', 'themes'), stored in the data_versions table. Triggers bump
+    them on every write, whichever process makes it, so caches and ETags
+    keyed on them see every change.
+
+    Reads are served from an in-process copy, so checking a version is a
+    dictionary lookup. Writers in this process call notify() after committing,
+    which reloads the copy at once. Writes from other processes are caught by
+    a recheck at most every `recheck_interval` seconds: `PRAGMA data_version`
+    on a connection of its own tells whether anyone else committed, and only
+    then are the counters read again. Listeners hear about every change seen
+    either way, so cache warmers can rebuild right away.
+    """
+    def __init__(self, connections: ConnectionManager, recheck_interval: float = 0.5):
+        self._connections = connections
+        self.recheck_interval = recheck_interval
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._data_version: Optional[int] = None
+        self._versions: Dict[str, int] = {}
+        self._checked_at: Optional[float] = None
+
+    def get(self, name: str) -> int:
+        return self.all().get(name, 0)
+
+    def all(self) -> Dict[str, int]:
+        """Every counter, as of the last check (do not modify)"""
+        self.recheck()
+        return self._versions
+
+    def recheck(self):
+        """check() unless the last check is less than recheck_interval old"""
+        checked_at = self._checked_at
+        if checked_at is None or time.monotonic() - checked_at >= self.recheck_interval:
+            self.check()
+
+    def check(self, force: bool = False):
+        """Reload the counters if another connection committed since the last check"""
+        with self._lock:
+            if self._conn is None:
+                self._conn = self._connections.open_connection()
+            data_version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+            changed = []
+            if force or data_version != self._data_version:
+                versions = dict(self._conn.execute('SELECT name, version FROM data_versions').fetchall())
+                if self._data_version is not None:
+                    changed = [(name, version) for name, version in versions.items()
+                               if self._versions.get(name) != version]
+                self._versions, self._data_version = versions, data_version
+            self._checked_at = time.monotonic()
+        for name, version in changed:
+            for listener in self._listeners:
+                listener(name, version)
+
+    def notify(self, name: str) -> int:
+        """Call after committing a write to `name`'s tables; returns its new version"""
+        self.check(force=True)
+        return self._versions.get(name, 0)
+
+    def subscribe(self, listener):
+        """Call listener(name, version) whenever a counter is seen to change, e.g. to rebuild a cache early"""
+        self._listeners.append(listener)
+
+_versions: Dict[str, DataVersions] = {}
+
+def get_data_versions(db_path: str) -> DataVersions:
+    connections = get_connection_manager(db_path)
+    with _managers_lock:
+        return _versions.setdefault(db_path, DataVersions(connections))
+
+# ((month, 'contests' version), contest row or None) per database file
+_current_contests: Dict[str, Tuple[Tuple[str, int], Optional[Tuple[int, str, int]]]] = {}
+
 
 class DBHelper:
     def __init__(self, db_path: str = 'goblin_battle.db'):
         # Ensure the path is absolute
         self.db_path = os.path.join(os.path.dirname(__file__), db_path)
+        self.connections = get_connection_manager(self.db_path)
+        self.writer = get_write_queue(self.db_path)
+        self.schema_version = apply_migrations(self.get_connection())
+        self.catalog = get_machine_catalog(self.db_path, self._query_all_machines)
+        self.versions = get_data_versions(self.db_path)
+        self.catalog_file = get_catalog_file(self.db_path)
+        self.sampler = get_machine_sampler(self.db_path)
+
+    def init_app(self, app):
+        """Return request-scoped connections to the pool when a request ends"""
+        app.teardown_appcontext(release_request_connections)
 
     def get_connection(self):
-        return sqlite3.connect(self.db_path)
+        # Connections are reused, so callers should use `with conn:` for
+        # transaction scoping and must not close them
+        return self.connections.acquire()
 
+    def write(self, job, *args, **kwargs):
+        """
+        Run a write job on the shared writer and return its result once committed.
+        `job` is called as job(cursor, *args, **kwargs) and must not commit.
+        """
+        return self.writer.run(job, *args, **kwargs)
 
-    def load_machines(self) -> List[Dict]:
-        """Load all active machines with their tags and IDs"""
+
+    def _query_all_machines(self) -> List[Dict]:
+        """Read every machine (active and inactive) with its tags, ordered by name"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT m.id, m.name, GROUP_CONCAT(t.name) as tags, m.active, m.pinside_id, m.manufacturer,
                     m.release_date, m.type, m.generation, m.release_count, m.estimated_value, 
                     m.cabinet, m.display_type, m.players, m.flippers, m.ramps, m.multiball, 
-                    m.ipdb, m.latest_software
+                    m.ipdb, m.latest_software, m.release_year, m.release_count_num, m.in_production,
+                    m.value_low, m.value_high, m.display_kind
                 FROM machines m
                 LEFT JOIN machine_tags mt ON m.id = mt.machine_id
                 LEFT JOIN tags t ON mt.tag_id = t.id
-                WHERE m.active = true
                 GROUP BY m.id
+                ORDER BY m.name ASC
             ''')
 
             columns = [desc[0] for desc in cursor.description]
@@ -37,89 +919,275 @@ class DBHelper:
                 machine_dict['tags'] = [tag.strip() for tag in machine_dict['tags'].split(',') if tag.strip()] if machine_dict['tags'] else []
                 machines.append(machine_dict)
             return machines
+
+    def load_machines(self) -> List[Dict]:
+        """Load all active machines with their tags and IDs (served from the catalog)"""
+        return list(self.catalog.snapshot().active)
         
     #Routine specfically for admin of machines    
     def load_all_machines(self) -> List[Dict]:
         """Load all machines (active and inactive) with their tags and IDs"""
+        return list(self.catalog.snapshot().machines)
+
+    def get_machine_details(self, name: str) -> Optional[Dict]:
+        """Get details for a specific active machine by name"""
+        machine = self.catalog.snapshot().by_name.get(name)
+        if machine and machine['active']:
+            return machine
+        return None
+
+    def get_machine_by_id(self, machine_id: int) -> Optional[Dict]:
+        """Get details for any machine (active or not) by id"""
+        return self.catalog.snapshot().by_id.get(machine_id)
+
+    def catalog_snapshot(self) -> CatalogSnapshot:
+        """The current immutable catalog snapshot (reloaded if the catalog changed)"""
+        return self.catalog.snapshot()
+
+    def catalog_columns(self) -> CatalogColumns:
+        """Memory-mapped columns of the active catalog, re-exported when it changed"""
+        return self.catalog_file.columns(self.catalog.snapshot())
+
+    def filter_machines(self, rules: List[Dict]) -> List[int]:
+        """Ids of the active machines matching theme-style rules, filtered column-wise"""
+        return self.catalog_columns().select(rules)
+
+    def pick_machines(self, count: int = 3, players: Tuple[str, ...] = (), avoid_recent: bool = False,
+                      candidates: Optional[List[int]] = None) -> List[Dict]:
+        """
+        Pick `count` distinct active machines, favouring the ones played least in
+        recent battles (see machine_sampler). With avoid_recent, machines either
+        player had in their last few battles are skipped while others remain.
+        `candidates` restricts the pick to those machine ids (e.g. a theme's).
+        """
+        self.sampler.sync(self.versions.get('battles'), self.load_recent_battle_machines)
+        return self.sampler.sample(self.catalog.snapshot(), count, players, avoid_recent, candidates)
+
+    def load_recent_battle_machines(self, after_id: int, limit: int) -> List[Tuple[int, str, str, List[int]]]:
+        """
+        The latest `limit` battles with an id above `after_id`, oldest first, as
+        (battle id, winner, loser, machine ids)
+        """
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                SELECT m.id, m.name, GROUP_CONCAT(t.name) as tags, m.active, m.pinside_id, m.manufacturer,
-                    m.release_date, m.type, m.generation, m.release_count, m.estimated_value, 
-                    m.cabinet, m.display_type, m.players, m.flippers, m.ramps, m.multiball, 
-                    m.ipdb, m.latest_software
-                FROM machines m
-                LEFT JOIN machine_tags mt ON m.id = mt.machine_id
-                LEFT JOIN tags t ON mt.tag_id = t.id
-                GROUP BY m.id
-                ORDER BY m.name ASC
-            ''')
+                WITH recent AS (
+                    SELECT id, winner_id, loser_id FROM battles WHERE id > ? ORDER BY id DESC LIMIT ?
+                )
+                SELECT r.id, w.name, l.name, GROUP_CONCAT(bm.machine_id)
+                FROM recent r
+                JOIN players w ON r.winner_id = w.id
+                JOIN players l ON r.loser_id = l.id
+                LEFT JOIN battle_machines bm ON bm.battle_id = r.id
+                GROUP BY r.id
+                ORDER BY r.id ASC
+            ''', (after_id, limit))
+            return [
+                (battle_id, winner, loser, [int(machine_id) for machine_id in machine_ids.split(',')] if machine_ids else [])
+                for battle_id, winner, loser, machine_ids in cursor.fetchall()
+            ]
 
-            columns = [desc[0] for desc in cursor.description]
-            machines = []
-            for row in cursor.fetchall():
-                machine_dict = dict(zip(columns, row))
-                # Split tags and remove any empty strings
-                machine_dict['tags'] = [tag.strip() for tag in machine_dict['tags'].split(',') if tag.strip()] if machine_dict['tags'] else []
-                machines.append(machine_dict)
-            return machines
+    def invalidate_catalog(self):
+        """
+        Call after committing any write to machines or machine tags. The catalog
+        reloads on its own once the data version moved; this wakes up listeners.
+        """
+        self.versions.notify('machines')
 
-    def get_machine_details(self, name: str) -> Optional[Dict]:
-        """Get details for a specific machine by name"""
-        machines = self.load_machines()
-        for machine in machines:
-            if machine['name'] == name:
-                return machine
-        return None
+    def search_machines(self, query: str, limit: int = 20) -> List[Dict]:
+        """
+        Full-text prefix search over machine name, manufacturer, generation and
+        tags, best matches first. Every word of the query must match the start of a word.
+        """
+        words = [word.replace('"', '""') for word in query.split()]
+        if not words:
+            return []
+        match = ' '.join(f'"{word}"*' for word in words)
 
-    def load_player_stats(self, time_filter: str = 'all_time') -> Dict:
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT rowid FROM machines_fts
+                WHERE machines_fts MATCH ?
+                ORDER BY rank
+                LIMIT ?
+            ''', (match, limit))
+            machine_ids = [row[0] for row in cursor.fetchall()]
+
+        snapshot = self.catalog.snapshot()
+        return [snapshot.by_id[machine_id] for machine_id in machine_ids if machine_id in snapshot.by_id]
+
+    def page_machines(self, offset: int = 0, limit: int = 50, sort: str = 'name', descending: bool = False,
+                      active: Optional[bool] = None, manufacturer: Optional[str] = None,
+                      tags: Tuple[str, ...] = (), query: str = '') -> Dict:
+        """
+        One page of the admin machine list, filtered and sorted in SQL.
+
+        active / manufacturer: exact matches when given
+        tags: the machine must have every one of them
+        query: full-text prefix search, like search_machines
+        sort: a key of MACHINE_SORTS
+
+        Returns:
+        {"total": machines matching the filters, "offset", "limit",
+         "machines": [{id, name, active, manufacturer, release_year, tags}]}
+        """
+        if sort not in MACHINE_SORTS:
+            raise ValueError(f"unknown sort {sort!r}")
+
+        conditions, params = [], []
+        if active is not None:
+            conditions.append('m.active = ?')
+            params.append(active)
+        if manufacturer:
+            conditions.append('m.manufacturer = ?')
+            params.append(manufacturer)
+        tags = list(dict.fromkeys(tags))
+        if tags:
+            conditions.append(f'''m.id IN (
+                SELECT mt.machine_id FROM machine_tags mt
+                JOIN tags t ON t.id = mt.tag_id
+                WHERE t.name IN ({",".join("?" * len(tags))})
+                GROUP BY mt.machine_id
+                HAVING COUNT(*) = ?
+            )''')
+            params += tags + [len(tags)]
+        words = [word.replace('"', '""') for word in query.split()]
+        if words:
+            conditions.append('m.id IN (SELECT rowid FROM machines_fts WHERE machines_fts MATCH ?)')
+            params.append(' '.join(f'"{word}"*' for word in words))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        direction = 'DESC' if descending else 'ASC'
+        order = f'{MACHINE_SORTS[sort]} {direction}'
+        if sort != 'name':
+            order += f', m.name {direction}'
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            # Read first: a change committed meanwhile is then sent again, never missed
+            version = machine_change_version(cursor)
+            total = cursor.execute(f'SELECT COUNT(*) FROM machines m {where}', params).fetchone()[0]
+            machines = _admin_machine_rows(cursor, f'''
+                {where}
+                ORDER BY {order}
+                LIMIT ? OFFSET ?
+            ''', params + [limit, offset])
+
+        return {'total': total, 'offset': offset, 'limit': limit, 'version': version, 'machines': machines}
+
+    def machine_change_version(self) -> int:
+        """Latest version of the machine change log, shared by every process"""
+        with self.get_connection() as conn:
+            return machine_change_version(conn.cursor())
+
+    def machine_changes(self, since: int) -> Dict:
+        """
+        Machines changed after change log version `since`, for admin pages to
+        catch up without reloading.
+
+        Returns:
+        {"version": latest version, "changed": [rows like page_machines], "deleted": [ids]},
+        or {"version": latest version, "reset": true} when `since` is older than
+        the log goes back and the client has to reload.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            version = machine_change_version(cursor)
+            if since == version:
+                return {'version': version, 'changed': [], 'deleted': []}
+            # Ahead of the log (e.g. the database was replaced) or behind what is kept
+            oldest = cursor.execute('SELECT MIN(version) FROM machine_changes').fetchone()[0]
+            if since > version or oldest is None or since < oldest - 1:
+                return {'version': version, 'reset': True}
+
+            # Only the latest change of each machine matters
+            cursor.execute('''
+                SELECT machine_id, deleted, MAX(version) FROM machine_changes
+                WHERE version > ? AND version <= ?
+                GROUP BY machine_id
+            ''', (since, version))
+            latest = cursor.fetchall()
+            deleted = [machine_id for machine_id, is_deleted, _ in latest if is_deleted]
+            changed_ids = [machine_id for machine_id, is_deleted, _ in latest if not is_deleted]
+            changed = []
+            for start in range(0, len(changed_ids), 500):
+                chunk = changed_ids[start:start + 500]
+                changed += _admin_machine_rows(cursor, f'WHERE m.id IN ({",".join("?" * len(chunk))})', chunk)
+
+        return {'version': version, 'changed': changed, 'deleted': deleted}
+
+    def machine_facets(self) -> Dict[str, List[str]]:
+        """Distinct manufacturers and tag names, for the admin list's filters"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            manufacturers = [row[0] for row in cursor.execute(
+                "SELECT DISTINCT manufacturer FROM machines WHERE manufacturer IS NOT NULL AND manufacturer != '' "
+                "ORDER BY manufacturer"
+            )]
+            tags = [row[0] for row in cursor.execute('SELECT name FROM tags ORDER BY name')]
+        return {'manufacturers': manufacturers, 'tags': tags}
+
+    def load_themes(self, include_inactive: bool = False) -> List[Dict]:
+        """Theme definitions from the themes table, with their rules parsed"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT id, name, rules, active FROM themes
+                {'' if include_inactive else 'WHERE active = true'}
+                ORDER BY name
+            ''')
+            return [
+                {'id': theme_id, 'name': name, 'rules': json.loads(rules), 'active': bool(active)}
+                for theme_id, name, rules, active in cursor.fetchall()
+            ]
+
+    def theme_machine_ids(self, rules: List[Dict]) -> List[int]:
+        """Ids of the active machines matching a theme's rules, filtered in SQL"""
+        where, params = compile_theme(rules)
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'SELECT m.id FROM machines m WHERE m.active = true AND {where}', params)
+            return [row[0] for row in cursor.fetchall()]
+
+    def load_player_stats(self, time_filter: str = 'all_time', players: Optional[List[str]] = None) -> Dict:
         """
         Load player statistics with flexible time filtering
         
         Args:
         time_filter (str): 
-        - 'all_time': Calculate stats from all battles
-        - 'current_month': Calculate stats only for the current month
+        - 'all_time': Stats from all battles
+        - 'current_month': Stats only for the current month
+        players (list): only these players (by name) instead of everyone
         
         Returns:
         Dict of player statistics
         """
+        if time_filter == 'current_month':
+            period = datetime.now().strftime("%Y-%m")
+        else:  # all_time
+            period = ALL_TIME_PERIOD
+
+        where = ''
+        params = [period]
+        if players is not None:
+            where = f'WHERE p.name IN ({", ".join("?" * len(players))})'
+            params.extend(players)
+
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            
-            # Prepare base query with time filtering
-            if time_filter == 'current_month':
-                current_month = datetime.now().strftime("%Y-%m")
-                query = '''
-                    SELECT 
-                        p.name, 
-                        p.custom_name,
-                        COUNT(CASE WHEN b.winner_id = p.id THEN 1 END) as total_wins,
-                        COUNT(CASE WHEN b.loser_id = p.id THEN 1 END) as total_losses
-                    FROM players p
-                    LEFT JOIN battles b ON (
-                        (b.winner_id = p.id OR b.loser_id = p.id) AND 
-                        strftime('%Y-%m', b.battle_time) = ?
-                    )
-                    GROUP BY p.id, p.name, p.custom_name
-                    ORDER BY total_wins DESC
-                '''
-                params = (current_month,)
-            else:  # all_time
-                query = '''
-                    SELECT 
-                        p.name, 
-                        p.custom_name,
-                        COUNT(CASE WHEN b.winner_id = p.id THEN 1 END) as total_wins,
-                        COUNT(CASE WHEN b.loser_id = p.id THEN 1 END) as total_losses
-                    FROM players p
-                    LEFT JOIN battles b ON (b.winner_id = p.id OR b.loser_id = p.id)
-                    GROUP BY p.id, p.name, p.custom_name
-                    ORDER BY total_wins DESC
-                '''
-                params = ()
-            
-            cursor.execute(query, params)
+            # Read the maintained aggregates; no battle rows are scanned here
+            cursor.execute(f'''
+                SELECT 
+                    p.name, 
+                    p.custom_name,
+                    COALESCE(a.wins, 0) as total_wins,
+                    COALESCE(a.losses, 0) as total_losses
+                FROM players p
+                LEFT JOIN player_aggregates a ON a.player_id = p.id AND a.period = ?
+                {where}
+                ORDER BY total_wins DESC
+            ''', params)
             
             stats = {}
             for row in cursor.fetchall():
@@ -133,39 +1201,115 @@ class DBHelper:
             
             return stats
 
-    def update_stats(self, winner: str, loser: str):
-        """Update player statistics after a battle"""
+    def rebuild_player_aggregates(self):
+        """Recompute every player_aggregates row from battles in one pass"""
+        self.write(rebuild_player_aggregates)
+        self.versions.notify('battles')
+
+    def verify_player_aggregates(self) -> List[Tuple]:
+        """
+        Compare player_aggregates with a fresh computation from battles.
+
+        Returns:
+        List of (player_id, period, stored wins, stored losses, expected wins, expected losses)
+        for every row that differs; empty when the aggregates are consistent
+        """
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            
-            # Ensure players exist, creating them if they don't
-            for player in [winner, loser]:
-                cursor.execute('''
-                    INSERT OR IGNORE INTO players (name, wins, losses)
-                    VALUES (?, 0, 0)
-                ''', (player,))
-            
-            # Update winner stats
-            cursor.execute('''
-                UPDATE players
-                SET wins = wins + 1
-                WHERE name = ?
-            ''', (winner,))
-            
-            # Update loser stats
-            cursor.execute('''
-                UPDATE players
-                SET losses = losses + 1
-                WHERE name = ?
-            ''', (loser,))
-            
-            conn.commit()
+            cursor.execute(f'''
+                WITH expected AS ({PLAYER_AGGREGATES_FROM_BATTLES_SQL}),
+                keys AS (
+                    SELECT player_id, period FROM expected
+                    UNION
+                    SELECT player_id, period FROM player_aggregates
+                )
+                SELECT k.player_id, k.period,
+                    COALESCE(a.wins, 0), COALESCE(a.losses, 0),
+                    COALESCE(e.wins, 0), COALESCE(e.losses, 0)
+                FROM keys k
+                LEFT JOIN player_aggregates a ON a.player_id = k.player_id AND a.period = k.period
+                LEFT JOIN expected e ON e.player_id = k.player_id AND e.period = k.period
+                WHERE COALESCE(a.wins, 0) != COALESCE(e.wins, 0)
+                    OR COALESCE(a.losses, 0) != COALESCE(e.losses, 0)
+                ORDER BY k.player_id, k.period
+            ''')
+            return cursor.fetchall()
+
+    def _load_machines_by_id(self, cursor, machine_ids) -> Dict[int, Dict]:
+        """Hydrate the given machines (with tags) using one query per chunk of ids"""
+        machines = {}
+        machine_ids = list(machine_ids)
+        # Stay well below SQLite's bound parameter limit
+        for start in range(0, len(machine_ids), 500):
+            chunk = machine_ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f'''
+                SELECT m.*, GROUP_CONCAT(t.name) as tag_names
+                FROM machines m
+                LEFT JOIN machine_tags mt ON m.id = mt.machine_id
+                LEFT JOIN tags t ON mt.tag_id = t.id
+                WHERE m.id IN ({placeholders})
+                GROUP BY m.id
+            ''', chunk)
+            columns = [d[0] for d in cursor.description]
+            for row in cursor.fetchall():
+                machine_data = dict(zip(columns, row))
+                machines[machine_data['id']] = {
+                    'id': machine_data['id'],
+                    'name': machine_data['name'],
+                    'tags': machine_data['tag_names'].split(',') if machine_data['tag_names'] else [],
+                    'active': bool(machine_data['active']),
+                    'details': {
+                        'manufacturer': machine_data['manufacturer'],
+                        'release_date': machine_data['release_date'],
+                        'type': machine_data['type'],
+                        'generation': machine_data['generation'],
+                        'release_count': machine_data['release_count'],
+                        'estimated_value': machine_data['estimated_value'],
+                        'cabinet': machine_data['cabinet'],
+                        'display_type': machine_data['display_type'],
+                        'players': machine_data['players'],
+                        'flippers': machine_data['flippers'],
+                        'ramps': machine_data['ramps'],
+                        'multiball': machine_data['multiball'],
+                        'ipdb': machine_data['ipdb'],
+                        'latest_software': machine_data['latest_software']
+                    }
+                }
+        return machines
+
+    def load_battle_history(self, limit: Optional[int] = None, before_time: Optional[str] = None,
+                            before_id: Optional[int] = None) -> List[Dict]:
+        """
+        Load battle history with machine details, newest first
+
+        Args:
+        limit (int): maximum number of battles to return (None for all)
+        before_time, before_id: keyset cursor taken from the last battle of the
+            previous page ('battle_time' and 'id'); only older battles are returned
+
+        Returns:
+        List of battle dicts
+        """
+        # Pick the page of battles first so the cost follows the page size,
+        # then join players and machines for just those rows
+        where = ''
+        params = []
+        if before_time is not None and before_id is not None:
+            where = 'WHERE battle_time < ? OR (battle_time = ? AND id < ?)'
+            params.extend([before_time, before_time, before_id])
+        params.append(limit if limit is not None else -1)
 
-    def load_battle_history(self) -> List[Dict]:
-        """Load battle history with machine details"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('''
+            cursor.execute(f'''
+                WITH page AS (
+                    SELECT id, winner_id, loser_id, battle_time
+                    FROM battles
+                    {where}
+                    ORDER BY battle_time DESC, id DESC
+                    LIMIT ?
+                )
                 SELECT 
                     b.id,
                     w.name as winner,
@@ -173,67 +1317,147 @@ class DBHelper:
                     b.battle_time,
                     GROUP_CONCAT(m.name) as machine_names,
                     GROUP_CONCAT(m.id) as machine_ids
-                FROM battles b
+                FROM page b
                 JOIN players w ON b.winner_id = w.id
                 JOIN players l ON b.loser_id = l.id
-                JOIN battle_machines bm ON b.id = bm.battle_id
-                JOIN machines m ON bm.machine_id = m.id
+                LEFT JOIN battle_machines bm ON b.id = bm.battle_id
+                LEFT JOIN machines m ON bm.machine_id = m.id
                 GROUP BY b.id
-                ORDER BY b.battle_time DESC
-            ''')
-            
+                ORDER BY b.battle_time DESC, b.id DESC
+            ''', params)
+            # Battles without machines stay on the page (machine_ids is NULL),
+            # so a page holds exactly the battles the cursor selected
+            rows = [
+                (battle_id, winner, loser, time, machine_names or '', machine_ids.split(',') if machine_ids else [])
+                for battle_id, winner, loser, time, machine_names, machine_ids in cursor.fetchall()
+            ]
+
+            # Hydrate every machine referenced by these battles in one pass
+            # instead of querying machine and tags per battle
+            referenced_ids = {int(machine_id) for row in rows for machine_id in row[5]}
+            machines_by_id = self._load_machines_by_id(cursor, referenced_ids)
+
             battles = []
-            for row in cursor.fetchall():
-                battle_id, winner, loser, time, machine_names, machine_ids = row
-                
-                # Get full machine details
-                machines = []
-                for machine_id in machine_ids.split(','):
-                    cursor.execute('SELECT * FROM machines WHERE id = ?', (machine_id,))
-                    machine_data = dict(zip([d[0] for d in cursor.description], cursor.fetchone()))
-                    
-                    # Get tags for this machine
-                    cursor.execute('''
-                        SELECT t.name 
-                        FROM tags t 
-                        JOIN machine_tags mt ON t.id = mt.tag_id 
-                        WHERE mt.machine_id = ?
-                    ''', (machine_id,))
-                    tags = [tag[0] for tag in cursor.fetchall()]
-                    
-                    machines.append({
-                        'id': machine_data['id'],
-                        'name': machine_data['name'],
-                        'tags': tags,
-                        'active': bool(machine_data['active']),
-                        'details': {
-                            'manufacturer': machine_data['manufacturer'],
-                            'release_date': machine_data['release_date'],
-                            'type': machine_data['type'],
-                            'generation': machine_data['generation'],
-                            'release_count': machine_data['release_count'],
-                            'estimated_value': machine_data['estimated_value'],
-                            'cabinet': machine_data['cabinet'],
-                            'display_type': machine_data['display_type'],
-                            'players': machine_data['players'],
-                            'flippers': machine_data['flippers'],
-                            'ramps': machine_data['ramps'],
-                            'multiball': machine_data['multiball'],
-                            'ipdb': machine_data['ipdb'],
-                            'latest_software': machine_data['latest_software']
-                        }
-                    })
-                
+            for battle_id, winner, loser, time, machine_names, machine_ids in rows:
                 battles.append({
+                    'id': battle_id,
                     'winner': winner,
                     'loser': loser,
                     'time': time,
-                    'machines': machines,
+                    'battle_time': time,
+                    'machines': [machines_by_id[int(machine_id)] for machine_id in machine_ids],
                     'machine_names': machine_names
                 })
             
             return battles
 
+    def get_battle(self, battle_id: int) -> Optional[Dict]:
+        """One battle by id with its players and machine names, or None"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT b.id, w.name, l.name, b.battle_time, GROUP_CONCAT(m.name) as machine_names
+                FROM battles b
+                JOIN players w ON b.winner_id = w.id
+                JOIN players l ON b.loser_id = l.id
+                LEFT JOIN battle_machines bm ON b.id = bm.battle_id
+                LEFT JOIN machines m ON bm.machine_id = m.id
+                WHERE b.id = ?
+                GROUP BY b.id
+            ''', (battle_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            battle_id, winner, loser, battle_time, machine_names = row
+            return {
+                'id': battle_id,
+                'winner': winner,
+                'loser': loser,
+                'battle_time': battle_time,
+                'machine_names': machine_names or ''
+            }
+
+    def _iter_query(self, query: str, params, batch_size: int = 500):
+        """
+        Yield rows of `query` as dicts straight from the cursor, batch by batch.
+        Uses its own short-lived connection so long exports never hold a pooled one.
+        """
+        conn = self.connections.open_connection()
+        try:
+            cursor = conn.execute(query, params)
+            columns = [desc[0] for desc in cursor.description]
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(zip(columns, row))
+        finally:
+            conn.close()
+
+    def iter_battles(self, since: Optional[str] = None, until: Optional[str] = None):
+        """
+        Stream battles in time order for exports, optionally limited to
+        since <= battle_time < until. Machine names are comma separated.
+        """
+        conditions = []
+        params = []
+        if since:
+            conditions.append('b.battle_time >= ?')
+            params.append(since)
+        if until:
+            conditions.append('b.battle_time < ?')
+            params.append(until)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        return self._iter_query(f'''
+            SELECT
+                b.id,
+                b.battle_time,
+                w.name as winner,
+                l.name as loser,
+                (
+                    SELECT GROUP_CONCAT(m.name)
+                    FROM battle_machines bm
+                    JOIN machines m ON bm.machine_id = m.id
+                    WHERE bm.battle_id = b.id
+                ) as machines
+            FROM battles b
+            JOIN players w ON b.winner_id = w.id
+            JOIN players l ON b.loser_id = l.id
+            {where}
+            ORDER BY b.battle_time, b.id
+        ''', params)
+
+    def iter_monthly_scores(self, since: Optional[str] = None, until: Optional[str] = None):
+        """
+        Stream every monthly contest score, optionally limited to contests with
+        since <= month < until (months as 'YYYY-MM').
+        """
+        conditions = []
+        params = []
+        if since:
+            conditions.append('mc.month >= ?')
+            params.append(since[:7])
+        if until:
+            conditions.append('mc.month < ?')
+            params.append(until[:7])
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        return self._iter_query(f'''
+            SELECT
+                mc.month,
+                m.name as machine,
+                p.name as player,
+                ms.score
+            FROM monthly_scores ms
+            JOIN monthly_contests mc ON ms.contest_id = mc.id
+            JOIN players p ON ms.player_id = p.id
+            LEFT JOIN machines m ON mc.machine_id = m.id
+            {where}
+            ORDER BY mc.month, ms.score DESC
+        ''', params)
+
     def get_or_create_player_id(self, cursor, player_name: str) -> int:
         """
         Check if a player exists in the database. If not, insert a new player.
@@ -248,63 +1472,126 @@ class DBHelper:
             cursor.execute('INSERT INTO players (name, wins, losses) VALUES (?, 0, 0)', (player_name,))
             return cursor.lastrowid
 
-    def save_battle(self, winner: str, loser: str, machines: List[Dict], time: str = None):
+    def record_battle_result(self, battle_key: str, winner: str, loser: str,
+                             machines: List[Dict], time: str = None) -> int:
         """
-        Save a battle result and update player statistics.
+        Record a finished battle: upsert both players, insert the battle and its
+        machines and update the player aggregates, all in one transaction.
+
+        `battle_key` is the Battle.battle_id of the battle being resolved. It is
+        unique in the battles table, so recording the same battle twice (e.g. a
+        double-clicked button) is a no-op that returns the existing battle id.
         """
         time = time or datetime.now(ZoneInfo("America/New_York")).isoformat()
+        battle_id = self.write(self._record_battle_result, battle_key, winner, loser, machines, time)
+        self.versions.notify('battles')
+        return battle_id
 
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
+    def _record_battle_result(self, cursor, battle_key: str, winner: str, loser: str,
+                              machines: List[Dict], time: str) -> int:
+        """Write job for record_battle_result"""
+        winner_id = self.get_or_create_player_id(cursor, winner)
+        loser_id = self.get_or_create_player_id(cursor, loser)
 
-            winner_id = self.get_or_create_player_id(cursor, winner)
-            loser_id = self.get_or_create_player_id(cursor, loser)
+        cursor.execute('''
+            INSERT INTO battles (battle_key, winner_id, loser_id, battle_time)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (battle_key) DO NOTHING
+        ''', (battle_key, winner_id, loser_id, time))
 
-            # Check if this battle already exists
-            cursor.execute('''
-                SELECT id FROM battles 
-                WHERE winner_id = ? AND loser_id = ? AND battle_time = ?
-            ''', (winner_id, loser_id, time))
-            
-            existing_battle = cursor.fetchone()
-            if existing_battle:
-                # Battle already exists, don't try to save it again
-                return existing_battle[0]
+        if cursor.rowcount == 0:
+            # Battle already recorded, don't count it again
+            cursor.execute('SELECT id FROM battles WHERE battle_key = ?', (battle_key,))
+            return cursor.fetchone()[0]
 
-            cursor.execute('''
-                INSERT INTO battles (winner_id, loser_id, battle_time)
-                VALUES (?, ?, ?)
-            ''', (winner_id, loser_id, time))
+        battle_id = cursor.lastrowid
+        record_player_aggregates(cursor, winner_id, loser_id, time)
 
-            battle_id = cursor.lastrowid
+        battle_machines = []
+        added_machines = set()
+        for position, machine in enumerate(machines, 1):
+            # Ensure we have the machine id, falling back to a lookup by name
+            machine_id = machine.get('id')
+            if not machine_id:
+                cursor.execute('SELECT id FROM machines WHERE name = ?', (machine['name'],))
+                result = cursor.fetchone()
+                if not result:
+                    raise ValueError(f"Could not find machine ID for {machine['name']}")
+                machine_id = result[0]
 
-            # Use a set to track machine IDs we've already added
-            added_machines = set()
-            
-            for position, machine in enumerate(machines, 1):
-                # Ensure we have the machine id, try to extract it
-                machine_id = machine.get('id')
-                if not machine_id:
-                    # Try to find the machine ID by name if 'id' is not provided
-                    cursor.execute('SELECT id FROM machines WHERE name = ?', (machine['name'],))
-                    result = cursor.fetchone()
-                    if not result:
-                        raise ValueError(f"Could not find machine ID for {machine['name']}")
-                    machine_id = result[0]
-                
-                # Skip if we've already added this machine to this battle
-                if machine_id in added_machines:
-                    continue
-                    
+            # Skip if we've already added this machine to this battle
+            if machine_id in added_machines:
+                continue
+            added_machines.add(machine_id)
+            battle_machines.append((battle_id, machine_id, position))
+
+        cursor.executemany('''
+            INSERT INTO battle_machines (battle_id, machine_id, position)
+            VALUES (?, ?, ?)
+        ''', battle_machines)
+
+        return battle_id
+
+    def get_current_contest(self) -> Optional[Tuple[int, str, str]]:
+        """
+        (contest id, month, machine name) of the current month's contest, or None.
+        The contest row is cached per database file, keyed on the month and the
+        'contests' data version, so contests saved by any process are seen while
+        score submissions keep hitting the cache.
+        """
+        current_month = datetime.now().strftime("%Y-%m")
+        key = (current_month, self.versions.get('contests'))
+        cached = _current_contests.get(self.db_path)
+        if cached is None or cached[0] != key:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
                 cursor.execute('''
-                    INSERT INTO battle_machines (battle_id, machine_id, position)
-                    VALUES (?, ?, ?)
-                ''', (battle_id, machine_id, position))
-                
-                added_machines.add(machine_id)
+                    SELECT id, month, machine_id 
+                    FROM monthly_contests 
+                    WHERE month = ?
+                    ORDER BY id DESC 
+                    LIMIT 1
+                ''', (current_month,))
+                cached = (key, cursor.fetchone())
+            _current_contests[self.db_path] = cached
+        if not cached[1]:
+            return None
 
-            conn.commit()
-            return battle_id
+        contest_id, month, machine_id = cached[1]
+        machine = self.get_machine_by_id(machine_id)
+        return contest_id, month, machine['name'] if machine else "None"
+
+    def submit_monthly_score(self, player: str, score: int) -> str:
+        """
+        Record a score for the current monthly contest, keeping the player's best.
+        Returns the machine of the month; raises ValueError if no contest is running.
+        """
+        contest = self.get_current_contest()
+        if not contest:
+            raise ValueError("There is no monthly contest running this month.")
+        contest_id, _, machine_name = contest
+        self.write(self._submit_monthly_score, contest_id, player, score)
+        self.versions.notify('monthly')
+        return machine_name
+
+    def _submit_monthly_score(self, cursor, contest_id: int, player: str, score: int):
+        """
+        Write job for submit_monthly_score. A known player takes the single
+        upsert; SQLite cannot insert into two tables in one statement, so a
+        first-time player is created and the upsert runs once more.
+        """
+        upsert = '''
+            INSERT INTO monthly_scores (contest_id, player_id, score)
+            SELECT ?, id, ? FROM players WHERE name = ?
+            ON CONFLICT (contest_id, player_id) DO UPDATE SET score = max(score, excluded.score)
+        '''
+        cursor.execute(upsert, (contest_id, score, player))
+        if cursor.rowcount == 0:
+            cursor.execute('''
+                INSERT INTO players (name, wins, losses) VALUES (?, 0, 0)
+                ON CONFLICT (name) DO NOTHING
+            ''', (player,))
+            cursor.execute(upsert, (contest_id, score, player))
 
     def get_current_month_data(self) -> Dict:
         """Get current month's contest data with detailed debugging"""
@@ -314,24 +1601,13 @@ class DBHelper:
             cursor = conn.cursor()
             
             # First, verify the monthly contests
-            cursor.execute('''
-                SELECT id, month, machine_id 
-                FROM monthly_contests 
-                WHERE month = ?
-                ORDER BY id DESC 
-                LIMIT 1
-            ''', (current_month,))
-            contest_row = cursor.fetchone()
+            contest = self.get_current_contest()
             
-            if not contest_row:
+            if not contest:
                 print("No monthly contest found")
                 return {"month": current_month, "machine_of_the_month": "None", "scores": []}
             
-            contest_id, contest_month, machine_id = contest_row
-            
-            # Get machine name
-            cursor.execute('SELECT name FROM machines WHERE id = ?', (machine_id,))
-            machine_name = cursor.fetchone()[0]
+            contest_id, contest_month, machine_name = contest
             
             # Fetch all scores for this contest with detailed information
             cursor.execute('''
@@ -371,70 +1647,104 @@ class DBHelper:
             }
 
     def save_monthly_contest(self, data: Dict):
-        """Save or update monthly contest data"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Get machine ID
-            cursor.execute('SELECT id FROM machines WHERE name = ?', (data['machine_of_the_month'],))
-            machine_result = cursor.fetchone()
-            if not machine_result:
-                raise ValueError(f"Machine '{data['machine_of_the_month']}' does not exist.")
-            machine_id = machine_result[0]
-            
-            # Check if an entry for the month and machine already exists
-            cursor.execute('SELECT id FROM monthly_contests WHERE month = ? AND machine_id = ?', (data['month'], machine_id))
-            contest_result = cursor.fetchone()
+        """Save or update monthly contest data (through the write queue)"""
+        self.write(self._save_monthly_contest, data)
+        self.versions.notify('monthly')
+
+    def _save_monthly_contest(self, cursor, data: Dict):
+        """Write job for save_monthly_contest"""
+        # Get machine ID
+        cursor.execute('SELECT id FROM machines WHERE name = ?', (data['machine_of_the_month'],))
+        machine_result = cursor.fetchone()
+        if not machine_result:
+            raise ValueError(f"Machine '{data['machine_of_the_month']}' does not exist.")
+        machine_id = machine_result[0]
 
-            if contest_result:
-                # Entry exists, use its ID
-                contest_id = contest_result[0]
+        # Check if an entry for the month and machine already exists
+        cursor.execute('SELECT id FROM monthly_contests WHERE month = ? AND machine_id = ?', (data['month'], machine_id))
+        contest_result = cursor.fetchone()
+
+        if contest_result:
+            # Entry exists, use its ID
+            contest_id = contest_result[0]
+        else:
+            # Insert a new contest entry
+            cursor.execute('''
+                INSERT INTO monthly_contests (month, machine_id)
+                VALUES (?, ?)
+            ''', (data['month'], machine_id))
+            contest_id = cursor.lastrowid
+
+        # Update or insert scores
+        for score_entry in data.get('scores', []):
+            # Find the player ID
+            cursor.execute('SELECT id FROM players WHERE name = ?', (score_entry['player'],))
+            player_result = cursor.fetchone()
+
+            if not player_result:
+                # Create player if not exists
+                cursor.execute('INSERT INTO players (name, wins, losses) VALUES (?, 0, 0)', (score_entry['player'],))
+                player_id = cursor.lastrowid
             else:
-                # Insert a new contest entry
-                cursor.execute('''
-                    INSERT INTO monthly_contests (month, machine_id)
-                    VALUES (?, ?)
-                ''', (data['month'], machine_id))
-                contest_id = cursor.lastrowid
-            
-            # Update or insert scores
-            for score_entry in data.get('scores', []):
-                # Find the player ID
-                cursor.execute('SELECT id FROM players WHERE name = ?', (score_entry['player'],))
-                player_result = cursor.fetchone()
-                
-                if not player_result:
-                    # Create player if not exists
-                    cursor.execute('INSERT INTO players (name, wins, losses) VALUES (?, 0, 0)', (score_entry['player'],))
-                    player_id = cursor.lastrowid
-                else:
-                    player_id = player_result[0]
-                
-                # Check if a score already exists for this player and contest
+                player_id = player_result[0]
+
+            # Check if a score already exists for this player and contest
+            cursor.execute('''
+                SELECT id FROM monthly_scores 
+                WHERE contest_id = ? AND player_id = ?
+            ''', (contest_id, player_id))
+            existing_score = cursor.fetchone()
+
+            if existing_score:
+                # Update existing score if new score is higher
                 cursor.execute('''
-                    SELECT id FROM monthly_scores 
+                    UPDATE monthly_scores 
+                    SET score = CASE 
+                        WHEN ? > score THEN ? 
+                        ELSE score 
+                    END
                     WHERE contest_id = ? AND player_id = ?
-                ''', (contest_id, player_id))
-                existing_score = cursor.fetchone()
-                
-                if existing_score:
-                    # Update existing score if new score is higher
-                    cursor.execute('''
-                        UPDATE monthly_scores 
-                        SET score = CASE 
-                            WHEN ? > score THEN ? 
-                            ELSE score 
-                        END
-                        WHERE contest_id = ? AND player_id = ?
-                    ''', (score_entry['score'], score_entry['score'], contest_id, player_id))
-                else:
-                    # Insert new score if no existing score
-                    cursor.execute('''
-                        INSERT INTO monthly_scores (contest_id, player_id, score)
-                        VALUES (?, ?, ?)
-                    ''', (contest_id, player_id, score_entry['score']))
-                
-                # Debug print
-                print(f"Saving score for {score_entry['player']}: {score_entry['score']}")
-            
-            conn.commit()
+                ''', (score_entry['score'], score_entry['score'], contest_id, player_id))
+            else:
+                # Insert new score if no existing score
+                cursor.execute('''
+                    INSERT INTO monthly_scores (contest_id, player_id, score)
+                    VALUES (?, ?, ?)
+                ''', (contest_id, player_id, score_entry['score']))
+
+            # Debug print
+            print(f"Saving score for {score_entry['player']}: {score_entry['score']}")
+
+
+
+class AsyncDBHelper:
+    """
+    Awaitable facade over a DBHelper for asyncio code (the Discord bot).
+
+    Every DBHelper method is exposed under the same name as a coroutine that
+    runs the call on a small, bounded pool of worker threads, so a slow query
+    never blocks the event loop. Each worker keeps its own tuned connection.
+    """
+    def __init__(self, db: DBHelper, max_workers: int = 4):
+        self.db = db
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='goblin-db')
+
+    def __getattr__(self, name):
+        method = getattr(self.db, name)
+        if not callable(method):
+            return method
+
+        @functools.wraps(method)
+        async def run_in_pool(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(method, *args, **kwargs))
+
+        return run_in_pool
+
+    async def run(self, func, *args, **kwargs):
+        """Run any blocking callable (e.g. one that queries through the DBHelper) on the pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
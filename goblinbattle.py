@@ -1,8 +1,14 @@
 import os
-from flask import Flask, render_template, request, redirect, url_for
-from flask_socketio import SocketIO
+import click
+from flask import Flask, Response, render_template, request, redirect, url_for, jsonify, abort
+from markupsafe import Markup
+from flask_socketio import SocketIO, join_room
 from admin import admin_bp
+import csv
+import io
+import json
 import random
+import uuid
 import os
 import discord
 from discord.ext import commands
@@ -11,16 +17,24 @@ from zoneinfo import ZoneInfo
 from dataclasses import dataclass
 from typing import List, Dict, Optional
 
-# Import your THEMES dictionary from the separate themes.py file
-from themes import THEMES
-from db_utils import DBHelper
+# Themes live in themes.py; the index caches which machines fit each theme
+from themes import ThemeIndex
+from db_utils import DBHelper, AsyncDBHelper
+from broadcaster import Broadcaster
+from page_cache import VersionedCache, Warmer
+import http_cache
+from http_cache import cache_policy, versioned_json, versioned_response
 
 # Flask App Setup
 app = Flask(__name__)
 socketio = SocketIO(app)
 app.register_blueprint(admin_bp, url_prefix='/admin')
+http_cache.init_app(app)
 # TPG 01/18/25 - Replaced the json files with a new sql-lite database
 db = DBHelper('goblin_battle.db')
+db.init_app(app)
+# Number of battles per page of the Recent Battles feed
+BATTLE_PAGE_SIZE = 30
 
 def get_eastern_time():
     # This automatically handles DST transitions
@@ -30,13 +44,10 @@ def get_eastern_time():
 @app.after_request
 def add_header(response):
     """
-    Add headers to both force latest IE rendering engine or Chrome Frame,
-    and also to cache the rendered page for 0 seconds.
+    Force the latest IE rendering engine or Chrome Frame. Caching headers
+    come from each route's policy (see http_cache.py).
     """
     response.headers['X-UA-Compatible'] = 'IE=Edge,chrome=1'
-    response.headers['Cache-Control'] = 'public, max-age=0, no-cache, no-store, must-revalidate'
-    response.headers['Pragma'] = 'no-cache'
-    response.headers['Expires'] = '0'
     return response
 
 @dataclass
@@ -52,7 +63,8 @@ class Battle:
 
     @classmethod
     def generate_id(cls):
-        return datetime.now().strftime('%Y%m%d%H%M%S') + str(random.randint(1000, 9999))
+        # Stored as the battle's unique key, so keep collisions out of reach
+        return datetime.now().strftime('%Y%m%d%H%M%S') + uuid.uuid4().hex[:12]
 
 # TPG 01/18/25 - Added battle manager class to handle concurrent battles happening at the same time. 
 # goblinbattle and themebattle have both been updated to use the new battle manager logic
@@ -60,6 +72,8 @@ class Battle:
 class BattleManager:
     def __init__(self):
         self.active_battles: Dict[int, Battle] = {}  # message_id -> Battle
+        # Bumped when battles start or end; the home page caches its ongoing panel by it
+        self.version = 0
     
     def create_battle(self, player1: str, player2: str, machines: List[Dict], 
                         message_id: int, channel_id: int) -> Battle:
@@ -72,6 +86,7 @@ class BattleManager:
                 battle_id=Battle.generate_id()
             )
             self.active_battles[message_id] = battle
+            self.version += 1
             return battle
     
     def get_battle(self, message_id: int) -> Optional[Battle]:
@@ -83,6 +98,7 @@ class BattleManager:
             battle.resolved = True
             # Remove from active battles
             del self.active_battles[message_id]
+            self.version += 1
             return battle
         return None
     
@@ -92,43 +108,34 @@ class BattleManager:
 def get_current_month():
     return datetime.now().strftime("%Y-%m")
 
-# Helper function to get machine details by name
-def get_machine_details(name):
-    machines = db.load_machines()
-    for machine in machines:
-        if machine['name'] == name:
-            return db.get_machine_details(name)
-    return None
+def format_battle_time(battle_time):
+    return datetime.fromisoformat(battle_time).strftime('%m/%d/%Y %I:%M %p')
 
-@app.route('/')
-def home():
-    # Determine leaderboard type from query parameter
-    leaderboard_type = request.args.get('leaderboard_type', 'all_time')
+def battle_page_cursor(battles, limit):
+    """Keyset cursor for the page after `battles`, or None when this was the last page"""
+    if len(battles) < limit:
+        return None
+    return {"before_time": battles[-1]['battle_time'], "before_id": battles[-1]['id']}
+
+def render_home_fragments(leaderboard_type):
+    """
+    The home page for a leaderboard type, split around the ongoing battles panel:
+    (bytes before it, bytes after it). Everything here only changes on writes.
+    """
     # Load stats based on selected type
     player_stats = db.load_player_stats(leaderboard_type)
     sorted_leaderboard = sorted(player_stats.items(), key=lambda x: x[1]['wins'], reverse=True)
     leaderboard_with_rank = [
-        {"rank": idx + 1, "player": player.split('#')[0], "stats": stats}
+        {"rank": idx + 1, "name": player, "player": player.split('#')[0], "stats": stats}
         for idx, (player, stats) in enumerate(sorted_leaderboard)
     ]
 
-    # Dynamically get ongoing battles and recent battles
-    recent_battles = db.load_battle_history()[:30]
+    # Recent battles
+    recent_battles = db.load_battle_history(limit=BATTLE_PAGE_SIZE)
+    battle_history_next = battle_page_cursor(recent_battles, BATTLE_PAGE_SIZE)
     
     for battle in recent_battles:
-        time = datetime.fromisoformat(battle['time'])
-        battle['time'] = time.strftime('%m/%d/%Y %I:%M %p')
-
-    # Get active battles from Discord bot's battle manager
-    ongoing_battles = bot.battle_manager.get_all_active_battles()
-    ongoing_battles_list = [
-        {
-            "player1": battle.player1, 
-            "player2": battle.player2, 
-            "machine_names": ', '.join([m['name'] for m in battle.machines]) if battle.machines else 'No machines'
-        } 
-        for battle in ongoing_battles
-    ]
+        battle['time'] = format_battle_time(battle['time'])
 
     # Get current monthly contest scoreboard
     current_monthly_data = db.get_current_month_data()
@@ -137,17 +144,305 @@ def home():
     for i, entry in enumerate(monthly_scores_sorted, start=1):
         entry['rank'] = i
 
-    return render_template(
+    page = render_template(
         'index.html',
         leaderboard=leaderboard_with_rank,
         leaderboard_type=leaderboard_type,
-        ongoing_battles=ongoing_battles_list,
+        ongoing_panel=Markup(ONGOING_PANEL_MARKER),
         battle_history=recent_battles,
+        battle_history_next=battle_history_next,
         machine_of_the_month=current_monthly_data.get("machine_of_the_month", "None"),
         monthly_scores=monthly_scores_sorted
     )
+    before, after = page.split(ONGOING_PANEL_MARKER)
+    return before.encode(), after.encode()
+
+def render_ongoing_panel(_):
+    # Get active battles from Discord bot's battle manager
+    ongoing_battles = bot.battle_manager.get_all_active_battles()
+    ongoing_battles_list = [ongoing_battle_json(battle) for battle in ongoing_battles]
+    return render_template('ongoing_battles.html', ongoing_battles=ongoing_battles_list).encode()
+
+def home_data_version():
+    """
+    Changes whenever anything on the home page except the ongoing battles changes.
+    The counters are kept in process (home_counters); the recheck picks up writes
+    made by other processes (the rebuild-stats command, db-setup.py imports,
+    other workers) within DataVersions.recheck_interval.
+    """
+    db.versions.recheck()
+    return (get_current_month(),) + home_counters
+
+def home_page(leaderboard_type, data_version=None):
+    """The whole home page as bytes, assembled from the cached fragments"""
+    if data_version is None:
+        data_version = home_data_version()
+    ongoing_version = bot.battle_manager.version
+
+    def build(_):
+        before, after = home_fragments.get(leaderboard_type, data_version, render_home_fragments)
+        return before + ongoing_panels.get(None, ongoing_version, render_ongoing_panel) + after
+    return home_pages.get(leaderboard_type, (data_version, ongoing_version), build)
+
+def warm_home_pages():
+    # A request context, so the templates can build URLs (static_url)
+    with app.test_request_context('/'):
+        for leaderboard_type in LEADERBOARD_TYPES:
+            home_page(leaderboard_type)
+
+@app.route('/')
+def home():
+    # Determine leaderboard type from query parameter
+    leaderboard_type = request.args.get('leaderboard_type', 'all_time')
+    if leaderboard_type not in LEADERBOARD_TYPES:
+        leaderboard_type = 'all_time'
+    data_version = home_data_version()
+    version = (leaderboard_type, data_version, http_cache.PROCESS_TOKEN, bot.battle_manager.version)
+    return versioned_response(version, lambda: home_page(leaderboard_type, data_version), 'text/html')
+
+@app.route('/api/leaderboard')
+def api_leaderboard():
+    """Ranked standings for ?type=all_time (default) or current_month"""
+    leaderboard_type = request.args.get('type', 'all_time')
+    if leaderboard_type not in LEADERBOARD_TYPES:
+        abort(400, description=f"type must be one of: {', '.join(LEADERBOARD_TYPES)}")
+
+    def build():
+        player_stats = db.load_player_stats(leaderboard_type)
+        sorted_leaderboard = sorted(player_stats.items(), key=lambda x: x[1]['wins'], reverse=True)
+        return [
+            {"rank": idx + 1, "player": player, "wins": stats['wins'], "losses": stats['losses']}
+            for idx, (player, stats) in enumerate(sorted_leaderboard)
+        ]
+    versions = db.versions.all()
+    version = (leaderboard_type, get_current_month(), versions.get('battles', 0), versions.get('monthly', 0))
+    return versioned_json(version, build)
+
+@app.route('/api/monthly')
+def api_monthly():
+    """The current monthly contest: machine of the month and ranked scores"""
+    def build():
+        current_monthly_data = db.get_current_month_data()
+        scores = sorted(current_monthly_data.get("scores", []), key=lambda x: x['score'], reverse=True)
+        return {
+            "month": current_monthly_data.get("month"),
+            "machine_of_the_month": current_monthly_data.get("machine_of_the_month", "None"),
+            "scores": [
+                {"rank": rank, "player": entry['player'], "score": entry['score']}
+                for rank, entry in enumerate(scores, start=1)
+            ]
+        }
+    versions = db.versions.all()
+    version = (get_current_month(), versions.get('monthly', 0), versions.get('machines', 0))
+    return versioned_json(version, build)
+
+@app.route('/api/ongoing')
+def api_ongoing():
+    """Battles started from Discord that have no winner yet"""
+    return versioned_json((http_cache.PROCESS_TOKEN, bot.battle_manager.version), lambda: [
+        ongoing_battle_json(battle) for battle in bot.battle_manager.get_all_active_battles()
+    ])
+
+@app.route('/api/page_cache_stats')
+@cache_policy(http_cache.NO_STORE_POLICY)
+def page_cache_stats():
+    return jsonify({
+        "pages": home_pages.stats(),
+        "fragments": home_fragments.stats(),
+        "ongoing_panels": ongoing_panels.stats()
+    })
     
+@app.route('/api/battles')
+def api_battles():
+    """
+    One page of battle history, newest first.
+    Pass the `next` cursor of a response as before_time/before_id to get the following page.
+    """
+    limit = max(1, min(request.args.get('limit', BATTLE_PAGE_SIZE, type=int), 100))
+    before_time = request.args.get('before_time')
+    before_id = request.args.get('before_id', type=int)
+    # A half cursor would silently return the first page again
+    if (before_time is None) != (before_id is None):
+        abort(400, description="before_time and before_id (an integer) must be given together")
+
+    battles = db.load_battle_history(limit=limit, before_time=before_time, before_id=before_id)
+    return jsonify({
+        "battles": [battle_json(battle) for battle in battles],
+        "next": battle_page_cursor(battles, limit)
+    })
+
+def battle_json(battle):
+    """A battle as sent to browsers by /api/battles and the battle_recorded event"""
+    return {
+        "id": battle['id'],
+        "winner": battle['winner'],
+        "loser": battle['loser'],
+        "battle_time": battle['battle_time'],
+        "time": format_battle_time(battle['battle_time']),
+        "machine_names": battle['machine_names']
+    }
+
+# Live updates. Each page panel is a Socket.IO room; a write publishes typed
+# changes for the rooms whose panels it changes, the broadcaster coalesces them
+# (see broadcaster.py) and the page patches itself instead of reloading.
+LEADERBOARD_TYPES = ('all_time', 'current_month')
+LIVE_ROOMS = {f'leaderboard:{leaderboard_type}' for leaderboard_type in LEADERBOARD_TYPES} | {
+    'battles', 'ongoing', 'monthly'
+}
+
+broadcaster = Broadcaster(
+    lambda event, items, room: socketio.emit(event, items, to=room),
+    socketio.start_background_task,
+    socketio.sleep,
+    window=float(os.environ.get("BROADCAST_WINDOW", 0.5)),
+    max_rate=float(os.environ.get("BROADCAST_MAX_RATE", 2))
+)
+
+# Home page cache: the page minus the ongoing battles panel per leaderboard type
+# and data version, the panel per battle manager version, and the assembled page.
+# Every change DataVersions sees (writes in this process right away, writes from
+# other processes at the next recheck) updates home_counters and warms the cache
+# in the background, so views stay a dictionary lookup.
+HOME_DATA_VERSIONS = ('battles', 'monthly', 'machines')
+home_counters = ()
+
+def update_home_counters(name=None, version=None):
+    global home_counters
+    if name is None or name in HOME_DATA_VERSIONS:
+        versions = db.versions.all()
+        home_counters = tuple(versions.get(counter, 0) for counter in HOME_DATA_VERSIONS)
+
+update_home_counters()
+db.versions.subscribe(update_home_counters)
+ONGOING_PANEL_MARKER = '<!-- ongoing battles panel -->'
+home_fragments = VersionedCache()
+ongoing_panels = VersionedCache()
+home_pages = VersionedCache()
+home_warmer = Warmer(lambda: warm_home_pages(), socketio.start_background_task, socketio.sleep)
+db.versions.subscribe(home_warmer.schedule)
+
+def start_background_tasks():
+    """
+    Start the live update and cache warm-up loops. Called once by the server
+    process before it serves, so the tasks belong to the server's async mode
+    rather than to whichever thread (e.g. the bot's) happens to write first.
+    """
+    broadcaster.start()
+    home_warmer.start()
+
+@app.route('/api/broadcast_stats')
+@cache_policy(http_cache.NO_STORE_POLICY)
+def broadcast_stats():
+    """Live update counters: notifications received vs events emitted, per event"""
+    return jsonify(broadcaster.stats())
+
+@socketio.on('subscribe')
+def subscribe(rooms):
+    """Clients name the panels they display, e.g. ['leaderboard:all_time', 'battles']"""
+    for room in rooms or []:
+        if room in LIVE_ROOMS:
+            join_room(room)
+
+def publish_battle_recorded(battle_id):
+    """Publish a newly recorded battle and its two players' new standings"""
+    battle = db.get_battle(battle_id)
+    if battle is None:
+        return
+    broadcaster.publish('battle_recorded', 'battles', battle_json(battle), key=battle['id'])
+    players = [battle['winner'], battle['loser']]
+    for leaderboard_type in LEADERBOARD_TYPES:
+        for player, stats in db.load_player_stats(leaderboard_type, players).items():
+            broadcaster.publish('leaderboard_update', f'leaderboard:{leaderboard_type}', {
+                "player": player,
+                "wins": stats['wins'],
+                "losses": stats['losses']
+            }, key=player)
+
+def ongoing_battle_json(battle):
+    return {
+        "battle_id": battle.battle_id,
+        "player1": battle.player1,
+        "player2": battle.player2,
+        "machine_names": ', '.join([m['name'] for m in battle.machines]) if battle.machines else 'No machines'
+    }
+
+def publish_ongoing_added(battle):
+    broadcaster.publish('ongoing_changed', 'ongoing', dict(ongoing_battle_json(battle), status='added'),
+                        key=battle.battle_id)
+
+def publish_ongoing_removed(battle):
+    # Replaces a still pending 'added' of the same battle
+    broadcaster.publish('ongoing_changed', 'ongoing', {"battle_id": battle.battle_id, "status": "removed"},
+                        key=battle.battle_id)
+
+def best_score(pending, new):
+    return new if new['score'] >= pending['score'] else pending
+
+def publish_monthly_score(player, score):
+    # The page keeps each player's best, like submit_monthly_score does
+    broadcaster.publish('monthly_changed', 'monthly', {"player": player, "score": score},
+                        key=player, merge=best_score)
+
+def publish_monthly_reset(machine_of_the_month):
+    broadcaster.publish('monthly_changed', 'monthly', {"reset": True, "machine_of_the_month": machine_of_the_month},
+                        reset=True)
+
+EXPORT_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+def export_response(name, columns, rows):
+    """
+    Stream `rows` (dicts) as NDJSON or CSV, chosen by the `format` query parameter.
+    Rows are encoded and sent in small batches, so memory stays flat for any table size.
+    """
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_MIMETYPES:
+        abort(400, description=f"format must be one of: {', '.join(EXPORT_MIMETYPES)}")
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if export_format == 'csv':
+            writer.writerow(columns)
+        for count, row in enumerate(rows, 1):
+            if export_format == 'csv':
+                writer.writerow([row[column] for column in columns])
+            else:
+                buffer.write(json.dumps(row) + '\n')
+            if count % 500 == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    return Response(generate(), mimetype=EXPORT_MIMETYPES[export_format], headers={
+        'Content-Disposition': f'attachment; filename={name}.{export_format}'
+    })
+
+@app.route('/api/export/battles')
+@cache_policy(http_cache.NO_STORE_POLICY)
+def export_battles():
+    """
+    All battles in time order as NDJSON (default) or CSV (?format=csv).
+    Optional ?since= and ?until= bound battle_time ('YYYY-MM-DD[ HH:MM:SS]', until exclusive).
+    """
+    rows = db.iter_battles(request.args.get('since'), request.args.get('until'))
+    return export_response('battles', ['id', 'battle_time', 'winner', 'loser', 'machines'], rows)
+
+@app.route('/api/export/monthly_scores')
+@cache_policy(http_cache.NO_STORE_POLICY)
+def export_monthly_scores():
+    """
+    Every monthly contest score as NDJSON (default) or CSV (?format=csv).
+    Optional ?since= and ?until= bound the contest month ('YYYY-MM', until exclusive).
+    """
+    rows = db.iter_monthly_scores(request.args.get('since'), request.args.get('until'))
+    return export_response('monthly_scores', ['month', 'machine', 'player', 'score'], rows)
+
 @app.route('/submit_battle', methods=['POST'])
+@cache_policy(http_cache.NO_STORE_POLICY)
 def submit_battle():
     winner = request.form['winner']
     loser = request.form['loser']
@@ -155,27 +450,37 @@ def submit_battle():
     if winner == loser:
         return redirect(url_for('home', error="Players cannot battle against themselves"))
 
-    # Update stats
-    db.update_stats(winner, loser)
-
-    # Record battle history
-    active_machines = [m['name'] for m in db.load_machines() if m.get('active', False)]
-    selected_machines = random.sample(active_machines, 3)
-    selected_machine_details = [get_machine_details(name) for name in selected_machines]
+    # Record battle history and player stats
+    selected_machine_details = db.pick_machines(3, (winner, loser))
     current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     
-    db.save_battle(winner, loser, selected_machine_details, current_time)
-
-    # Emit refresh event
-    socketio.emit('refresh', {'message': 'Battle stats updated'})
+    battle_id = db.record_battle_result(Battle.generate_id(), winner, loser, selected_machine_details, current_time)
+    publish_battle_recorded(battle_id)
 
     return redirect(url_for('home'))
 
+@app.cli.command('rebuild-stats')
+@click.option('--verify', is_flag=True, help='Only report rows that differ from the battles table.')
+def rebuild_stats_command(verify):
+    """Rebuild (or verify) the player win/loss aggregates from battle history."""
+    mismatches = db.verify_player_aggregates()
+    if verify:
+        for player_id, period, wins, losses, expected_wins, expected_losses in mismatches:
+            click.echo(f"player {player_id} {period}: stored {wins}/{losses}, expected {expected_wins}/{expected_losses}")
+        click.echo(f"{len(mismatches)} mismatched aggregate rows")
+        return
+
+    db.rebuild_player_aggregates()
+    click.echo(f"Player aggregates rebuilt ({len(mismatches)} rows corrected)")
+
 # Discord Bot Setup
 intents = discord.Intents.default()
 intents.message_content = True
 bot = commands.Bot(command_prefix='!', intents=intents)
 bot.battle_manager = BattleManager()
+# Bot handlers run on the asyncio loop, so they reach the database through a worker pool
+bot_db = AsyncDBHelper(db)
+theme_index = ThemeIndex()
 
 @bot.command()
 async def goblinbattle(ctx, opponent: discord.Member):
@@ -190,13 +495,14 @@ async def goblinbattle(ctx, opponent: discord.Member):
         await ctx.send("You cannot battle against yourself.")
         return
     
-    active_machines = [m['name'] for m in db.load_machines() if m.get('active', False)]
+    active_machines = await bot_db.load_machines()
     if len(active_machines) < 3:
         await ctx.send("There are fewer than 3 active machines available. Cannot start a goblinbattle.")
         return
 
-    selected_machines = random.sample(active_machines, 3)
-    selected_machine_details = [get_machine_details(name) for name in selected_machines]
+    selected_machine_details = await bot_db.pick_machines(
+        3, (player1.display_name, player2.display_name), avoid_recent=True
+    )
 
     # Construct the battle initiation message
     # TPG 01/18/25 - Changed buttons to store participant ids for validation
@@ -233,43 +539,7 @@ async def goblinbattle(ctx, opponent: discord.Member):
         channel_id=ctx.channel.id
     )
 
-    # Emit refresh event
-    socketio.emit('refresh', {'message': 'New battle initiated'})
-    
-def transform_for_theme_filter(machine):
-    try:
-        # Convert to strings for any potential integer/null values
-        return {
-            "name": str(machine['name']) if machine['name'] else "",
-            "details": {
-                "release_date": str(machine['release_date']) if machine['release_date'] else "",
-                "ramps": int(machine['ramps']) if machine['ramps'] else 0,
-                "multiball": int(machine['multiball']) if machine['multiball'] else 0,
-                "display_type": str(machine['display_type']) if machine['display_type'] else "",
-                "type": str(machine['type']) if machine['type'] else "",
-                "flippers": int(machine['flippers']) if machine['flippers'] else 0,
-                "manufacturer": str(machine['manufacturer']) if machine['manufacturer'] else "",
-                "generation": str(machine['generation']) if machine['generation'] else "",
-                "cabinet": str(machine['cabinet']) if machine['cabinet'] else "",
-                "release_count": int(machine['release_count']) if machine['release_count'] else 0
-            },
-            "tags": machine['tags'] if isinstance(machine['tags'], list) else [],
-            "active": bool(machine['active'])
-        }
-    except (KeyError, TypeError, ValueError) as e:
-        print(f"Error transforming machine {machine.get('name', 'Unknown')}: {str(e)}")
-        # Return a safe default structure if transformation fails
-        return {
-            "name": "",
-            "details": {
-                "release_date": "", "ramps": 0, "multiball": 0,
-                "display_type": "", "type": "", "flippers": 0,
-                "manufacturer": "", "generation": "", "cabinet": "",
-                "release_count": 0
-            },
-            "tags": [],
-            "active": False
-        }
+    publish_ongoing_added(battle)
     
 @bot.command()
 async def guestbattle(ctx, *, guest_name: str):
@@ -284,13 +554,14 @@ async def guestbattle(ctx, *, guest_name: str):
         await ctx.send("You cannot battle against yourself.")
         return
     
-    active_machines = [m['name'] for m in db.load_machines() if m.get('active', False)]
+    active_machines = await bot_db.load_machines()
     if len(active_machines) < 3:
         await ctx.send("There are fewer than 3 active machines available. Cannot start a battle.")
         return
 
-    selected_machines = random.sample(active_machines, 3)
-    selected_machine_details = [get_machine_details(name) for name in selected_machines]
+    selected_machine_details = await bot_db.pick_machines(
+        3, (player1.display_name, player2_name), avoid_recent=True
+    )
 
     # Construct the battle initiation message
     message = f"**GUEST BATTLE INITIATED**\n\nMachines:\n"
@@ -326,16 +597,14 @@ async def guestbattle(ctx, *, guest_name: str):
         channel_id=ctx.channel.id
     )
 
-    # Emit refresh event
-    socketio.emit('refresh', {'message': 'New guest battle initiated'})
+    publish_ongoing_added(battle)
 
 @bot.command()
 async def themebattle(ctx, opponent: discord.Member):
     """
     Usage: !themebattle @opponent
-    Randomly selects a theme from THEMES, attempts to find 3 machines matching it.
-    If fewer than 3 match, it picks a new theme (up to 10 tries),
-    then starts a battle between the command invoker and the opponent.
+    Randomly picks one of the themes that has at least 3 matching active machines,
+    then starts a battle on 3 of them between the command invoker and the opponent.
     """
     player1 = ctx.author
     player2 = opponent
@@ -344,41 +613,21 @@ async def themebattle(ctx, opponent: discord.Member):
         await ctx.send("You cannot battle against yourself.")
         return
 
-    active_machines = [m['name'] for m in db.load_machines() if m.get('active', False)]
-    if not active_machines:
+    # Only themes with at least 3 eligible active machines are offered
+    snapshot, viable_themes = await bot_db.run(theme_index.viable_themes, db)
+    if not snapshot.active:
         await ctx.send("No active machines are available at the moment.")
         return
-
-    selected_theme_name = None
-    selected_machines_details = []
-    max_tries = 10
-
-    for _ in range(max_tries):
-        theme_name = random.choice(list(THEMES.keys()))
-        theme_filter = THEMES[theme_name]
-        machines = db.load_machines()
-        
-        # Transform machines to match theme filter expectations
-        transformed_machines = [transform_for_theme_filter(m) for m in machines]
-        try:
-            filtered = [m for m in transformed_machines if m['name'] in active_machines and theme_filter(m)]
-        except (TypeError, KeyError) as e:
-            print(f"Error during theme filtering: {str(e)}")
-            filtered = []
-            
-        if len(filtered) >= 3:
-            selected_theme_name = theme_name
-            # Get the original machine details using the filtered names
-            selected_machines_details = [
-                next(machine for machine in machines if machine['name'] == filtered_machine['name'])
-                for filtered_machine in random.sample(filtered, 3)
-            ]
-            break
-
-    if not selected_theme_name:
-        await ctx.send("Could not find a theme with at least 3 machines after several tries. Please try again.")
+    if not viable_themes:
+        await ctx.send("No theme currently has at least 3 active machines.")
         return
 
+    selected_theme_name = random.choice(list(viable_themes))
+    selected_machines_details = await bot_db.pick_machines(
+        3, (player1.display_name, player2.display_name), avoid_recent=True,
+        candidates=viable_themes[selected_theme_name]
+    )
+
     # Construct the battle initiation message
     message = f"**THEME BATTLE INITIATED: {selected_theme_name}**\n\nMachines:\n"
     for i, machine in enumerate(selected_machines_details, 1):
@@ -413,18 +662,38 @@ async def themebattle(ctx, opponent: discord.Member):
         channel_id=ctx.channel.id
     )
 
-    # Emit refresh event
-    socketio.emit('refresh', {'message': 'New theme battle initiated'})
+    publish_ongoing_added(battle)
     
 @bot.command()
 async def leaderboard(ctx):
-    player_stats = db.load_player_stats()
+    player_stats = await bot_db.load_player_stats()
     sorted_leaderboard = sorted(player_stats.items(), key=lambda x: x[1]['wins'], reverse=True)
     message = "**Leaderboard**\n**Rank - Goblin, Wins/Losses**\n\n"
     for idx, (player, stats) in enumerate(sorted_leaderboard, start=1):
         message += f"{idx} - {player.split('#')[0]}, {stats['wins']}/{stats['losses']}\n"
     await ctx.send(message)
 
+@bot.command()
+async def machine(ctx, *, query: str):
+    """
+    Usage: !machine attack mars
+    Searches machines by name, manufacturer, generation or tag.
+    """
+    matches = await bot_db.search_machines(query, limit=5)
+    if not matches:
+        await ctx.send(f"No machines found matching \"{query}\".")
+        return
+
+    message = f"**Machines matching \"{query}\"**\n\n"
+    for m in matches:
+        status = "Active" if m['active'] else "Inactive"
+        message += f"**{m['name']}** ({status})\n"
+        message += f"{m['manufacturer'] or 'Unknown'}, {m['release_date'] or 'Unknown date'}"
+        if m['generation']:
+            message += f" - {m['generation']}"
+        message += f"\nTags: {', '.join(m['tags']) or 'None'}\n\n"
+    await ctx.send(message)
+
 @bot.command()
 async def ongoing(ctx):
     active_battles = bot.battle_manager.get_all_active_battles()
@@ -450,20 +719,16 @@ async def monthly(ctx, score: int):
 
     player_name = ctx.author.display_name
     
-    # Get current monthly data
-    current_data = db.get_current_month_data()
-    
-    # Update the score
-    current_scores = current_data.get("scores", [])
-    current_scores.append({"player": player_name, "score": score})
-    
-    current_data["scores"] = current_scores
-    db.save_monthly_contest(current_data)
+    # Record the score (only kept if it beats the player's current best)
+    try:
+        machine_of_the_month = await bot_db.submit_monthly_score(player_name, score)
+    except ValueError as e:
+        await ctx.send(str(e))
+        return
     
-    await ctx.send(f"High score of {score:,} submitted for {player_name} on **{current_data.get('machine_of_the_month', 'None')}**!")
+    await ctx.send(f"High score of {score:,} submitted for {player_name} on **{machine_of_the_month}**!")
     
-    # Emit refresh event
-    socketio.emit('refresh', {'message': 'Monthly scoreboard updated'})
+    publish_monthly_score(player_name, score)
 
 @bot.command()
 async def commands(ctx):
@@ -481,6 +746,7 @@ async def commands(ctx):
 **Stats & Info**
 `!leaderboard` - Show the current win/loss rankings
 `!ongoing` - Display all active battles
+`!machine [search]` - Look up machines by name, manufacturer or tag
 `!monthly [score]` - Submit your score for the current Machine of the Month"""
 
     # Send as ephemeral message (only visible to command invoker)
@@ -497,22 +763,21 @@ async def resetmonth(ctx):
         await ctx.send("You do not have permission to use this command.")
         return
 
-    current_data = db.get_current_month_data()
+    current_data = await bot_db.get_current_month_data()
     current_data["month"] = get_current_month()
     
-    active_machines = [m['name'] for m in db.load_machines() if m.get('active', False)]
+    active_machines = [m['name'] for m in await bot_db.load_machines() if m.get('active', False)]
     if active_machines:
         current_data["machine_of_the_month"] = random.choice(active_machines)
     else:
         current_data["machine_of_the_month"] = "None"
     
     current_data["scores"] = []
-    db.save_monthly_contest(current_data)
+    await bot_db.save_monthly_contest(current_data)
 
     await ctx.send(f"Monthly leaderboard reset! New Machine of the Month: **{current_data['machine_of_the_month']}**")
     
-    # Emit refresh event
-    socketio.emit('refresh', {'message': 'Monthly leaderboard reset'})
+    publish_monthly_reset(current_data["machine_of_the_month"])
     
 #TPG 01/18/25 - Changed logic to check if the person who clicked the button is one of the participants of the battle
 @bot.event
@@ -561,9 +826,6 @@ async def on_interaction(interaction):
         )
         return
 
-    # Update stats in database
-    db.update_stats(winner, loser)
-
     # Edit the original message to disable buttons
     original_message = await interaction.message.channel.fetch_message(message_id)
     updated_view = discord.ui.View()
@@ -575,12 +837,11 @@ async def on_interaction(interaction):
     )
     await original_message.edit(view=updated_view)
 
-    # Save battle to database with current time
+    # Save battle to database with current time (this also updates player stats)
     completion_time = get_eastern_time().strftime('%Y-%m-%d %H:%M:%S')
-    db.save_battle(winner, loser, battle.machines, completion_time)
-
-    # Emit refresh event
-    socketio.emit('refresh', {'message': 'Battle stats updated'})
+    battle_id = await bot_db.record_battle_result(battle.battle_id, winner, loser, battle.machines, completion_time)
+    publish_ongoing_removed(battle)
+    await bot_db.run(publish_battle_recorded, battle_id)
 
     # Send winner confirmation
     await interaction.response.send_message(
@@ -594,6 +855,7 @@ if __name__ == '__main__':
     def run_flask():
         # Modified to bind to all interfaces and use the PORT environment variable
         port = int(os.environ.get("PORT", 5000))
+        start_background_tasks()
         socketio.run(
             app,
             host='0.0.0.0',  # Bind to all interfaces
@@ -0,0 +1,117 @@
+# http_cache.py
+
+"""
+HTTP caching for the web app: per-route Cache-Control policies, ETags derived
+from data versions, and fingerprinted static URLs.
+
+    http_cache.init_app(app)
+
+    @app.route('/api/ongoing')
+    def api_ongoing():
+        return versioned_json(('ongoing', manager.version), lambda: [...])
+
+versioned_json / versioned_response answer If-None-Match with a 304 without
+building the body. ETags are salted with a hash of the app's code, templates
+and static files, which is the same in every worker of a release and changes
+when a new release may render the same data differently. Versions built from
+counters that live in one process (the ongoing battles) must also include
+PROCESS_TOKEN, since those restart from zero and differ between workers.
+
+Every response gets the Cache-Control of its view (set with @cache_policy),
+DEFAULT_POLICY otherwise. Static files requested through static_url() carry a
+content hash in `?v=` and are cached for a year.
+"""
+
+import functools
+import hashlib
+import json
+import os
+import uuid
+from typing import Callable, Hashable, Iterator
+
+from flask import current_app, request, url_for
+
+# Revalidate every time; with an ETag that is a 304 when nothing changed
+DEFAULT_POLICY = 'no-cache'
+PRIVATE_POLICY = 'private, no-cache'
+NO_STORE_POLICY = 'no-store'
+IMMUTABLE_POLICY = 'public, max-age=31536000, immutable'
+
+# Part of versions that come from in-process counters
+PROCESS_TOKEN = uuid.uuid4().hex
+
+def cache_policy(policy: str):
+    """Decorator setting the Cache-Control header of a view's responses"""
+    def decorator(view):
+        view.cache_policy = policy
+        return view
+    return decorator
+
+def apply_cache_policy(response):
+    view = current_app.view_functions.get(request.endpoint)
+    policy = getattr(view, 'cache_policy', None)
+    if policy is None:
+        if request.endpoint == 'static' and request.args.get('v'):
+            policy = IMMUTABLE_POLICY
+        else:
+            policy = DEFAULT_POLICY
+    response.headers['Cache-Control'] = policy
+    return response
+
+def _release_files(app) -> Iterator[str]:
+    """The app's Python modules, templates and static files, in a stable order"""
+    for name in sorted(os.listdir(app.root_path)):
+        if name.endswith('.py'):
+            yield os.path.join(app.root_path, name)
+    for folder in (app.template_folder, app.static_folder):
+        folder = os.path.join(app.root_path, folder)
+        for root, dirs, files in os.walk(folder):
+            dirs.sort()
+            for name in sorted(files):
+                yield os.path.join(root, name)
+
+@functools.lru_cache(maxsize=None)
+def _etag_salt(app) -> str:
+    digest = hashlib.blake2b(digest_size=12)
+    for path in _release_files(app):
+        digest.update(os.path.relpath(path, app.root_path).encode())
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def version_etag(version: Hashable) -> str:
+    salt = _etag_salt(current_app._get_current_object())
+    return hashlib.blake2b(f'{salt}:{request.path}:{version!r}'.encode(), digest_size=12).hexdigest()
+
+def versioned_response(version: Hashable, build: Callable, mimetype: str):
+    """
+    Response whose body build() returns (str or bytes), tagged with an ETag
+    for `version`. `version` must change whenever the body would.
+    """
+    etag = version_etag(version)
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(build(), mimetype=mimetype)
+    response.set_etag(etag)
+    return response
+
+def versioned_json(version: Hashable, build: Callable):
+    """Compact JSON of build() with an ETag for `version`"""
+    return versioned_response(
+        version, lambda: json.dumps(build(), separators=(',', ':')), 'application/json'
+    )
+
+@functools.lru_cache(maxsize=None)
+def _static_fingerprint(path: str, mtime: float) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=8).hexdigest()
+
+def static_url(filename: str) -> str:
+    """url_for('static') plus a content hash, so the file can be cached for good"""
+    path = os.path.join(current_app.static_folder, filename)
+    return url_for('static', filename=filename, v=_static_fingerprint(path, os.path.getmtime(path)))
+
+def init_app(app):
+    app.after_request(apply_cache_policy)
+    app.jinja_env.globals['static_url'] = static_url
@@ -0,0 +1,194 @@
+# machine_sampler.py
+
+"""
+Fair machine rotation for battles.
+
+Uniform random.sample() keeps handing out the same machines while others sit
+idle. MachineSampler instead weights every active machine by how often it was
+played in the last RECENT_BATTLES battles (weight = 1 / (1 + recent plays)), so
+idle machines come up more often.
+
+The recent-play counts are kept in memory and caught up from battle_machines
+whenever the database's 'battles' data version moved: only battles with a
+higher id than the last one counted are read, in id order, so battles recorded
+by other processes (workers, db-setup.py imports) are counted too. Draws come
+from a Walker alias table that is rebuilt (O(machines)) only after the weights
+or the catalog changed, so picking machines takes constant time no matter how
+long the battle history is. Picks limited to a candidate set (a theme's
+machines) do not use the table: they take the O(pool) weighted scan instead.
+
+    machines = db.pick_machines(3, players=("Alice", "Bob"), avoid_recent=True)
+
+With avoid_recent, machines that either player had in their last AVOID_BATTLES
+battles are skipped as long as enough other machines are left.
+"""
+
+import heapq
+import random
+import threading
+from collections import Counter, deque
+from typing import Deque, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+# Battles that count toward a machine's recent plays
+RECENT_BATTLES = 200
+
+# How many of a player's latest battles avoid_recent looks at
+AVOID_BATTLES = 5
+
+# Alias draws per machine picked before falling back to a scan of the pool
+MAX_DRAWS = 20
+
+class AliasTable:
+    """Walker's alias method (Vose's construction): O(1) draws from fixed weights"""
+    def __init__(self, items: Sequence, weights: Sequence[float]):
+        self.items = list(items)
+        count = len(self.items)
+        self.probability = [1.0] * count
+        self.alias = list(range(count))
+        if not count:
+            return
+
+        total = sum(weights)
+        scaled = [weight * count / total for weight in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            (small if scaled[more] < 1.0 else large).append(more)
+        # Whatever is left is 1.0 up to rounding error
+        for i in small + large:
+            self.probability[i] = 1.0
+
+    def draw(self, rng: random.Random):
+        i = rng.randrange(len(self.items))
+        return self.items[i] if rng.random() < self.probability[i] else self.items[self.alias[i]]
+
+class MachineSampler:
+    """Recent-play weights and alias table for one database, shared by its DBHelpers"""
+    def __init__(self, recent_battles: int = RECENT_BATTLES, avoid_battles: int = AVOID_BATTLES,
+                 rng: Optional[random.Random] = None):
+        self.recent_battles = recent_battles
+        self.avoid_battles = avoid_battles
+        self._rng = rng or random.Random()
+        self._synced_version: Optional[int] = None
+        self._last_battle_id = 0
+        self._window: Deque[Tuple[int, ...]] = deque()
+        self._plays: Counter = Counter()
+        self._player_recent: Dict[str, Deque[Tuple[int, ...]]] = {}
+        # Bumped whenever the weights change; part of the alias table's cache key
+        self._generation = 0
+        self._table_key = None
+        self._table: Optional[AliasTable] = None
+        self._lock = threading.Lock()
+
+    def sync(self, version: int, loader):
+        """
+        Count the battles committed since the last sync. `version` is the
+        database's 'battles' data version; nothing is read while it stays the
+        same. `loader(after_id, limit)` returns the latest `limit` battles with
+        an id above after_id, oldest first, as (battle id, winner, loser, machine ids).
+        """
+        if version == self._synced_version:
+            return
+        with self._lock:
+            if version == self._synced_version:
+                return
+            battles = loader(self._last_battle_id, self.recent_battles)
+            if len(battles) == self.recent_battles:
+                # The new battles fill the whole window on their own
+                self._window.clear()
+                self._plays.clear()
+            for battle in battles:
+                self._record(*battle)
+            self._synced_version = version
+
+    def _record(self, battle_id, winner, loser, machine_ids):
+        self._last_battle_id = battle_id
+        machine_ids = tuple(machine_ids)
+
+        self._window.append(machine_ids)
+        self._plays.update(machine_ids)
+        if len(self._window) > self.recent_battles:
+            evicted = self._window.popleft()
+            self._plays.subtract(evicted)
+            for machine_id in evicted:
+                if self._plays[machine_id] <= 0:
+                    del self._plays[machine_id]
+
+        for player in (winner, loser):
+            recent = self._player_recent.get(player)
+            if recent is None:
+                recent = self._player_recent[player] = deque(maxlen=self.avoid_battles)
+            recent.append(machine_ids)
+        self._generation += 1
+
+    def weight(self, machine_id: int) -> float:
+        return 1.0 / (1 + self._plays[machine_id])
+
+    def recent_machines(self, *players: str) -> Set[int]:
+        """Machines any of the players had in their last avoid_battles battles"""
+        return {
+            machine_id
+            for player in players
+            for machine_ids in self._player_recent.get(player, ())
+            for machine_id in machine_ids
+        }
+
+    def _alias_table(self, snapshot) -> AliasTable:
+        key = (snapshot.version, self._generation)
+        if self._table_key != key:
+            machines = snapshot.active
+            self._table = AliasTable(machines, [self.weight(machine['id']) for machine in machines])
+            self._table_key = key
+        return self._table
+
+    def _weighted_sample(self, machines: List[Dict], count: int) -> List[Dict]:
+        # Weighted sampling without replacement (Efraimidis-Spirakis keys)
+        return heapq.nlargest(
+            count, machines, key=lambda machine: self._rng.random() ** (1.0 / self.weight(machine['id']))
+        )
+
+    def sample(self, snapshot, count: int, players: Sequence[str] = (), avoid_recent: bool = False,
+               candidates: Optional[Iterable[int]] = None) -> List[Dict]:
+        """
+        Pick up to `count` distinct active machines of the snapshot, weighted toward
+        the least recently played. `candidates` limits the pick to those machine ids;
+        such picks scan the candidates (O(len(candidates))) instead of drawing from
+        the alias table, which covers the whole active catalog.
+        """
+        with self._lock:
+            avoided = self.recent_machines(*players) if avoid_recent else set()
+            chosen: List[Dict] = []
+            chosen_ids: Set[int] = set()
+
+            if candidates is None:
+                pool = snapshot.active
+                if pool:
+                    table = self._alias_table(snapshot)
+                    for _ in range(MAX_DRAWS * count):
+                        if len(chosen) == count:
+                            break
+                        machine = table.draw(self._rng)
+                        if machine['id'] in avoided or machine['id'] in chosen_ids:
+                            continue
+                        chosen.append(machine)
+                        chosen_ids.add(machine['id'])
+            else:
+                pool = [machine for machine in map(snapshot.by_id.get, candidates) if machine and machine['active']]
+
+            # Candidate lists, and alias draws that kept hitting avoided machines,
+            # are finished from the pool: machines not avoided first, then the rest
+            for allow_avoided in (False, True):
+                if len(chosen) == count:
+                    break
+                remaining = [
+                    machine for machine in pool
+                    if machine['id'] not in chosen_ids and (allow_avoided or machine['id'] not in avoided)
+                ]
+                for machine in self._weighted_sample(remaining, count - len(chosen)):
+                    chosen.append(machine)
+                    chosen_ids.add(machine['id'])
+            return chosen
@@ -0,0 +1,79 @@
+# page_cache.py
+
+"""
+Rendered pages and page fragments kept as ready-made bytes.
+
+Each entry is built for one variant (e.g. a leaderboard type) at one data
+version. Serving it is a dictionary lookup plus a version comparison; when the
+version has moved on, the entry is rebuilt on the next request, or earlier by
+a background warm-up after the write that changed it.
+
+The warm-up runs in one long-lived task started with Warmer.start() at server
+startup; schedule() only raises a flag, so any thread (web or bot) may call it.
+"""
+
+import threading
+from typing import Callable, Dict, Hashable, Tuple
+
+class VersionedCache:
+    def __init__(self):
+        self._entries: Dict[Hashable, Tuple[Hashable, bytes]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, variant: Hashable, version: Hashable, build: Callable) -> bytes:
+        """The cached value of `variant` if it was built at `version`, else build(variant)"""
+        entry = self._entries.get(variant)
+        if entry is not None and entry[0] == version:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        # Callers read `version` before building, so a write that lands while
+        # building leaves this entry behind the new version and it is rebuilt
+        value = build(variant)
+        self._entries[variant] = (version, value)
+        return value
+
+    def stats(self) -> Dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+class Warmer:
+    """Runs `warm` in the background after writes, at most one run queued at a time"""
+    def __init__(self, warm: Callable, start_task: Callable, sleep: Callable, interval: float = 0.2):
+        """
+        start_task(fn) runs fn in the background and sleep(seconds) pauses it
+        (socketio.start_background_task and socketio.sleep). The task checks
+        for scheduled runs every `interval` seconds.
+        """
+        self._warm = warm
+        self._start_task = start_task
+        self._sleep = sleep
+        self.interval = interval
+        self._pending = False
+        self._started = False
+        self._lock = threading.Lock()
+
+    def schedule(self, *args):
+        with self._lock:
+            self._pending = True
+
+    def start(self):
+        """Start the warm-up task; call once from the server's thread before serving"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self._start_task(self._run)
+
+    def _run(self):
+        while True:
+            self._sleep(self.interval)
+            with self._lock:
+                pending, self._pending = self._pending, False
+            if not pending:
+                continue
+            try:
+                self._warm()
+            except Exception as e:
+                # The next request builds the page itself
+                print(f"Error warming page cache: {e}")
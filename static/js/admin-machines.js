@@ -0,0 +1,345 @@
+const editModal = new bootstrap.Modal(document.getElementById('editModal'));
+let allMachines = [];
+const selected = new Set();
+const page = { offset: 0, limit: 50, total: 0 };
+// Change log version the list is up to date with
+let changeVersion = 0;
+
+// Fetch the current page; filtering, sorting and paging happen on the server
+async function fetchMachines() {
+    const params = new URLSearchParams({ offset: page.offset, limit: page.limit });
+    const query = document.getElementById('machineSearch').value.trim();
+    const filter = document.querySelector('input[name="filter"]:checked').id;
+    const manufacturer = document.getElementById('manufacturerFilter').value;
+    const tag = document.getElementById('tagFilter').value;
+    if (query) params.set('q', query);
+    if (filter === 'showActive') params.set('active', 'true');
+    if (filter === 'showInactive') params.set('active', 'false');
+    if (manufacturer) params.set('manufacturer', manufacturer);
+    if (tag) params.set('tag', tag);
+    params.set('sort', document.getElementById('machineSort').value);
+
+    const response = await fetch(`/admin/machines?${params}`);
+    const data = await response.json();
+    allMachines = data.machines;
+    page.total = data.total;
+    changeVersion = data.version;
+    displayMachines();
+}
+
+// Whether a machine belongs in the list under the filters the browser can check
+function matchesFilters(machine) {
+    const filter = document.querySelector('input[name="filter"]:checked').id;
+    const manufacturer = document.getElementById('manufacturerFilter').value;
+    const tag = document.getElementById('tagFilter').value;
+    if (filter === 'showActive' && !machine.active) return false;
+    if (filter === 'showInactive' && machine.active) return false;
+    if (manufacturer && machine.manufacturer !== manufacturer) return false;
+    if (tag && !machine.tags.includes(tag)) return false;
+    return true;
+}
+
+// Apply machines changed since changeVersion (by anyone) to the current page
+async function fetchChanges() {
+    const response = await fetch(`/admin/machines/changes?since=${changeVersion}`);
+    if (!response.ok) return;
+    const data = await response.json();
+    if (data.reset) {
+        fetchMachines();
+        return;
+    }
+
+    // Changes outside this page can move rows in or out of it: refetch just the page
+    let refetch = false;
+    data.changed.forEach(machine => {
+        const i = allMachines.findIndex(m => m.id === machine.id);
+        if (i >= 0) {
+            allMachines[i] = machine;
+        } else if (matchesFilters(machine)) {
+            refetch = true;
+        }
+    });
+    data.deleted.forEach(id => {
+        selected.delete(id);
+        if (allMachines.some(m => m.id === id)) {
+            allMachines = allMachines.filter(m => m.id !== id);
+            page.total -= 1;
+        } else {
+            refetch = true;
+        }
+    });
+    changeVersion = data.version;
+    if (refetch) {
+        fetchMachines();
+    } else if (data.changed.length || data.deleted.length) {
+        displayMachines();
+    }
+}
+
+async function fetchFacets() {
+    const response = await fetch('/admin/machines/facets');
+    const facets = await response.json();
+    [['manufacturerFilter', facets.manufacturers], ['tagFilter', facets.tags]].forEach(([id, values]) => {
+        const select = document.getElementById(id);
+        const current = select.value;
+        select.length = 1;
+        values.forEach(value => select.add(new Option(value, value)));
+        select.value = values.includes(current) ? current : '';
+    });
+}
+
+function updatePager() {
+    const first = page.total ? page.offset + 1 : 0;
+    const last = Math.min(page.offset + allMachines.length, page.total);
+    document.getElementById('pageInfo').textContent = `${first}-${last} of ${page.total}`;
+    document.getElementById('prevPage').disabled = page.offset === 0;
+    document.getElementById('nextPage').disabled = page.offset + page.limit >= page.total;
+}
+
+function reloadFromFirstPage() {
+    page.offset = 0;
+    fetchMachines();
+}
+
+function displayMachines() {
+    const table = document.getElementById('machineTable');
+    table.innerHTML = '';
+
+    // Rows changed since the page was fetched may no longer match
+    allMachines.filter(matchesFilters).forEach(machine => {
+        const row = document.createElement('tr');
+        if (!machine.active) {
+            row.classList.add('inactive-row');
+        }
+        row.innerHTML = `
+            <td>
+                <input type="checkbox" class="form-check-input" ${selected.has(machine.id) ? 'checked' : ''}
+                       onchange="toggleSelected(${machine.id}, this.checked)">
+            </td>
+            <td>${machine.name}</td>
+            <td>${machine.manufacturer || ''}</td>
+            <td>
+                <span class="status-badge ${machine.active ? 'status-active' : 'status-inactive'}">
+                    ${machine.active ? 'Active' : 'Inactive'}
+                </span>
+            </td>
+            <td>${machine.tags ? machine.tags.join(', ') : ''}</td>
+            <td>
+                <button class="btn btn-sm btn-warning" onclick="editMachine(${JSON.stringify(machine).replace(/"/g, '&quot;')})">Edit</button>
+                <button class="btn btn-sm btn-danger" onclick="deleteMachine(${machine.id})">Delete</button>
+            </td>
+        `;
+        table.appendChild(row);
+    });
+    updatePager();
+}
+
+function toggleSelected(machineId, checked) {
+    if (checked) {
+        selected.add(machineId);
+    } else {
+        selected.delete(machineId);
+    }
+}
+
+// Send operations to the bulk endpoint and patch the local list with
+// whatever succeeded, instead of reloading every machine
+async function applyOperations(operations) {
+    const response = await fetch('/admin/machines/bulk', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ operations }),
+    });
+    const data = await response.json();
+    if (!response.ok) {
+        alert(data.message);
+        return [];
+    }
+
+    const errors = [];
+    data.results.forEach((result, i) => {
+        const operation = operations[i];
+        if (result.status !== 'success') {
+            errors.push(`${operation.name || operation.id}: ${result.message}`);
+        }
+    });
+    document.getElementById('bulkMessage').textContent = errors.join('; ');
+
+    // Our own edits arrive through the change feed like everyone else's
+    await fetchChanges();
+    if (operations.some(operation => operation.tags)) {
+        fetchFacets();
+    }
+    return data.results;
+}
+
+document.getElementById('addMachine').addEventListener('click', async () => {
+    const name = document.getElementById('machineName').value;
+    const tags = document.getElementById('machineTags').value.split(',').map(tag => tag.trim()).filter(tag => tag);
+    const active = document.getElementById('machineActive').checked;
+
+    const results = await applyOperations([{ action: 'add', name, tags, active }]);
+    if (results.length && results[0].status === 'success') {
+        document.getElementById('machineForm').reset();
+    }
+});
+
+async function deleteMachine(machineId) {
+    if (confirm('Are you sure you want to delete this machine?')) {
+        await applyOperations([{ action: 'delete', id: machineId }]);
+    }
+}
+
+async function setSelectedActive(active) {
+    const operations = [...selected].map(id => ({ action: 'activate', id, active }));
+    if (operations.length) {
+        await applyOperations(operations);
+    }
+}
+
+document.getElementById('activateSelected').addEventListener('click', () => setSelectedActive(true));
+document.getElementById('deactivateSelected').addEventListener('click', () => setSelectedActive(false));
+
+document.getElementById('selectAll').addEventListener('change', (event) => {
+    document.querySelectorAll('#machineTable input[type="checkbox"]').forEach(box => {
+        box.checked = event.target.checked;
+        box.onchange();
+    });
+});
+
+function editMachine(machine) {
+    document.getElementById('editMachineId').value = machine.id;
+    document.getElementById('editMachineName').value = machine.name;
+    document.getElementById('editMachineTags').value = machine.tags ? machine.tags.join(', ') : '';
+    document.getElementById('editMachineActive').checked = machine.active;
+    editModal.show();
+}
+
+document.getElementById('saveEdit').addEventListener('click', async () => {
+    const id = Number(document.getElementById('editMachineId').value);
+    const name = document.getElementById('editMachineName').value;
+    const tags = document.getElementById('editMachineTags').value.split(',').map(tag => tag.trim()).filter(tag => tag);
+    const active = document.getElementById('editMachineActive').checked;
+
+    const results = await applyOperations([{ action: 'update', id, name, active, tags }]);
+    if (results.length && results[0].status === 'success') {
+        editModal.hide();
+    }
+});
+
+// Search on the server as the user types
+let searchTimer = null;
+document.getElementById('machineSearch').addEventListener('input', () => {
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(reloadFromFirstPage, 200);
+});
+
+// Any filter or sort change starts again from the first page
+document.querySelectorAll('input[name="filter"]').forEach(radio => {
+    radio.addEventListener('change', reloadFromFirstPage);
+});
+['manufacturerFilter', 'tagFilter', 'machineSort'].forEach(id => {
+    document.getElementById(id).addEventListener('change', reloadFromFirstPage);
+});
+
+document.getElementById('prevPage').addEventListener('click', () => {
+    page.offset = Math.max(0, page.offset - page.limit);
+    fetchMachines();
+});
+document.getElementById('nextPage').addEventListener('click', () => {
+    page.offset += page.limit;
+    fetchMachines();
+});
+
+fetchFacets();
+fetchMachines();
+
+// Keep up with other staff editing the catalog
+setInterval(fetchChanges, 5000);
+
+let allThemes = [];
+
+async function fetchThemes() {
+    const response = await fetch('/admin/themes');
+    allThemes = await response.json();
+    const table = document.getElementById('themeTable');
+    table.innerHTML = '';
+    allThemes.forEach(theme => {
+        const row = document.createElement('tr');
+        if (!theme.active) {
+            row.classList.add('inactive-row');
+        }
+        row.innerHTML = `
+            <td>${theme.name}</td>
+            <td>
+                <span class="status-badge ${theme.active ? 'status-active' : 'status-inactive'}">
+                    ${theme.active ? 'Active' : 'Inactive'}
+                </span>
+            </td>
+            <td>${theme.error ? `<span class="text-danger">${theme.error}</span>` : theme.machine_count}</td>
+            <td><code>${JSON.stringify(theme.rules)}</code></td>
+            <td>
+                <button class="btn btn-sm btn-warning" onclick="editTheme(${theme.id})">Edit</button>
+                <button class="btn btn-sm btn-danger" onclick="deleteTheme(${theme.id})">Delete</button>
+            </td>
+        `;
+        table.appendChild(row);
+    });
+}
+
+function editTheme(themeId) {
+    const theme = allThemes.find(t => t.id === themeId);
+    document.getElementById('themeId').value = theme.id;
+    document.getElementById('themeName').value = theme.name;
+    document.getElementById('themeRules').value = JSON.stringify(theme.rules, null, 2);
+    document.getElementById('themeActive').checked = theme.active;
+}
+
+async function deleteTheme(themeId) {
+    if (confirm('Are you sure you want to delete this theme?')) {
+        await fetch('/admin/themes', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ action: 'delete', id: themeId }),
+        });
+        fetchThemes();
+    }
+}
+
+document.getElementById('clearTheme').addEventListener('click', () => {
+    document.getElementById('themeForm').reset();
+    document.getElementById('themeId').value = '';
+    document.getElementById('themeError').textContent = '';
+});
+
+document.getElementById('saveTheme').addEventListener('click', async () => {
+    const errorLabel = document.getElementById('themeError');
+    let rules;
+    try {
+        rules = JSON.parse(document.getElementById('themeRules').value);
+    } catch (e) {
+        errorLabel.textContent = 'Rules are not valid JSON.';
+        return;
+    }
+    const id = document.getElementById('themeId').value;
+    const response = await fetch('/admin/themes', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+            action: id ? 'update' : 'add',
+            id: id ? parseInt(id) : undefined,
+            name: document.getElementById('themeName').value,
+            rules,
+            active: document.getElementById('themeActive').checked
+        }),
+    });
+    const result = await response.json();
+    if (result.status !== 'success') {
+        errorLabel.textContent = result.message;
+        return;
+    }
+    document.getElementById('clearTheme').click();
+    fetchThemes();
+});
+
+fetchThemes();
@@ -0,0 +1,262 @@
+const socket = io();
+const leaderboardType = new URLSearchParams(window.location.search).get('leaderboard_type') || 'all_time';
+
+// Join the rooms of the panels on this page (again after every reconnect);
+// the server then only sends events that change them
+socket.on('connect', () => {
+  socket.emit('subscribe', [`leaderboard:${leaderboardType}`, 'battles', 'ongoing', 'monthly']);
+});
+
+// Reorder the rows of a tbody by a numeric data attribute, highest first,
+// and renumber the rank column
+function rerank(tbody, key) {
+  let rows = Array.from(tbody.querySelectorAll('tr[data-player]'));
+  rows.sort((a, b) => Number(b.dataset[key]) - Number(a.dataset[key]));
+  rows.forEach((row, i) => {
+    row.cells[0].textContent = i + 1;
+    tbody.appendChild(row);
+  });
+}
+
+function findRow(container, attribute, value) {
+  return Array.from(container.querySelectorAll(`[${attribute}]`))
+    .find(element => element.getAttribute(attribute) === String(value));
+}
+
+// Every event carries a list of changes, coalesced by the server (broadcaster.py)
+
+// [{player, wins, losses}]: new standings of players who just battled
+socket.on('leaderboard_update', entries => {
+  let tbody = document.getElementById('leaderboardTable').tBodies[0];
+  entries.forEach(entry => {
+    let row = findRow(tbody, 'data-player', entry.player);
+    if (!row) {
+      row = tbody.insertRow();
+      row.dataset.player = entry.player;
+      for (let i = 0; i < 4; i++) {
+        row.insertCell();
+      }
+      row.cells[1].textContent = entry.player.split('#')[0];
+    }
+    row.dataset.wins = entry.wins;
+    row.cells[2].innerHTML = `<i class="fas fa-trophy"></i> ${Number(entry.wins)}`;
+    row.cells[3].innerHTML = `<i class="fas fa-skull"></i> ${Number(entry.losses)}`;
+  });
+  rerank(tbody, 'wins');
+  filterLeaderboard();
+});
+
+// [battle]: battles just recorded, oldest first; added to the top of Recent Battles
+socket.on('battle_recorded', battles => {
+  let tbody = document.getElementById('recentBattlesTable').tBodies[0];
+  battles.forEach(battle => {
+    if (findRow(tbody, 'data-battle-id', battle.id)) {
+      return;
+    }
+    let placeholder = document.getElementById('noRecentBattles');
+    if (placeholder) {
+      placeholder.remove();
+    }
+    let row = tbody.insertRow(0);
+    row.dataset.battleId = battle.id;
+    [battle.winner, battle.loser, battle.time, battle.machine_names].forEach(value => {
+      row.insertCell().textContent = value;
+    });
+  });
+  filterRecentBattles();
+});
+
+// [{battle_id, status: 'added' | 'removed', player1, player2, machine_names}]
+socket.on('ongoing_changed', changes => {
+  let list = document.getElementById('ongoingBattlesList');
+  let placeholder = document.getElementById('noOngoingBattles');
+  changes.forEach(battle => {
+    let item = findRow(list, 'data-battle-id', battle.battle_id);
+    if (battle.status === 'removed') {
+      if (item) {
+        item.remove();
+      }
+      return;
+    }
+    if (item) {
+      return;
+    }
+    item = document.createElement('li');
+    item.className = 'list-group-item bg-dark text-center text-light';
+    item.dataset.battleId = battle.battle_id;
+    let players = document.createElement('div');
+    players.className = 'sparkle';
+    players.textContent = `${battle.player1} vs ${battle.player2}`;
+    let machines = document.createElement('div');
+    machines.style.cssText = 'font-size: 1rem; color: #76c442; margin-top: 10px;';
+    machines.textContent = `On machines: ${battle.machine_names}`;
+    item.append(players, machines);
+    list.insertBefore(item, placeholder);
+  });
+  placeholder.style.display = list.querySelector('li[data-battle-id]') ? 'none' : '';
+});
+
+// [{player, score} | {reset: true, machine_of_the_month}]: submitted scores
+// (the table keeps each player's best) and monthly resets, in order
+socket.on('monthly_changed', changes => {
+  let tbody = document.getElementById('monthlyScoresTable').tBodies[0];
+  let placeholder = document.getElementById('noMonthlyScores');
+  changes.forEach(change => {
+    if (change.reset) {
+      tbody.querySelectorAll('tr[data-player]').forEach(row => row.remove());
+      document.getElementById('machineOfTheMonth').textContent = change.machine_of_the_month;
+      return;
+    }
+    let row = findRow(tbody, 'data-player', change.player);
+    if (!row) {
+      row = tbody.insertRow(0);
+      row.dataset.player = change.player;
+      row.dataset.score = 0;
+      for (let i = 0; i < 3; i++) {
+        row.insertCell();
+      }
+      row.cells[1].textContent = change.player;
+    }
+    if (change.score >= Number(row.dataset.score)) {
+      row.dataset.score = change.score;
+      row.cells[2].textContent = Number(change.score).toLocaleString('en-US');
+    }
+  });
+  rerank(tbody, 'score');
+  tbody.appendChild(placeholder);
+  placeholder.style.display = tbody.querySelector('tr[data-player]') ? 'none' : '';
+});
+
+// Simple client-side filter for Leaderboard
+function filterLeaderboard() {
+  let input = document.getElementById('searchInput');
+  let filter = input.value.toUpperCase();
+  let table = document.getElementById('leaderboardTable');
+  let tr = table.getElementsByTagName('tr');
+
+  // Skip the header (i=0)
+  for (let i = 1; i < tr.length; i++) {
+    let tdRank = tr[i].getElementsByTagName('td')[0];
+    let tdPlayer = tr[i].getElementsByTagName('td')[1];
+    if (tdRank && tdPlayer) {
+      let rankText = tdRank.textContent || tdRank.innerText;
+      let playerText = tdPlayer.textContent || tdPlayer.innerText;
+
+      if (
+        rankText.toUpperCase().indexOf(filter) > -1 ||
+        playerText.toUpperCase().indexOf(filter) > -1
+      ) {
+        tr[i].style.display = '';
+      } else {
+        tr[i].style.display = 'none';
+      }
+    }
+  }
+}
+
+// Filter & limit the Recent Battles
+function filterRecentBattles() {
+  let searchInput = document.getElementById('battleSearchInput');
+  let filter = searchInput.value.toUpperCase();
+
+  let table = document.getElementById('recentBattlesTable');
+  let tr = table.getElementsByTagName('tr');
+
+  let maxCount = parseInt(document.getElementById('battleCount').value) || 5;
+  let visibleCount = 0;
+
+  // Skip the header (i=0)
+  for (let i = 1; i < tr.length; i++) {
+    let tdWinner = tr[i].getElementsByTagName('td')[0];
+    let tdLoser  = tr[i].getElementsByTagName('td')[1];
+
+    // If there's a "No recent battles found." row, handle it separately
+    // that row might have colspan="4"
+    if (!tdLoser) {
+      // Probably the "No recent battles" row
+      tr[i].style.display = 'none';
+      continue;
+    }
+
+    let winnerText = tdWinner.textContent || tdWinner.innerText;
+    let loserText  = tdLoser.textContent  || tdLoser.innerText;
+
+    // Check if row matches the filter and we haven't reached maxCount
+    if (
+      (winnerText.toUpperCase().indexOf(filter) > -1 ||
+       loserText.toUpperCase().indexOf(filter) > -1) &&
+       visibleCount < maxCount
+    ) {
+      tr[i].style.display = '';
+      visibleCount++;
+    } else {
+      tr[i].style.display = 'none';
+    }
+  }
+}
+
+// Fetch the next page of battles from /api/battles and append it
+async function loadMoreBattles() {
+  let table = document.getElementById('recentBattlesTable');
+  let button = document.getElementById('loadMoreBattles');
+  if (!table.dataset.beforeId) {
+    return;
+  }
+
+  button.disabled = true;
+  let params = new URLSearchParams({
+    before_time: table.dataset.beforeTime,
+    before_id: table.dataset.beforeId
+  });
+  let response = await fetch(`/api/battles?${params}`);
+  let page = await response.json();
+
+  let tbody = table.getElementsByTagName('tbody')[0];
+  page.battles.forEach(battle => {
+    let row = tbody.insertRow();
+    row.dataset.battleId = battle.id;
+    [battle.winner, battle.loser, battle.time, battle.machine_names].forEach(value => {
+      row.insertCell().textContent = value;
+    });
+  });
+
+  // Show the newly loaded rows along with the ones already visible
+  let countInput = document.getElementById('battleCount');
+  countInput.value = (parseInt(countInput.value) || 5) + page.battles.length;
+
+  if (page.next) {
+    table.dataset.beforeTime = page.next.before_time;
+    table.dataset.beforeId = page.next.before_id;
+    button.disabled = false;
+  } else {
+    delete table.dataset.beforeTime;
+    delete table.dataset.beforeId;
+    button.style.display = 'none';
+  }
+  filterRecentBattles();
+}
+
+// Leaderboard type selection
+document.addEventListener('DOMContentLoaded', () => {
+  // Get the leaderboard type from the URL
+  const urlParams = new URLSearchParams(window.location.search);
+  const leaderboardType = urlParams.get('leaderboard_type');
+
+  if (leaderboardType) {
+    const selectElement = document.getElementById('leaderboardTypeSelect');
+    selectElement.value = leaderboardType;
+  }
+
+  function updateLeaderboardType() {
+    const selectedType = document.getElementById('leaderboardTypeSelect').value;
+    window.location.href = `/?leaderboard_type=${selectedType}`;
+  }
+
+  // Attach the event listener
+  document.getElementById('leaderboardTypeSelect').addEventListener('change', updateLeaderboardType);
+});
+
+// Run once on page load (so the table is limited to 5 by default)
+document.addEventListener('DOMContentLoaded', () => {
+  filterRecentBattles();
+});
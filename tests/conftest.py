@@ -0,0 +1,25 @@
+import importlib.util
+import os
+import sqlite3
+import sys
+
+import pytest
+
+# The modules live at the top of the repository, next to goblinbattle.py
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def load_db_setup():
+    spec = importlib.util.spec_from_file_location('db_setup', os.path.join(ROOT, 'db-setup.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+@pytest.fixture
+def base_database(tmp_path):
+    """Path and connection of a database with db-setup.py's tables and no migrations applied"""
+    path = str(tmp_path / 'goblin_battle.db')
+    conn = sqlite3.connect(path, isolation_level=None)
+    load_db_setup().create_tables(conn.cursor())
+    yield path, conn
+    conn.close()
@@ -0,0 +1,20 @@
+import db_utils
+
+def test_pages_keep_battles_without_machines(base_database):
+    path, setup = base_database
+    setup.executemany('INSERT INTO players (name) VALUES (?)', [('Amy',), ('Zed',)])
+    setup.execute("INSERT INTO machines (name) VALUES ('Medieval Madness')")
+    setup.executemany('INSERT INTO battles (winner_id, loser_id, battle_time) VALUES (1, 2, ?)',
+                      [(f'2024-01-0{day} 20:00:00',) for day in range(1, 6)])
+    # Only the odd battles were played on a recorded machine
+    setup.executemany('INSERT INTO battle_machines (battle_id, machine_id) VALUES (?, 1)', [(1,), (3,), (5,)])
+
+    db = db_utils.DBHelper(path)
+    first = db.load_battle_history(limit=2)
+    assert [battle['id'] for battle in first] == [5, 4]
+    assert first[1]['machines'] == [] and first[1]['machine_names'] == ''
+
+    last = first[-1]
+    rest = db.load_battle_history(limit=10, before_time=last['battle_time'], before_id=last['id'])
+    assert [battle['id'] for battle in rest] == [3, 2, 1]
+    assert rest[0]['machines'][0]['name'] == 'Medieval Madness'
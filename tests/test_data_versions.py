@@ -0,0 +1,76 @@
+from datetime import datetime
+import sqlite3
+
+import db_utils
+
+def test_catalog_sees_writes_from_other_connections(base_database):
+    path, setup = base_database
+    setup.executemany('INSERT INTO machines (name, flippers) VALUES (?, ?)',
+                      [('Attack from Mars', 2), ('Medieval Madness', 3), ('Twilight Zone', 3)])
+
+    db = db_utils.DBHelper(path)
+    db.versions.recheck_interval = 60
+    snapshot = db.catalog_snapshot()
+    rules = [{'field': 'flippers', 'op': 'ge', 'value': 3}]
+    assert len(db.filter_machines(rules)) == 2
+
+    # Another process (here: another connection) edits the catalog directly
+    other = sqlite3.connect(path)
+    with other:
+        other.execute("UPDATE machines SET active = false WHERE name = 'Twilight Zone'")
+
+    # Until the next recheck, lookups are served from memory without a query
+    statements = []
+    db.connections.acquire().set_trace_callback(statements.append)
+    assert len(db.load_machines()) == 3
+    assert db.catalog_snapshot() is snapshot
+    assert statements == []
+
+    db.versions.recheck_interval = 0
+    assert db.catalog.version > snapshot.version
+    assert len(db.catalog_snapshot().active) == 2
+    assert len(db.filter_machines(rules)) == 1
+    assert db.catalog_columns().version == db.catalog.version
+
+    themes_version = db.versions.get('themes')
+    with other:
+        other.execute("INSERT INTO themes (name, rules) VALUES ('Three flippers', '[]')")
+    assert db.versions.get('themes') == themes_version + 1
+
+def test_current_contest_sees_contests_saved_elsewhere(base_database):
+    path, setup = base_database
+    setup.executemany('INSERT INTO machines (name) VALUES (?)', [('Attack from Mars',), ('Medieval Madness',)])
+
+    db = db_utils.DBHelper(path)
+    db.versions.recheck_interval = 0
+    assert db.get_current_contest() is None
+
+    month = datetime.now().strftime('%Y-%m')
+    other = sqlite3.connect(path)
+    with other:
+        other.execute('INSERT INTO monthly_contests (month, machine_id) VALUES (?, 1)', (month,))
+    assert db.get_current_contest()[1:] == (month, 'Attack from Mars')
+
+    with other:
+        other.execute('INSERT INTO monthly_contests (month, machine_id) VALUES (?, 2)', (month,))
+    assert db.get_current_contest()[2] == 'Medieval Madness'
+
+def test_score_submissions_keep_the_contest_cached(base_database):
+    path, setup = base_database
+    setup.execute("INSERT INTO machines (name) VALUES ('Attack from Mars')")
+    setup.execute("INSERT INTO players (name) VALUES ('Amy')")
+    setup.execute('INSERT INTO monthly_contests (month, machine_id) VALUES (?, 1)', (datetime.now().strftime('%Y-%m'),))
+
+    db = db_utils.DBHelper(path)
+    assert db.submit_monthly_score('Amy', 100) == 'Attack from Mars'
+
+    statements = []
+    db.connections.acquire().set_trace_callback(statements.append)
+    db.submit_monthly_score('Amy', 50)
+    db.submit_monthly_score('Zed', 70)
+    assert not [statement for statement in statements if 'monthly_contests' in statement]
+
+    scores = setup.execute('''
+        SELECT p.name, ms.score FROM monthly_scores ms JOIN players p ON p.id = ms.player_id ORDER BY p.name
+    ''').fetchall()
+    assert scores == [('Amy', 100), ('Zed', 70)]
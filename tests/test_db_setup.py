@@ -0,0 +1,29 @@
+import db_utils
+from conftest import load_db_setup
+
+def battle(time, *machines):
+    return {'winner': 'Amy', 'loser': 'Zed', 'time': time, 'machines': [{'name': name} for name in machines]}
+
+def test_reimport_leaves_machines_of_existing_battles_alone(base_database):
+    _, conn = base_database
+    db_utils.apply_migrations(conn)
+    db_setup = load_db_setup()
+    cursor = conn.cursor()
+    conn.execute('BEGIN')
+    assert db_setup.populate_battles(cursor, [battle('2024-01-01 20:00:00', 'Funhouse')], 10, 'first') == 1
+
+    # Another archive lists the same battle with other machines, plus a new one twice
+    archive = [
+        battle('2024-01-01 20:00:00', 'Twilight Zone'),
+        battle('2024-01-02 20:00:00', 'Medieval Madness'),
+        battle('2024-01-02 20:00:00', 'Attack from Mars'),
+    ]
+    assert db_setup.populate_battles(cursor, archive, 10, 'second') == 1
+    conn.execute('COMMIT')
+
+    links = cursor.execute('''
+        SELECT b.battle_time, m.name FROM battle_machines bm
+        JOIN battles b ON b.id = bm.battle_id JOIN machines m ON m.id = bm.machine_id
+        ORDER BY b.battle_time
+    ''').fetchall()
+    assert links == [('2024-01-01 20:00:00', 'Funhouse'), ('2024-01-02 20:00:00', 'Medieval Madness')]
@@ -0,0 +1,29 @@
+import sqlite3
+
+import db_utils
+
+def test_sampler_counts_battles_from_every_writer(base_database):
+    path, setup = base_database
+    setup.executemany('INSERT INTO machines (name) VALUES (?)',
+                      [('Attack from Mars',), ('Medieval Madness',), ('Twilight Zone',), ('Funhouse',)])
+
+    db = db_utils.DBHelper(path)
+    db.versions.recheck_interval = 0
+    assert len(db.pick_machines(3)) == 3
+    assert db.sampler.weight(1) == 1.0
+
+    # A battle recorded by another process
+    other = sqlite3.connect(path)
+    with other:
+        other.executemany('INSERT INTO players (name) VALUES (?)', [('Amy',), ('Zed',)])
+        other.execute("INSERT INTO battles (winner_id, loser_id, battle_time) VALUES (1, 2, '2024-01-01 20:00:00')")
+        other.execute('INSERT INTO battle_machines (battle_id, machine_id, position) VALUES (1, 1, 0)')
+    db.pick_machines(3)
+    assert db.sampler.weight(1) == 0.5
+    assert db.sampler.recent_machines('Amy') == {1}
+
+    # And one recorded by this process
+    db.record_battle_result('battle-2', 'Zed', 'Amy', [db.get_machine_by_id(2)])
+    db.pick_machines(3)
+    assert db.sampler.weight(2) == 0.5
+    assert db.sampler.recent_machines('Zed') == {1, 2}
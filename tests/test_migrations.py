@@ -0,0 +1,43 @@
+import json
+
+import db_utils
+import themes
+
+def test_migrations_merge_duplicate_machines(base_database):
+    _, conn = base_database
+    cursor = conn.cursor()
+    # The same two machines imported twice, each copy with its own links
+    for name in ('Medieval Madness', 'Twilight Zone') * 2:
+        cursor.execute('INSERT INTO machines (name) VALUES (?)', (name,))
+    cursor.execute("INSERT INTO tags (name) VALUES ('castle'), ('clock')")
+    cursor.executemany('INSERT INTO machine_tags (machine_id, tag_id) VALUES (?, ?)',
+                       [(1, 1), (3, 1), (3, 2), (4, 2)])
+    cursor.execute("INSERT INTO players (name) VALUES ('Alice'), ('Bob')")
+    cursor.execute("INSERT INTO battles (winner_id, loser_id, battle_time) VALUES (1, 2, '2024-01-01 10:00:00')")
+    cursor.execute("INSERT INTO battles (winner_id, loser_id, battle_time) VALUES (2, 1, '2024-01-02 10:00:00')")
+    cursor.executemany('INSERT INTO battle_machines (battle_id, machine_id, position) VALUES (?, ?, ?)',
+                       [(1, 1, 0), (1, 3, 1), (2, 4, 0)])
+    cursor.execute("INSERT INTO monthly_contests (month, machine_id) VALUES ('2024-01', 4)")
+
+    assert db_utils.apply_migrations(conn) == len(db_utils.MIGRATIONS)
+
+    assert cursor.execute('SELECT id, name FROM machines ORDER BY id').fetchall() == \
+        [(1, 'Medieval Madness'), (2, 'Twilight Zone')]
+    assert cursor.execute('SELECT machine_id, tag_id FROM machine_tags ORDER BY 1, 2').fetchall() == \
+        [(1, 1), (1, 2), (2, 2)]
+    assert cursor.execute('SELECT battle_id, machine_id FROM battle_machines ORDER BY 1, 2').fetchall() == \
+        [(1, 1), (2, 2)]
+    assert cursor.execute('SELECT machine_id FROM monthly_contests').fetchall() == [(2,)]
+    # Temp tables of the migration are gone again
+    assert cursor.execute("SELECT COUNT(*) FROM sqlite_temp_master WHERE name = 'machine_merges'").fetchone() == (0,)
+
+def test_seeded_themes_do_not_follow_themes_py(base_database, monkeypatch):
+    _, conn = base_database
+    monkeypatch.setitem(themes.THEMES, 'Added later', [{'field': 'flippers', 'op': 'eq', 'value': 5}])
+    db_utils.apply_migrations(conn)
+
+    stored = dict(conn.execute('SELECT name, rules FROM themes').fetchall())
+    assert 'Added later' not in stored
+    assert len(stored) == len(db_utils.SEED_THEMES)
+    # Seeded themes end up on the typed attributes, like on databases migrated earlier
+    assert json.loads(stored['LCD Display Crew']) == themes.THEMES['LCD Display Crew']
@@ -1,168 +1,352 @@
 # themes.py
 
 """
-This file holds a dictionary of pinball "themes" keyed by their display name,
-with each value as a lambda function that tests whether a given machine
-matches that theme's criteria.
-
-Example usage in your main application:
-    from themes import THEMES
-    
-    selected_theme_name = random.choice(list(THEMES.keys()))
-    selected_filter = THEMES[selected_theme_name]
-    matching_machines = [m for m in machines if selected_filter(m)]
+This file holds the default pinball "themes" keyed by their display name.
+Each theme is a list of declarative rules that a machine must all satisfy:
+
+    {"field": "ramps", "op": "eq", "value": 0}
+    {"field": "release_year", "op": "between", "value": [1980, 1989]}
+    {"field": "display_kind", "op": "eq", "value": "LCD"}
+    {"tags_any": ["music", "rock"]}
+    {"tags_all": ["movie", "licensed"]}
+
+Themes are stored in the `themes` table and can be edited from the admin page.
+The table is seeded by a migration from a frozen copy of THEMES below
+(db_utils.SEED_THEMES), so changing THEMES does not change existing or new
+databases: add or edit themes on the admin page, or in a new migration. compile_theme turns a theme's rules into a
+parameterized SQL condition over `machines m`, so filtering runs in SQLite;
+columnar_catalog evaluates the same rules over the memory-mapped catalog.
+ThemeIndex keeps, per catalog and theme version, the themes that have at
+least 3 eligible active machines:
+
+    from themes import ThemeIndex
+
+    theme_index = ThemeIndex()
+    snapshot, viable_themes = theme_index.viable_themes(db)
+    selected_theme_name = random.choice(list(viable_themes))
+    machine_ids = random.sample(viable_themes[selected_theme_name], 3)
 """
 
+import math
+import threading
+from typing import Dict, List, Tuple
+
+# Fewest eligible machines a theme needs to be used for a battle
+MIN_THEME_MACHINES = 3
+
+# Machine attributes a rule can test, as SQL over `machines m`. Missing numbers
+# count as 0 and missing text as '', like the original Python filters did.
+THEME_FIELDS = {
+    "name": "COALESCE(m.name, '')",
+    "manufacturer": "COALESCE(m.manufacturer, '')",
+    "type": "COALESCE(m.type, '')",
+    "generation": "COALESCE(m.generation, '')",
+    "display_type": "COALESCE(m.display_type, '')",
+    "cabinet": "COALESCE(m.cabinet, '')",
+    "release_count": "COALESCE(m.release_count, '')",
+    "display_kind": "COALESCE(m.display_kind, '')",
+    # Typed columns parsed at ingest (db_utils.machine_attributes); NULL when unknown
+    "release_year": "m.release_year",
+    "release_count_num": "m.release_count_num",
+    "in_production": "COALESCE(m.in_production, 0)",
+    "value_low": "m.value_low",
+    "value_high": "m.value_high",
+    "players": "COALESCE(m.players, 0)",
+    "flippers": "COALESCE(m.flippers, 0)",
+    "ramps": "COALESCE(m.ramps, 0)",
+    "multiball": "COALESCE(m.multiball, 0)",
+}
+
+# Fields holding numbers; the rest are text
+NUMBER_FIELDS = {
+    "release_year", "release_count_num", "in_production", "value_low", "value_high",
+    "players", "flippers", "ramps", "multiball",
+}
+
+COMPARISONS = {"eq": "=", "ne": "!=", "lt": "<", "le": "<=", "gt": ">", "ge": ">="}
+
+# Tag rows of the machine being tested
+TAGS_OF_MACHINE = "FROM machine_tags mt JOIN tags t ON mt.tag_id = t.id WHERE mt.machine_id = m.id"
+
 THEMES = {
-    "70s Battle": lambda m:
-        1970 <= int(m["details"]["release_date"][-4:]) <= 1979,
+    "70s Battle": [
+        {"field": "release_year", "op": "between", "value": [1970, 1979]}],
 
-    "Games with No Ramps": lambda m:
-        m["details"]["ramps"] == 0,
+    "Games with No Ramps": [
+        {"field": "ramps", "op": "eq", "value": 0}],
 
-    "80s Classics": lambda m:
-        1980 <= int(m["details"]["release_date"][-4:]) <= 1989,
+    "80s Classics": [
+        {"field": "release_year", "op": "between", "value": [1980, 1989]}],
 
-    "90s Favorites": lambda m:
-        1990 <= int(m["details"]["release_date"][-4:]) <= 1999,
+    "90s Favorites": [
+        {"field": "release_year", "op": "between", "value": [1990, 1999]}],
 
-    "Zero Multiball Madness": lambda m:
-        m["details"]["multiball"] == 0,
+    "Zero Multiball Madness": [
+        {"field": "multiball", "op": "eq", "value": 0}],
 
-    "Six-Ball Mayhem (Multiball = 6)": lambda m:
-        m["details"]["multiball"] == 6,
+    "Six-Ball Mayhem (Multiball = 6)": [
+        {"field": "multiball", "op": "eq", "value": 6}],
 
-    "Dot Matrix Heroes": lambda m:
-        m["details"]["display_type"] == "Dot Matrix",
+    "Dot Matrix Heroes": [
+        {"field": "display_type", "op": "eq", "value": "Dot Matrix"}],
 
-    "LCD Display Crew": lambda m:
-        "LCD" in m["details"]["display_type"],
+    "LCD Display Crew": [
+        {"field": "display_kind", "op": "eq", "value": "LCD"}],
 
-    "Music & Rock": lambda m:
-        "music" in m["tags"] or "rock" in m["tags"],
+    "Music & Rock": [
+        {"tags_any": ["music", "rock"]}],
 
-    "Horror & Monsters": lambda m:
-        "horror" in m["tags"] or "monsters" in m["tags"],
+    "Horror & Monsters": [
+        {"tags_any": ["horror", "monsters"]}],
 
-    "Treasure & Adventure": lambda m:
-        "adventure" in m["tags"],
+    "Treasure & Adventure": [
+        {"tags_any": ["adventure"]}],
 
-    "Fantasy Realms": lambda m:
-        "fantasy" in m["tags"],
+    "Fantasy Realms": [
+        {"tags_any": ["fantasy"]}],
 
-    "Movie Licensed": lambda m:
-        "movie" in m["tags"] and "licensed" in m["tags"],
+    "Movie Licensed": [
+        {"tags_all": ["movie", "licensed"]}],
 
-    "Motor Sports": lambda m:
-        "racing" in m["tags"],
+    "Motor Sports": [
+        {"tags_any": ["racing"]}],
 
-    "Solid State Throwbacks": lambda m:
-        m["details"]["type"] == "Solid state"
-        and int(m["details"]["release_date"][-4:]) < 2000,
+    "Solid State Throwbacks": [
+        {"field": "type", "op": "eq", "value": "Solid state"},
+        {"field": "release_year", "op": "lt", "value": 2000}],
 
-    "EM Nostalgia": lambda m:
-        m["details"]["type"] == "Electro-mechanical",
+    "EM Nostalgia": [
+        {"field": "type", "op": "eq", "value": "Electro-mechanical"}],
 
-    "Futuristic Sci-Fi": lambda m:
-        "sci-fi" in m["tags"],
+    "Futuristic Sci-Fi": [
+        {"tags_any": ["sci-fi"]}],
 
-    "Four-Flipper Frenzy": lambda m:
-        m["details"]["flippers"] == 4,
+    "Four-Flipper Frenzy": [
+        {"field": "flippers", "op": "eq", "value": 4}],
 
-    "Ramps Galore (3 or More)": lambda m:
-        m["details"]["ramps"] >= 3,
+    "Ramps Galore (3 or More)": [
+        {"field": "ramps", "op": "ge", "value": 3}],
 
-    "Alphanumeric Retro": lambda m:
-        m["details"]["display_type"] == "Alphanumeric",
+    "Alphanumeric Retro": [
+        {"field": "display_type", "op": "eq", "value": "Alphanumeric"}],
 
-    "Three-Flipper Club": lambda m:
-        m["details"]["flippers"] == 3,
+    "Three-Flipper Club": [
+        {"field": "flippers", "op": "eq", "value": 3}],
 
-    "Active Sci-Fi Adventures": lambda m:
-        m["active"] and "sci-fi" in m["tags"],
+    # Only active machines are ever offered, so this is the same as Futuristic Sci-Fi
+    "Active Sci-Fi Adventures": [
+        {"tags_any": ["sci-fi"]}],
 
-    "Food Frenzy": lambda m:
-        any(tag in ["food", "BBQ", "festival"] for tag in m["tags"]),
+    "Food Frenzy": [
+        {"tags_any": ["food", "BBQ", "festival"]}],
 
-    "Outdoor Sports": lambda m:
-        any(tag in ["outdoor", "sports"] for tag in m["tags"]),
+    "Outdoor Sports": [
+        {"tags_any": ["outdoor", "sports"]}],
 
-    "Bally Originals": lambda m:
-        "Bally" in m["details"]["manufacturer"],
+    "Bally Originals": [
+        {"field": "manufacturer", "op": "contains", "value": "Bally"}],
 
-    "American Pinball All-Stars": lambda m:
-        m["details"]["manufacturer"] == "American Pinball",
+    "American Pinball All-Stars": [
+        {"field": "manufacturer", "op": "eq", "value": "American Pinball"}],
 
-    "Gottlieb Gems": lambda m:
-        "Gottlieb" in m["details"]["manufacturer"],
+    "Gottlieb Gems": [
+        {"field": "manufacturer", "op": "contains", "value": "Gottlieb"}],
 
-    "Williams System 11 Showcase": lambda m:
-        "Williams System 11" in m["details"]["generation"],
+    "Williams System 11 Showcase": [
+        {"field": "generation", "op": "contains", "value": "Williams System 11"}],
 
-    "TV Series Ties": lambda m:
-        "television" in m["tags"],
+    "TV Series Ties": [
+        {"tags_any": ["television"]}],
 
-    "Small Release Runs (≤ 500 units)": lambda m:
-        isinstance(m["details"]["release_count"], int)
-        and m["details"]["release_count"] <= 500,
+    "Small Release Runs (≤ 500 units)": [
+        {"field": "release_count_num", "op": "le", "value": 500}],
 
-    "Digital Old-School (Display = \"Digital\")": lambda m:
-        m["details"]["display_type"] == "Digital",
+    "Digital Old-School (Display = \"Digital\")": [
+        {"field": "display_type", "op": "eq", "value": "Digital"}],
 
-    "Mechanical Reels Throwback": lambda m:
-        m["details"]["display_type"] == "Mechanical Reels",
+    "Mechanical Reels Throwback": [
+        {"field": "display_type", "op": "eq", "value": "Mechanical Reels"}],
 
-    "5-Ball (or More) Multiball": lambda m:
-        m["details"]["multiball"] >= 5,
+    "5-Ball (or More) Multiball": [
+        {"field": "multiball", "op": "ge", "value": 5}],
 
-    "Sky High Adventures": lambda m:
-        any(tag in ["aviation", "skydiving", "hang gliding"] for tag in m["tags"]),
+    "Sky High Adventures": [
+        {"tags_any": ["aviation", "skydiving", "hang gliding"]}],
 
-    "Space Explorers": lambda m:
-        "space" in m["tags"],
+    "Space Explorers": [
+        {"tags_any": ["space"]}],
 
-    "Flipper Overload (4 or More)": lambda m:
-        m["details"]["flippers"] >= 4,
+    "Flipper Overload (4 or More)": [
+        {"field": "flippers", "op": "ge", "value": 4}],
 
-    "Movie Marathon": lambda m:
-        "movie" in m["tags"],
+    "Movie Marathon": [
+        {"tags_any": ["movie"]}],
 
-    "Under 2,000 Release Count": lambda m:
-        isinstance(m["details"]["release_count"], int)
-        and m["details"]["release_count"] < 2000,
+    "Under 2,000 Release Count": [
+        {"field": "release_count_num", "op": "lt", "value": 2000}],
 
-    "Widebodies": lambda m:
-        "Wide" in m["details"]["cabinet"],
+    "Widebodies": [
+        {"field": "cabinet", "op": "contains", "value": "Wide"}],
 
-    "BBQ & Brew": lambda m:
-        any(tag in ["BBQ", "food", "beer", "festival"] for tag in m["tags"]),
+    "BBQ & Brew": [
+        {"tags_any": ["BBQ", "food", "beer", "festival"]}],
 
-    "Swords & Sorcery": lambda m:
-        any(tag in ["fantasy", "Norse mythology", "mythology"] for tag in m["tags"]),
+    "Swords & Sorcery": [
+        {"tags_any": ["fantasy", "Norse mythology", "mythology"]}],
 
-    "Comedy & Humor": lambda m:
-        "comedy" in m["tags"],
+    "Comedy & Humor": [
+        {"tags_any": ["comedy"]}],
 
-    "Mythology Matters": lambda m:
-        "mythology" in m["tags"],
+    "Mythology Matters": [
+        {"tags_any": ["mythology"]}],
 
-    "Pinball Giants (Over 10,000 Made)": lambda m:
-        isinstance(m["details"]["release_count"], int)
-        and m["details"]["release_count"] > 10000,
+    "Pinball Giants (Over 10,000 Made)": [
+        {"field": "release_count_num", "op": "gt", "value": 10000}],
 
-    "Still Rolling Off the Line (In Production)": lambda m:
-        m["details"]["release_count"] == "In production",
+    "Still Rolling Off the Line (In Production)": [
+        {"field": "in_production", "op": "eq", "value": 1}],
 
-    "Solid State Stern": lambda m:
-        "Stern" in m["details"]["manufacturer"]
-        and m["details"]["type"] == "Solid state",
+    "Solid State Stern": [
+        {"field": "manufacturer", "op": "contains", "value": "Stern"},
+        {"field": "type", "op": "eq", "value": "Solid state"}],
 
-    "Late 90s Hits (1995–1999)": lambda m:
-        1995 <= int(m["details"]["release_date"][-4:]) <= 1999,
+    "Late 90s Hits (1995–1999)": [
+        {"field": "release_year", "op": "between", "value": [1995, 1999]}],
 
-    "Sports Galore": lambda m:
-        "sports" in m["tags"],
+    "Sports Galore": [
+        {"tags_any": ["sports"]}],
 
-    "Less Than 3 Flippers": lambda m:
-        m["details"]["flippers"] < 3
+    "Less Than 3 Flippers": [
+        {"field": "flippers", "op": "lt", "value": 3}],
 }
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+def _field_value(field: str, op: str, value):
+    """
+    A comparison value converted to the field's type, so SQLite and the columnar
+    filter (which never converts between numbers and text) compare the same way
+    """
+    # JSON numbers (or true/false) and strings only; null would never match anything
+    if not (_is_number(value) or isinstance(value, (bool, str))):
+        raise ValueError(f"{op} needs a number or text value, not {value!r}")
+    if isinstance(value, bool):
+        value = int(value)
+    if field in NUMBER_FIELDS:
+        if isinstance(value, str):
+            try:
+                value = float(value.strip())
+            except ValueError:
+                raise ValueError(f"{field} holds numbers; {value!r} is not one")
+            if not math.isfinite(value):
+                raise ValueError(f"{field} holds numbers; {value!r} is not one")
+            if value.is_integer():
+                value = int(value)
+        return value
+    return value if isinstance(value, str) else str(value)
+
+def normalize_rule(rule: Dict) -> Dict:
+    """Validated copy of one rule with its values converted to the field's type; raises ValueError"""
+    if not isinstance(rule, dict):
+        raise ValueError(f"Rule must be an object: {rule!r}")
+
+    for key in ("tags_any", "tags_all"):
+        if key in rule:
+            tags = rule[key]
+            if not tags or not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+                raise ValueError(f"{key} needs a non-empty list of tag names")
+            return {key: list(tags)}
+
+    field, op, value = rule.get("field"), rule.get("op"), rule.get("value")
+    if field not in THEME_FIELDS:
+        raise ValueError(f"Unknown field {field!r}; expected one of {', '.join(THEME_FIELDS)}")
+
+    if op in COMPARISONS:
+        value = _field_value(field, op, value)
+    elif op == "between":
+        if not isinstance(value, list) or len(value) != 2:
+            raise ValueError("between needs a [low, high] value")
+        low, high = (_field_value(field, op, bound) for bound in value)
+        if isinstance(low, str) != isinstance(high, str):
+            raise ValueError(f"between needs two numbers or two texts, not {value!r}")
+        if low > high:
+            raise ValueError(f"between needs low <= high, not {value!r}")
+        value = [low, high]
+    elif op == "contains":
+        if not isinstance(value, str):
+            raise ValueError("contains needs a text value")
+    else:
+        raise ValueError(f"Unknown op {op!r}; expected one of {', '.join([*COMPARISONS, 'between', 'contains'])}")
+    return {"field": field, "op": op, "value": value}
+
+def normalize_theme(rules: List[Dict]) -> List[Dict]:
+    """normalize_rule for every rule of a theme; a theme needs at least one"""
+    if not isinstance(rules, list) or not rules:
+        raise ValueError("A theme needs a non-empty list of rules")
+    return [normalize_rule(rule) for rule in rules]
+
+def compile_rule(rule: Dict) -> Tuple[str, List]:
+    """SQL condition and parameters for one rule; raises ValueError if it is malformed"""
+    rule = normalize_rule(rule)
+    for key in ("tags_any", "tags_all"):
+        if key in rule:
+            tags = rule[key]
+            placeholders = ", ".join("?" * len(tags))
+            if key == "tags_any":
+                return f"EXISTS (SELECT 1 {TAGS_OF_MACHINE} AND t.name IN ({placeholders}))", list(tags)
+            return (f"(SELECT COUNT(DISTINCT t.name) {TAGS_OF_MACHINE} AND t.name IN ({placeholders})) = ?",
+                    list(tags) + [len(set(tags))])
+
+    column, op, value = THEME_FIELDS[rule["field"]], rule["op"], rule["value"]
+    if op in COMPARISONS:
+        return f"{column} {COMPARISONS[op]} ?", [value]
+    if op == "between":
+        return f"{column} BETWEEN ? AND ?", list(value)
+    # instr is case-sensitive, like Python's `in`
+    return f"instr({column}, ?) > 0", [value]
+
+def compile_theme(rules: List[Dict]) -> Tuple[str, List]:
+    """
+    Compile a theme's rules into one SQL condition over `machines m` (all rules
+    must hold) plus its parameters. Raises ValueError for malformed rules.
+    """
+    conditions = []
+    params = []
+    for rule in normalize_theme(rules):
+        condition, rule_params = compile_rule(rule)
+        conditions.append(f"({condition})")
+        params.extend(rule_params)
+    return " AND ".join(conditions), params
+
+class ThemeIndex:
+    """Machine ids eligible for each viable theme, rebuilt when machines or themes change"""
+    def __init__(self):
+        self._key = None
+        self._snapshot = None
+        self._viable: Dict[str, Tuple[int, ...]] = {}
+        self._lock = threading.Lock()
+
+    def viable_themes(self, db):
+        """
+        Return (catalog snapshot, {theme name: ids of its active machines}) for
+        themes with at least MIN_THEME_MACHINES machines. Reads the database
+        and the catalog file when stale, so call it off the event loop.
+        """
+        snapshot = db.catalog_snapshot()
+        key = (snapshot.version, db.versions.get('themes'))
+        with self._lock:
+            if self._key != key:
+                viable = {}
+                for theme in db.load_themes():
+                    try:
+                        matches = db.filter_machines(theme['rules'])
+                    except Exception as e:
+                        # One broken theme must not take the others down with it
+                        print(f"Skipping theme {theme['name']!r}: {e}")
+                        continue
+                    machine_ids = [machine_id for machine_id in matches if machine_id in snapshot.by_id]
+                    if len(machine_ids) >= MIN_THEME_MACHINES:
+                        viable[theme['name']] = tuple(machine_ids)
+                self._key, self._snapshot, self._viable = key, snapshot, viable
+            return self._snapshot, self._viable